@@ -1,6 +1,9 @@
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework import authentication
 from rest_framework import exceptions
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
 
 class TokenAuthentication(JWTAuthentication):
     def authenticate(self, request):
@@ -12,3 +15,32 @@ class TokenAuthentication(JWTAuthentication):
             raise exceptions.AuthenticationFailed('Invalid token')
 
         return auth
+
+    def get_user(self, validated_token):
+        """
+        Get the user of the token from the cache of the process, so authenticated requests do not read the database
+        every time. Missing and inactive users are never cached
+        """
+        timeout = settings.SONGSEARCH_AUTH_USER_CACHE_TIMEOUT
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if not timeout or user_id is None:
+            return super().get_user(validated_token)
+
+        cache_key = user_cache_key(user_id)
+        user = cache.get(cache_key)
+        if user is None:
+            user = super().get_user(validated_token)
+            cache.set(cache_key, user, timeout=timeout)
+        return user
+
+
+def user_cache_key(user_id):
+    return f'auth_user:{user_id}'
+
+
+def forget_cached_user(sender, instance, **kwargs):
+    """
+    Drop the cached user when it is saved or deleted, so changes such as deactivating it apply right away in this
+    process. The other processes pick them up when their cached user expires
+    """
+    cache.delete(user_cache_key(getattr(instance, api_settings.USER_ID_FIELD)))
@@ -0,0 +1,192 @@
+"Thread-safe in-memory cache backend with a byte budget, storing the values compressed."
+import pickle
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# Approximate bytes taken by each entry besides its value and key: the tuple, the dict slot and the numbers
+ENTRY_OVERHEAD = 200
+
+
+class CacheStore:
+    """
+    Entries of a named cache, shared by the backend instances of every thread. Entries are kept from the least to the
+    most recently used, key -> (expires_at, compressed, data, raw_size)
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.bytes = 0  # Bytes of the entries, as counted against the budget
+        self.raw_bytes = 0  # Bytes of the pickled values before compression
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+# Stores of the caches by name, so there can be several named caches
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class CompressedLocMemCache(BaseCache):
+    """
+    Like LocMemCache, but the values are pickled and compressed with zlib when they are larger than
+    COMPRESS_MIN_BYTES, and the least recently used entries are evicted to keep the entries under MAX_BYTES instead
+    of under a number of entries. The memory it takes is predictable whatever the size of the values
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._max_bytes = int(options.get('MAX_BYTES', 64 * 1024 * 1024))
+        self._compress_min_bytes = int(options.get('COMPRESS_MIN_BYTES', 256))
+        self._compression_level = int(options.get('COMPRESSION_LEVEL', 1))
+        with _stores_lock:
+            self._store = _stores.setdefault(name, CacheStore())
+
+    def _encode(self, value):
+        data = pickle.dumps(value, self.pickle_protocol)
+        raw_size = len(data)
+        if raw_size < self._compress_min_bytes:
+            return False, data, raw_size
+        compressed = zlib.compress(data, self._compression_level)
+        if len(compressed) >= raw_size:
+            return False, data, raw_size
+        return True, compressed, raw_size
+
+    @staticmethod
+    def _decode(compressed, data):
+        return pickle.loads(zlib.decompress(data) if compressed else data)
+
+    @staticmethod
+    def _entry_size(key, data):
+        return len(key) + len(data) + ENTRY_OVERHEAD
+
+    def _live_entry(self, key):
+        """
+        Return the entry of the key and mark it as the most recently used, or None and remove it when it expired
+        """
+        entry = self._store.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= time.time():
+            self._delete(key)
+            return None
+        self._store.entries.move_to_end(key)
+        return entry
+
+    def _set(self, key, encoded, timeout):
+        compressed, data, raw_size = encoded
+        size = self._entry_size(key, data)
+        self._delete(key)
+        if size > self._max_bytes:
+            return False  # Would evict every other entry
+        store = self._store
+        while store.bytes + size > self._max_bytes:
+            evicted_key, evicted = store.entries.popitem(last=False)
+            store.bytes -= self._entry_size(evicted_key, evicted[2])
+            store.raw_bytes -= evicted[3]
+            store.evictions += 1
+        store.entries[key] = (self.get_backend_timeout(timeout), compressed, data, raw_size)
+        store.bytes += size
+        store.raw_bytes += raw_size
+        return True
+
+    def _delete(self, key):
+        store = self._store
+        entry = store.entries.pop(key, None)
+        if entry is None:
+            return False
+        store.bytes -= self._entry_size(key, entry[2])
+        store.raw_bytes -= entry[3]
+        return True
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        encoded = self._encode(value)
+        with self._store.lock:
+            if self._live_entry(key) is not None:
+                return False
+            return self._set(key, encoded, timeout)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        store = self._store
+        with store.lock:
+            entry = self._live_entry(key)
+            if entry is None:
+                store.misses += 1
+                return default
+            store.hits += 1
+        return self._decode(entry[1], entry[2])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        encoded = self._encode(value)
+        with self._store.lock:
+            self._set(key, encoded, timeout)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._store.lock:
+            entry = self._live_entry(key)
+            if entry is None:
+                return False
+            self._store.entries[key] = (self.get_backend_timeout(timeout), *entry[1:])
+            return True
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._store.lock:
+            entry = self._live_entry(key)
+            if entry is None:
+                raise ValueError("Key '%s' not found" % key)
+            new_value = self._decode(entry[1], entry[2]) + delta
+            # Keeps the expiration of the key
+            timeout = None if entry[0] is None else max(entry[0] - time.time(), 0.001)
+            self._set(key, self._encode(new_value), timeout)
+        return new_value
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._store.lock:
+            return self._live_entry(key) is not None
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._store.lock:
+            return self._delete(key)
+
+    def clear(self):
+        store = self._store
+        with store.lock:
+            store.entries.clear()
+            store.bytes = store.raw_bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Entries and bytes stored, the budget, and the hits, misses and evictions since the process started
+        """
+        store = self._store
+        with store.lock:
+            return {
+                'entries': len(store.entries),
+                'bytes': store.bytes,
+                'raw_bytes': store.raw_bytes,
+                'max_bytes': self._max_bytes,
+                'hits': store.hits,
+                'misses': store.misses,
+                'evictions': store.evictions,
+            }
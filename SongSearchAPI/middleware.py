@@ -0,0 +1,104 @@
+import asyncio
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.http import HttpResponse
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework import exceptions
+from songsearch.metrics import RequestMetrics, record_time, request_metrics, working_for_request
+from songsearch.profiler import SamplingProfiler
+from .authentication import TokenAuthentication
+
+
+class LeanPathsMixin:
+    """
+    Skips the middleware for the paths under SONGSEARCH_LEAN_PATHS. The search API authenticates every request with
+    its token, so it needs neither sessions, nor the session user, nor messages
+    """
+
+    def __call__(self, request):
+        if request.path_info.startswith(settings.SONGSEARCH_LEAN_PATHS):
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class LeanSessionMiddleware(LeanPathsMixin, SessionMiddleware):
+    pass
+
+
+class LeanAuthenticationMiddleware(LeanPathsMixin, AuthenticationMiddleware):
+    pass
+
+
+class LeanMessageMiddleware(LeanPathsMixin, MessageMiddleware):
+    pass
+
+
+@sync_and_async_middleware
+def server_timing_middleware(get_response):
+    """
+    Collects the timings and counts of every request and returns them in the Server-Timing header. With
+    SONGSEARCH_PROFILER_ENABLED, the successful requests of staff users with profile=1 in the query string are
+    answered with the stacks sampled while they were served instead
+    """
+
+    def start(profile):
+        metrics = RequestMetrics()
+        profiler = None
+        if profile:
+            profiler = SamplingProfiler(settings.SONGSEARCH_PROFILER_INTERVAL, metrics.threads)
+            profiler.start()
+        return metrics, profiler, time.perf_counter()
+
+    def finish(response, metrics, profiler, start_time):
+        elapsed = time.perf_counter() - start_time
+        record_time('total', elapsed)  # Only to the metrics of the process, the request context is gone
+        metrics.add_time('total', elapsed)
+        if profiler is not None:
+            profiler.stop()
+            if response.status_code < 400:  # Errors are answered as they are
+                response = HttpResponse(profiler.folded_stacks(), content_type='text/plain; charset=utf-8')
+        response['Server-Timing'] = metrics.server_timing()
+        return response
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            profile = profile_requested(request) and await sync_to_async(can_profile)(request)
+            metrics, profiler, start_time = start(profile)
+            token = request_metrics.set(metrics)
+            try:
+                with working_for_request():
+                    response = await get_response(request)
+            finally:
+                request_metrics.reset(token)
+            return finish(response, metrics, profiler, start_time)
+    else:
+        def middleware(request):
+            metrics, profiler, start_time = start(profile_requested(request) and can_profile(request))
+            token = request_metrics.set(metrics)
+            try:
+                with working_for_request():
+                    response = get_response(request)
+            finally:
+                request_metrics.reset(token)  # The thread serves other requests next
+            return finish(response, metrics, profiler, start_time)
+    return middleware
+
+
+def profile_requested(request) -> bool:
+    return settings.SONGSEARCH_PROFILER_ENABLED and request.GET.get('profile', '').lower() in ('1', 'true')
+
+
+def can_profile(request) -> bool:
+    """
+    Whether the access token of the request belongs to a staff user. The stacks reveal the internals of the API, so
+    they are never shown to other users
+    """
+    try:
+        user, _ = TokenAuthentication().authenticate(request)
+    except exceptions.APIException:
+        return False
+    return user.is_active and user.is_staff
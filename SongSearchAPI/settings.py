@@ -27,9 +27,9 @@ load_dotenv(dotenv_path=env_path)
 SECRET_KEY = os.getenv("SECRET_KEY")
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.getenv("DEBUG", "False") == "True"
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS", "localhost,127.0.0.1").split(",")
 
 
 # Application definition
@@ -48,12 +48,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'SongSearchAPI.middleware.server_timing_middleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',  # Serves the static files of the admin and the docs without DEBUG
+    'SongSearchAPI.middleware.LeanSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
+    'SongSearchAPI.middleware.LeanAuthenticationMiddleware',
+    'SongSearchAPI.middleware.LeanMessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -84,7 +86,7 @@ WSGI_APPLICATION = 'SongSearchAPI.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.getenv("SONGSEARCH_DB_PATH", BASE_DIR / 'db.sqlite3'),
     }
 }
 
@@ -107,11 +109,22 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Bytes of compressed entries each process keeps in the cache, the least recently used are evicted past them
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'SongSearchAPI.cache.CompressedLocMemCache',
         'LOCATION': 'unique-snowflake',
-    }
+        'OPTIONS': {
+            'MAX_BYTES': int(os.getenv("SONGSEARCH_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+        },
+    },
+    # Shared by every worker and process, for the provider access tokens. A table of the database by default, created
+    # with the createcachetable command, or e.g. Memcached with django.core.cache.backends.memcached.PyMemcacheCache.
+    # Without the table, each process requests its own tokens
+    'shared': {
+        'BACKEND': os.getenv("SONGSEARCH_SHARED_CACHE_BACKEND", 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.getenv("SONGSEARCH_SHARED_CACHE_LOCATION", 'songsearch_shared_cache'),
+    },
 }
 
 REST_FRAMEWORK = {
@@ -137,8 +150,152 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/4.2/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'  # Filled by collectstatic when the image is built
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Song search
+
+# Maximum number of provider calls running at the same time, shared by all requests
+SONGSEARCH_MAX_WORKERS = int(os.getenv("SONGSEARCH_MAX_WORKERS", 16))
+
+# Seconds a search waits for the providers before answering with the ones that finished
+SONGSEARCH_SEARCH_DEADLINE = float(os.getenv("SONGSEARCH_SEARCH_DEADLINE", 5))
+
+# Seconds the Spotify artist genres are cached, separately from the search results
+SONGSEARCH_ARTIST_GENRES_TIMEOUT = int(os.getenv("SONGSEARCH_ARTIST_GENRES_TIMEOUT", 60 * 60 * 24 * 7))
+
+# Maximum number of Genius song detail requests running at the same time
+SONGSEARCH_GENIUS_DETAIL_WORKERS = int(os.getenv("SONGSEARCH_GENIUS_DETAIL_WORKERS", 8))
+
+# Seconds the album of each Genius song is cached
+SONGSEARCH_GENIUS_SONG_TIMEOUT = int(os.getenv("SONGSEARCH_GENIUS_SONG_TIMEOUT", 60 * 60 * 24 * 7))
+
+# Seconds before expiring that the provider access tokens are refreshed in the background
+SONGSEARCH_TOKEN_REFRESH_MARGIN = int(os.getenv("SONGSEARCH_TOKEN_REFRESH_MARGIN", 60))
+
+# Connections kept open to each provider, should be at least the number of provider calls that can run at once
+SONGSEARCH_HTTP_POOL_SIZE = int(os.getenv("SONGSEARCH_HTTP_POOL_SIZE", 24))
+
+# Seconds to wait for a provider to accept the connection and to send data
+SONGSEARCH_HTTP_CONNECT_TIMEOUT = float(os.getenv("SONGSEARCH_HTTP_CONNECT_TIMEOUT", 3.05))
+SONGSEARCH_HTTP_READ_TIMEOUT = float(os.getenv("SONGSEARCH_HTTP_READ_TIMEOUT", 5))
+
+# Retries of the provider GET requests that fail to connect or answer with a 5xx status
+SONGSEARCH_HTTP_RETRIES = int(os.getenv("SONGSEARCH_HTTP_RETRIES", 2))
+SONGSEARCH_HTTP_RETRY_BACKOFF = float(os.getenv("SONGSEARCH_HTTP_RETRY_BACKOFF", 0.2))
+
+# Seconds the results of each provider are fresh in the cache, per search term
+SONGSEARCH_SEARCH_CACHE_TIMEOUT = int(os.getenv("SONGSEARCH_SEARCH_CACHE_TIMEOUT", 60 * 60 * 6))
+
+# Entries kept in the in-process cache placed in front of the Django cache, which saves decoding them on every hit.
+# Disabled by default, since the default Django cache is already in the process, within SONGSEARCH_CACHE_MAX_BYTES,
+# while these entries are not compressed nor counted in it. Worth it with a cache reached through the network
+SONGSEARCH_LOCAL_CACHE_SIZE = int(os.getenv("SONGSEARCH_LOCAL_CACHE_SIZE", 0))
+
+# Seconds the provider results are still served after SONGSEARCH_SEARCH_CACHE_TIMEOUT while they are refreshed
+SONGSEARCH_SEARCH_CACHE_STALE_TIMEOUT = int(os.getenv("SONGSEARCH_SEARCH_CACHE_STALE_TIMEOUT", 60 * 60 * 6))
+
+# Seconds the songs stored in the local catalog can answer searches without asking the providers, 0 disables it
+SONGSEARCH_CATALOG_MAX_AGE = int(os.getenv("SONGSEARCH_CATALOG_MAX_AGE", 60 * 60 * 24))
+
+# Fresh full-text matches a provider needs in the catalog to answer a term it was never asked for, 0 disables it
+SONGSEARCH_CATALOG_MIN_MATCHES = int(os.getenv("SONGSEARCH_CATALOG_MIN_MATCHES", 10))
+
+# Connections the asynchronous search endpoint can keep open to the providers at the same time
+SONGSEARCH_ASYNC_MAX_CONNECTIONS = int(os.getenv("SONGSEARCH_ASYNC_MAX_CONNECTIONS", 200))
+
+# Maximum number of searches in a batch request, provider fetches of a batch in flight at the same time
+# and seconds a batch waits for the providers
+SONGSEARCH_BATCH_MAX_SEARCHES = int(os.getenv("SONGSEARCH_BATCH_MAX_SEARCHES", 100))
+SONGSEARCH_BATCH_CONCURRENCY = int(os.getenv("SONGSEARCH_BATCH_CONCURRENCY", 8))
+SONGSEARCH_BATCH_DEADLINE = float(os.getenv("SONGSEARCH_BATCH_DEADLINE", 30))
+
+# Consecutive failed calls that open the circuit breaker of a provider, seconds the provider is then skipped
+# and fetches let through afterwards to probe whether it recovered
+SONGSEARCH_BREAKER_FAILURES = int(os.getenv("SONGSEARCH_BREAKER_FAILURES", 5))
+SONGSEARCH_BREAKER_COOLDOWN = float(os.getenv("SONGSEARCH_BREAKER_COOLDOWN", 30))
+SONGSEARCH_BREAKER_PROBES = int(os.getenv("SONGSEARCH_BREAKER_PROBES", 2))
+
+# Latency samples kept per provider. The read timeout follows their p99 times SONGSEARCH_ADAPTIVE_TIMEOUT_FACTOR,
+# between SONGSEARCH_ADAPTIVE_TIMEOUT_MIN and SONGSEARCH_HTTP_READ_TIMEOUT
+SONGSEARCH_HEALTH_WINDOW = int(os.getenv("SONGSEARCH_HEALTH_WINDOW", 200))
+SONGSEARCH_ADAPTIVE_TIMEOUT_FACTOR = float(os.getenv("SONGSEARCH_ADAPTIVE_TIMEOUT_FACTOR", 2))
+SONGSEARCH_ADAPTIVE_TIMEOUT_MIN = float(os.getenv("SONGSEARCH_ADAPTIVE_TIMEOUT_MIN", 0.5))
+
+# Send a second search request to a provider when the first one takes longer than its p95 latency
+SONGSEARCH_HEDGE_REQUESTS = os.getenv("SONGSEARCH_HEDGE_REQUESTS", "False") == "True"
+
+# Calls allowed to each provider per window of seconds, shared by every worker and process through the database.
+# Up to SONGSEARCH_RATE_LIMIT_BURST of them can be made at once, the rest are spread over the window
+SONGSEARCH_RATE_LIMITS = {
+    'Spotify': (int(os.getenv("SONGSEARCH_SPOTIFY_RATE_LIMIT", 150)), 30),
+    'iTunes': (int(os.getenv("SONGSEARCH_ITUNES_RATE_LIMIT", 20)), 60),
+    'Genius': (int(os.getenv("SONGSEARCH_GENIUS_RATE_LIMIT", 300)), 60),
+}
+SONGSEARCH_RATE_LIMIT_BURST = float(os.getenv("SONGSEARCH_RATE_LIMIT_BURST", 0.1))
+
+# Share of the tokens of each bucket that the background refreshes can use, and seconds a search waits for a token
+# before skipping a provider whose quota is used up
+SONGSEARCH_RATE_LIMIT_BACKGROUND_SHARE = float(os.getenv("SONGSEARCH_RATE_LIMIT_BACKGROUND_SHARE", 0.5))
+SONGSEARCH_RATE_LIMIT_MAX_WAIT = float(os.getenv("SONGSEARCH_RATE_LIMIT_MAX_WAIT", 1))
+
+# Paths served without sessions, session users or messages, since their requests authenticate with a token
+SONGSEARCH_LEAN_PATHS = ('/api/song/', '/api/metrics/')
+
+# Seconds the user of a token is cached instead of read from the database on every request, 0 disables it. The
+# cache is local to each process: saving or deleting a user drops it only in the process that did it, the others
+# keep the previous user, e.g. still active, for up to these seconds. So do changes made with QuerySet.update()
+SONGSEARCH_AUTH_USER_CACHE_TIMEOUT = int(os.getenv("SONGSEARCH_AUTH_USER_CACHE_TIMEOUT", 60))
+
+# Base URLs of the provider APIs, which can point to the fake providers of the benchmarks
+SONGSEARCH_SPOTIFY_ACCOUNTS_URL = os.getenv("SONGSEARCH_SPOTIFY_ACCOUNTS_URL", "https://accounts.spotify.com")
+SONGSEARCH_SPOTIFY_API_URL = os.getenv("SONGSEARCH_SPOTIFY_API_URL", "https://api.spotify.com")
+SONGSEARCH_ITUNES_URL = os.getenv("SONGSEARCH_ITUNES_URL", "https://itunes.apple.com")
+SONGSEARCH_GENIUS_URL = os.getenv("SONGSEARCH_GENIUS_URL", "https://api.genius.com")
+
+# Answer the successful requests of staff users with profile=1 in the query string with the stacks sampled every
+# SONGSEARCH_PROFILER_INTERVAL seconds while they were served, in the folded format of flame graph tools
+SONGSEARCH_PROFILER_ENABLED = os.getenv("SONGSEARCH_PROFILER_ENABLED", "False") == "True"
+SONGSEARCH_PROFILER_INTERVAL = float(os.getenv("SONGSEARCH_PROFILER_INTERVAL", 0.005))
+
+# Clients allowed to read the metrics: the addresses in SONGSEARCH_METRICS_ALLOWED_IPS, and the requests with the
+# bearer token SONGSEARCH_METRICS_TOKEN when it is set
+SONGSEARCH_METRICS_ALLOWED_IPS = os.getenv("SONGSEARCH_METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",")
+SONGSEARCH_METRICS_TOKEN = os.getenv("SONGSEARCH_METRICS_TOKEN", "")
+
+# Seconds the API docs and their schema are cached, instead of being generated on every request
+SONGSEARCH_DOCS_CACHE_TIMEOUT = int(os.getenv("SONGSEARCH_DOCS_CACHE_TIMEOUT", 60 * 60 * 24))
+
+# Songs of each provider that a filtered search tries to find. Providers that can not apply the filters themselves
+# are asked for pages SONGSEARCH_FILTER_OVERFETCH_GROWTH times bigger while fewer of their songs match
+SONGSEARCH_FILTER_QUOTA = int(os.getenv("SONGSEARCH_FILTER_QUOTA", 10))
+SONGSEARCH_FILTER_OVERFETCH_GROWTH = int(os.getenv("SONGSEARCH_FILTER_OVERFETCH_GROWTH", 5))
+
+# Song names and artists kept by the suggestion index of each process, keys read per suggestion and songs of the
+# catalog the index starts from
+SONGSEARCH_SUGGEST_MAX_ENTRIES = int(os.getenv("SONGSEARCH_SUGGEST_MAX_ENTRIES", 100000))
+SONGSEARCH_SUGGEST_MAX_SCANNED = int(os.getenv("SONGSEARCH_SUGGEST_MAX_SCANNED", 500))
+SONGSEARCH_SUGGEST_CATALOG_SONGS = int(os.getenv("SONGSEARCH_SUGGEST_CATALOG_SONGS", 20000))
+
+# Seconds the search counts are kept in memory before they are added to the database
+SONGSEARCH_SEARCH_STATS_FLUSH_INTERVAL = int(os.getenv("SONGSEARCH_SEARCH_STATS_FLUSH_INTERVAL", 60))
+
+# Pre-warming of the SONGSEARCH_PREWARM_TOP most searched terms of the days in the last SONGSEARCH_PREWARM_WINDOW
+# seconds, by the prewarm_cache command and, when SONGSEARCH_PREWARM_SCHEDULER is enabled, by every Gunicorn worker
+# when it starts and then every SONGSEARCH_PREWARM_INTERVAL seconds. Songs that stop being fresh within
+# SONGSEARCH_PREWARM_REFRESH_AHEAD seconds are refreshed, with at most SONGSEARCH_PREWARM_RATE provider fetches per
+# second
+SONGSEARCH_PREWARM_TOP = int(os.getenv("SONGSEARCH_PREWARM_TOP", 100))
+SONGSEARCH_PREWARM_WINDOW = int(os.getenv("SONGSEARCH_PREWARM_WINDOW", 60 * 60 * 24 * 7))
+SONGSEARCH_PREWARM_SCHEDULER = os.getenv("SONGSEARCH_PREWARM_SCHEDULER", "False") == "True"
+SONGSEARCH_PREWARM_INTERVAL = int(os.getenv("SONGSEARCH_PREWARM_INTERVAL", 60 * 10))
+SONGSEARCH_PREWARM_REFRESH_AHEAD = int(os.getenv("SONGSEARCH_PREWARM_REFRESH_AHEAD", 60 * 60))
+SONGSEARCH_PREWARM_RATE = float(os.getenv("SONGSEARCH_PREWARM_RATE", 1))
+
+# Let shared caches such as a CDN store the search responses, which are the same for every user. Only for CDNs that
+# check the access tokens themselves, otherwise they would serve the responses without authentication
+SONGSEARCH_HTTP_CACHE_SHARED = os.getenv("SONGSEARCH_HTTP_CACHE_SHARED", "False") == "True"
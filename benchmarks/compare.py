@@ -0,0 +1,55 @@
+"""
+Compare two reports of benchmarks/load.py, e.g. of the main branch and of a change:
+
+    python benchmarks/compare.py main.json change.json
+
+Prints the change of the throughput and latency percentiles of every scenario and concurrency level in both,
+and exits with 1 when a p95 grew more than --threshold percent.
+"""
+import argparse
+import json
+import sys
+
+METRICS = (('throughput_rps', 'req/s'), ('p50', 'p50 ms'), ('p95', 'p95 ms'), ('p99', 'p99 ms'))
+
+
+def load_results(path):
+    with open(path) as report:
+        return {(result['scenario'], result['concurrency']): result for result in json.load(report)['results']}
+
+
+def metric(result, name):
+    return result[name] if name == 'throughput_rps' else result['latency_ms'][name]
+
+
+def change(base, new):
+    return (new - base) / base * 100 if base else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10, help='Percent of p95 growth counted as a regression')
+    args = parser.parse_args()
+
+    base_results = load_results(args.base)
+    new_results = load_results(args.new)
+    regressions = []
+    for key in sorted(base_results.keys() & new_results.keys()):
+        base, new = base_results[key], new_results[key]
+        columns = [f'{key[0]:>8} x{key[1]:<4}']
+        for name, label in METRICS:
+            columns.append(f'{label} {metric(base, name)} -> {metric(new, name)} '
+                           f'({change(metric(base, name), metric(new, name)):+.1f}%)')
+        print('  '.join(columns))
+        if change(metric(base, 'p95'), metric(new, 'p95')) > args.threshold:
+            regressions.append(key)
+
+    for scenario, concurrency in regressions:
+        print(f'Regression: p95 of {scenario} at concurrency {concurrency} grew more than {args.threshold}%')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""
+Local stand-in for the Spotify, iTunes and Genius APIs used by the benchmarks.
+
+It replays the responses recorded in benchmarks/recordings for every search, with ids derived from the search term
+so each term needs its own artist and song detail requests, like the real APIs. The latency and errors of each
+provider are set on the command line or changed while running through the control endpoint:
+
+    GET  /_control         current settings and request counts
+    POST /_control         {"provider": "spotify", "latency": 0.5, "error_rate": 0.2, "error_status": 503}
+    POST /_control/reset   back to the command line settings, counts cleared
+
+Point the app at it with the base URL settings, e.g. for the default port:
+
+    SONGSEARCH_SPOTIFY_ACCOUNTS_URL=http://127.0.0.1:8001/spotify-accounts
+    SONGSEARCH_SPOTIFY_API_URL=http://127.0.0.1:8001/spotify
+    SONGSEARCH_ITUNES_URL=http://127.0.0.1:8001/itunes
+    SONGSEARCH_GENIUS_URL=http://127.0.0.1:8001/genius
+"""
+import argparse
+import copy
+import hashlib
+import json
+import pathlib
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+RECORDINGS_DIR = pathlib.Path(__file__).parent / 'recordings'
+
+PROVIDERS = ('spotify', 'itunes', 'genius')
+
+# Digits added to the recorded ids, derived from the search term
+ID_SUFFIX_DIGITS = 6
+
+
+def load_recording(name):
+    with open(RECORDINGS_DIR / f'{name}.json', encoding='utf-8') as recording:
+        return json.load(recording)
+
+
+def term_suffix(term):
+    return int(hashlib.md5(term.lower().encode('utf-8')).hexdigest(), 16) % 10 ** ID_SUFFIX_DIGITS
+
+
+def string_id(recorded_id, suffix):
+    return f'{recorded_id}{suffix:0{ID_SUFFIX_DIGITS}d}'
+
+
+def int_id(recorded_id, suffix):
+    return recorded_id * 10 ** ID_SUFFIX_DIGITS + suffix
+
+
+class FakeProviders:
+    """
+    Recorded responses and the latency and error settings of each provider
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, retry_after=None):
+        self.defaults = {'latency': latency, 'jitter': jitter, 'error_rate': error_rate,
+                         'error_status': error_status, 'retry_after': retry_after}
+        self.settings = {provider: dict(self.defaults) for provider in PROVIDERS}
+        self.requests = Counter()
+        self.lock = threading.Lock()
+
+        self.spotify_search = load_recording('spotify_search')
+        self.spotify_artists = {artist['id']: artist for artist in load_recording('spotify_artists')['artists']}
+        self.itunes_search = load_recording('itunes_search')
+        self.genius_search = load_recording('genius_search')
+        self.genius_songs = {int(song_id): song for song_id, song in load_recording('genius_songs').items()}
+
+    def configure(self, provider, **values):
+        with self.lock:
+            self.settings[provider].update({key: value for key, value in values.items() if key in self.defaults})
+
+    def reset(self):
+        with self.lock:
+            self.settings = {provider: dict(self.defaults) for provider in PROVIDERS}
+            self.requests.clear()
+
+    def state(self):
+        with self.lock:
+            return {'settings': copy.deepcopy(self.settings), 'requests': dict(self.requests)}
+
+    def simulate(self, provider, endpoint):
+        """
+        Wait the latency of the provider and return the error status to answer with, if any
+        """
+        with self.lock:
+            self.requests[f'{provider}:{endpoint}'] += 1
+            settings = dict(self.settings[provider])
+        time.sleep(max(settings['latency'] + random.uniform(-settings['jitter'], settings['jitter']), 0))
+        if random.random() < settings['error_rate']:
+            return settings['error_status'], settings['retry_after']
+        return None, None
+
+    def token(self):
+        return {'access_token': 'benchmark-token', 'token_type': 'Bearer', 'expires_in': 3600}
+
+    def spotify_tracks(self, term):
+        suffix = term_suffix(term)
+        response = copy.deepcopy(self.spotify_search)
+        for track in response['tracks']['items']:
+            track['id'] = string_id(track['id'], suffix)
+            for artist in track['artists']:
+                artist['id'] = string_id(artist['id'], suffix)
+        return response
+
+    def spotify_artist_genres(self, artist_ids):
+        artists = []
+        for artist_id in artist_ids:
+            artist = self.spotify_artists.get(artist_id[:-ID_SUFFIX_DIGITS])
+            artists.append(dict(artist, id=artist_id) if artist else None)  # Unknown ids come back as null
+        return {'artists': artists}
+
+    def itunes_tracks(self, term):
+        suffix = term_suffix(term)
+        response = copy.deepcopy(self.itunes_search)
+        for track in response['results']:
+            track['trackId'] = int_id(track['trackId'], suffix)
+        return response
+
+    def genius_hits(self, term):
+        suffix = term_suffix(term)
+        response = copy.deepcopy(self.genius_search)
+        for hit in response['response']['hits']:
+            hit['result']['id'] = int_id(hit['result']['id'], suffix)
+        return response
+
+    def genius_song(self, song_id):
+        song = self.genius_songs.get(song_id // 10 ** ID_SUFFIX_DIGITS)
+        if song is None:
+            return None
+        song = copy.deepcopy(song)
+        song['response']['song']['id'] = song_id
+        return song
+
+
+class FakeProvidersHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keeps the connections open, as the real APIs do
+    fake_providers = None
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def route(self, method):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        parts = url.path.strip('/').split('/')
+
+        if parts[0] == '_control':
+            return self.control(method, parts[1:], body)
+
+        routes = {
+            ('POST', 'spotify-accounts/api/token'): ('spotify', 'token', lambda: self.fake_providers.token()),
+            ('GET', 'spotify/v1/search'): ('spotify', 'search',
+                                           lambda: self.fake_providers.spotify_tracks(query.get('q', ''))),
+            ('GET', 'spotify/v1/artists'): ('spotify', 'artists', lambda: self.fake_providers.spotify_artist_genres(
+                query.get('ids', '').split(','))),
+            ('GET', 'itunes/search'): ('itunes', 'search',
+                                       lambda: self.fake_providers.itunes_tracks(query.get('term', ''))),
+            ('POST', 'genius/oauth/token'): ('genius', 'token', lambda: self.fake_providers.token()),
+            ('GET', 'genius/search'): ('genius', 'search', lambda: self.fake_providers.genius_hits(query.get('q', ''))),
+        }
+        route = routes.get((method, '/'.join(parts)))
+        if route is None and method == 'GET' and parts[:2] == ['genius', 'songs'] and len(parts) == 3 and parts[2].isdigit():
+            song_id = int(parts[2])
+            route = ('genius', 'songs', lambda: self.fake_providers.genius_song(song_id))
+        if route is None:
+            return self.send_json(404, {'error': 'Not found'})
+
+        provider, endpoint, response = route
+        error_status, retry_after = self.fake_providers.simulate(provider, endpoint)
+        if error_status:
+            headers = {'Retry-After': str(retry_after)} if retry_after else {}
+            return self.send_json(error_status, {'error': 'Injected error'}, headers)
+        data = response()
+        if data is None:
+            return self.send_json(404, {'error': 'Not found'})
+        self.send_json(200, data)
+
+    def control(self, method, parts, body):
+        if method == 'POST' and parts == ['reset']:
+            self.fake_providers.reset()
+        elif method == 'POST' and not parts:
+            try:
+                values = json.loads(body or b'{}')
+            except ValueError:
+                return self.send_json(400, {'error': 'Invalid JSON'})
+            provider = values.pop('provider', 'all')
+            providers = PROVIDERS if provider == 'all' else [provider]
+            if any(provider not in PROVIDERS for provider in providers):
+                return self.send_json(400, {'error': f'Unknown provider, expected one of {", ".join(PROVIDERS)}'})
+            for provider in providers:
+                self.fake_providers.configure(provider, **values)
+        elif method != 'GET' or parts:
+            return self.send_json(404, {'error': 'Not found'})
+        self.send_json(200, self.fake_providers.state())
+
+    def send_json(self, status, data, headers=None):
+        content = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass  # One line per request would slow down the benchmarks
+
+
+def create_server(host, port, fake_providers):
+    handler = type('Handler', (FakeProvidersHandler,), {'fake_providers': fake_providers})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds each response takes')
+    parser.add_argument('--jitter', type=float, default=0.02, help='Random seconds added or removed to the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of the requests that fail')
+    parser.add_argument('--error-status', type=int, default=503, help='Status of the failed requests')
+    parser.add_argument('--retry-after', type=int, help='Retry-After header of the failed requests, in seconds')
+    args = parser.parse_args()
+
+    fake_providers = FakeProviders(args.latency, args.jitter, args.error_rate, args.error_status, args.retry_after)
+    server = create_server(args.host, args.port, fake_providers)
+    print(f'Fake providers listening on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
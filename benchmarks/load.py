@@ -0,0 +1,187 @@
+"""
+Load benchmark of the song search endpoint.
+
+Drives /api/song/ at each concurrency level in the chosen scenarios and writes the throughput and latency
+percentiles as JSON, to compare between commits with benchmarks/compare.py:
+
+    cold      every request searches a term never searched before, so every provider is called
+    warm      the requests cycle over terms searched beforehand, so they are answered from the cache
+    degraded  like cold, while the fake providers make one provider slow and failing
+
+The app has to point at the fake providers (see benchmarks/fake_providers.py) with rate limits above the load,
+e.g. SONGSEARCH_ITUNES_RATE_LIMIT=1000000, and run under Gunicorn as in production. Every request opens a new
+connection unless --keep-alive is given: Django's runserver delays the responses on kept-alive connections by ~40 ms.
+"""
+import argparse
+import datetime
+import json
+import math
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+SCENARIOS = ('cold', 'warm', 'degraded')
+
+# Terms searched before measuring the warm scenario, the requests cycle over them
+WARM_TERMS = 20
+
+
+def percentile(latencies, percent):
+    # Nearest rank, the same as the provider health
+    return latencies[min(math.ceil(percent / 100 * len(latencies)) - 1, len(latencies) - 1)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class LoadRunner:
+    def __init__(self, base_url, fake_providers_url, username, password, timeout, keep_alive=False):
+        self.base_url = base_url.rstrip('/')
+        self.fake_providers_url = fake_providers_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.run_id = uuid.uuid4().hex[:8]  # Keeps the terms of every run out of the cache of the previous ones
+        self.sessions = threading.local()
+
+    def access_token(self):
+        response = requests.post(f'{self.base_url}/api/token/', timeout=self.timeout,
+                                 json={'username': self.username, 'password': self.password})
+        response.raise_for_status()
+        return response.json()['access']
+
+    def control(self, **values):
+        response = requests.post(f'{self.fake_providers_url}/_control', json=values, timeout=self.timeout)
+        response.raise_for_status()
+
+    def reset_fake_providers(self):
+        response = requests.post(f'{self.fake_providers_url}/_control/reset', timeout=self.timeout)
+        response.raise_for_status()
+
+    def search(self, search_term, headers):
+        """
+        Search the term and return the seconds the request took and whether it succeeded
+        """
+        if self.keep_alive:
+            session = getattr(self.sessions, 'session', None)
+            if session is None:
+                session = self.sessions.session = requests.Session()  # One connection per concurrent client
+        else:
+            session = requests
+            headers = {**headers, 'Connection': 'close'}
+        start = time.perf_counter()
+        try:
+            response = session.get(f'{self.base_url}/api/song/', params={'search_term': search_term},
+                                   headers=headers, timeout=self.timeout)
+            response.content
+            succeeded = response.status_code == 200
+        except requests.exceptions.RequestException:
+            succeeded = False
+        return time.perf_counter() - start, succeeded
+
+    def measure(self, scenario, concurrency, search_terms):
+        headers = {'Authorization': f'Bearer {self.access_token()}'}  # A new one per level, tokens expire quickly
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            start = time.perf_counter()
+            results = list(executor.map(lambda search_term: self.search(search_term, headers), search_terms))
+            elapsed = time.perf_counter() - start
+
+        latencies = sorted(latency for latency, _ in results)
+        return {
+            'scenario': scenario,
+            'concurrency': concurrency,
+            'requests': len(results),
+            'errors': sum(1 for _, succeeded in results if not succeeded),
+            'seconds': round(elapsed, 3),
+            'throughput_rps': round(len(results) / elapsed, 2),
+            'latency_ms': {
+                'mean': round(sum(latencies) / len(latencies) * 1000, 2),
+                'p50': round(percentile(latencies, 50) * 1000, 2),
+                'p95': round(percentile(latencies, 95) * 1000, 2),
+                'p99': round(percentile(latencies, 99) * 1000, 2),
+                'max': round(latencies[-1] * 1000, 2),
+            },
+        }
+
+    def unique_terms(self, scenario, concurrency, count):
+        return [f'bench {self.run_id} {scenario} {concurrency} {index}' for index in range(count)]
+
+    def run(self, scenario, concurrency, count, degraded_settings):
+        if scenario == 'cold':
+            return self.measure(scenario, concurrency, self.unique_terms(scenario, concurrency, count))
+
+        if scenario == 'warm':
+            warm_terms = self.unique_terms(scenario, concurrency, WARM_TERMS)
+            self.measure('warm-up', concurrency, warm_terms)
+            return self.measure(scenario, concurrency, [warm_terms[index % WARM_TERMS] for index in range(count)])
+
+        self.control(**degraded_settings)
+        try:
+            return self.measure(scenario, concurrency, self.unique_terms(scenario, concurrency, count))
+        finally:
+            self.reset_fake_providers()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='URL of the app')
+    parser.add_argument('--fake-providers-url', default='http://127.0.0.1:8001')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma separated, out of ' + ', '.join(SCENARIOS))
+    parser.add_argument('--concurrency', default='1,8,32', help='Comma separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario and concurrency level')
+    parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request counts as failed')
+    parser.add_argument('--degraded-provider', default='spotify')
+    parser.add_argument('--degraded-latency', type=float, default=1.0)
+    parser.add_argument('--degraded-error-rate', type=float, default=0.3)
+    parser.add_argument('--keep-alive', action='store_true',
+                        help='Reuse one connection per concurrent client instead of a new one per request')
+    parser.add_argument('--output', help='File to write the results to, instead of the standard output')
+    args = parser.parse_args()
+
+    scenarios = args.scenarios.split(',')
+    unknown_scenarios = set(scenarios) - set(SCENARIOS)
+    if unknown_scenarios:
+        parser.error(f'Unknown scenarios: {", ".join(sorted(unknown_scenarios))}')
+    concurrency_levels = [int(level) for level in args.concurrency.split(',')]
+    degraded_settings = {'provider': args.degraded_provider, 'latency': args.degraded_latency,
+                         'error_rate': args.degraded_error_rate}
+
+    runner = LoadRunner(args.base_url, args.fake_providers_url, args.username, args.password, args.timeout,
+                        args.keep_alive)
+    runner.reset_fake_providers()
+    results = []
+    for scenario in scenarios:
+        for concurrency in concurrency_levels:
+            result = runner.run(scenario, concurrency, args.requests, degraded_settings)
+            print(f"{scenario:>8} x{concurrency:<4} {result['throughput_rps']:>8} req/s  "
+                  f"p50 {result['latency_ms']['p50']} ms  p95 {result['latency_ms']['p95']} ms  "
+                  f"p99 {result['latency_ms']['p99']} ms  errors {result['errors']}", file=sys.stderr)
+            results.append(result)
+
+    report = json.dumps({
+        'commit': git_commit(),
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'settings': {'requests': args.requests, 'keep_alive': args.keep_alive, 'degraded': degraded_settings},
+        'results': results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,20 @@
 #!/bin/sh
+set -e
 
-python manage.py makemigrations
-python manage.py migrate
-python manage.py createsuperuser --noinput
-python manage.py runserver 0.0.0.0:8000
+case "$1" in
+    migrate)
+        # Run once per release, not on every start of the server
+        python manage.py migrate --noinput
+        python manage.py createcachetable
+        python manage.py createsuperuser --noinput || true  # Fails when the user already exists
+        ;;
+    runserver)
+        python manage.py runserver 0.0.0.0:8000
+        ;;
+    serve|"")
+        exec gunicorn --config gunicorn.conf.py
+        ;;
+    *)
+        exec "$@"
+        ;;
+esac
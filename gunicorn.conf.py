@@ -0,0 +1,57 @@
+"""
+Gunicorn settings of the production server, read from the environment.
+
+GUNICORN_WORKER_CLASS=gthread serves the WSGI application with GUNICORN_THREADS threads per worker, and
+GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker serves the ASGI application, needed by api/song/async/
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8000)}"
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+wsgi_app = 'SongSearchAPI.asgi:application' if 'uvicorn' in worker_class else 'SongSearchAPI.wsgi:application'
+
+# The application is loaded once before the workers are forked, so they start right away and share its memory
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True') == 'True'
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# Workers are replaced after this many requests, which bounds the memory they can grow to. 0 disables it
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+worker_tmp_dir = os.getenv('GUNICORN_WORKER_TMP_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else None)
+accesslog = os.getenv('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def when_ready(server):
+    """
+    Import the URLconf, and with it the views and their dependencies, before the workers are forked. Django loads it
+    on the first request otherwise, once per worker
+    """
+    if preload_app:
+        from django.urls import get_resolver
+        get_resolver().url_patterns
+
+
+def post_worker_init(worker):
+    """
+    Start loading the suggestions and, when enabled, pre-warming the popular searches in the worker. Threads started
+    before the fork do not run in the workers
+    """
+    from songsearch.prewarm import start_scheduler
+    from songsearch.suggest import start_loading
+    start_loading()
+    start_scheduler()
+
+
+def worker_exit(server, worker):
+    # Keeps the search counts of the worker
+    from songsearch.search_stats import search_stats
+    search_stats.flush()
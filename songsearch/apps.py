@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
 
 
 class SongsearchConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'songsearch'
+
+    def ready(self):
+        from SongSearchAPI.authentication import forget_cached_user
+        post_save.connect(forget_cached_user, sender=settings.AUTH_USER_MODEL)
+        post_delete.connect(forget_cached_user, sender=settings.AUTH_USER_MODEL)
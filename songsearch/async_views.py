@@ -0,0 +1,205 @@
+import asyncio
+import time
+import weakref
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse
+from rest_framework import exceptions, status
+from SongSearchAPI.authentication import TokenAuthentication
+from . import catalog
+from .cache import async_search_flight, search_cache
+from .conditional import ResultsValidator, add_cache_headers, not_modified, results_etag, validator_key
+from .facets import NO_FILTERS, SongResults
+from .http import create_async_client
+from .merge import merge_songs
+from .metrics import record_cache_lookup, request_metrics, timer
+from .ratelimit import BACKGROUND, INTERACTIVE, request_priority
+from .results import encode_json
+from .search_stats import search_stats
+from .suggest import suggestion_index
+from .views import (PROVIDERS, answers_filters, cache_lookup_filters, filter_songs, flight_key, fresh_timeout,
+                    has_pending_songs, is_complete, provider_cache_key, query_flag, search_params, serialize_songs,
+                    sort_merged_songs)
+
+# One client per event loop, since connections can not be shared between loops
+async_clients = weakref.WeakKeyDictionary()
+
+
+def async_client():
+    loop = asyncio.get_running_loop()
+    client = async_clients.get(loop)
+    if client is None:
+        client = async_clients[loop] = create_async_client()
+    return client
+
+
+async def close_async_client():
+    """
+    Close the client of the running event loop, if it has one
+    """
+    client = async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def afetch_songs(provider, search_term, fast=False, priority=INTERACTIVE, filters=NO_FILTERS):
+    """
+    Asynchronous version of fetch_songs
+    """
+    request_priority.set(priority)  # Each task runs in a copy of the context
+    max_age = None
+    if priority == BACKGROUND:
+        request_metrics.set(None)  # Not part of the request that started the refresh
+        max_age = min(settings.SONGSEARCH_SEARCH_CACHE_TIMEOUT, settings.SONGSEARCH_CATALOG_MAX_AGE)
+    cache_key = provider_cache_key(provider, search_term)
+    songs = await sync_to_async(catalog.find_songs)(provider.name, search_term, max_age)
+    if songs is not None and not answers_filters(songs, filters):
+        songs = None
+    record_cache_lookup('catalog', 'miss' if songs is None else 'hit')
+    if songs is None:
+        provider.health.check()  # Fails right away while the provider is failing repeatedly
+        with provider.timer('fetch'):
+            data = await provider.aget_data(async_client(), search_term, fast=fast, filters=filters)
+            songs = serialize_songs(provider, data)
+        if has_pending_songs(songs):
+            # Songs with a pending album are not stored so the next requests pick up the album once it is known
+            return songs
+        songs = SongResults(songs, complete=is_complete(data, filters))
+        if filters:
+            cache_key = provider_cache_key(provider, search_term, filters)
+        else:
+            await sync_to_async(catalog.store_songs)(provider.name, search_term, songs, songs.complete)
+
+    timeout = fresh_timeout(songs)
+    stale_timeout = settings.SONGSEARCH_SEARCH_CACHE_STALE_TIMEOUT
+    await search_cache.aset(cache_key, songs, timeout=timeout, stale_timeout=stale_timeout)
+    await search_cache.aset(validator_key(cache_key), ResultsValidator.of(songs), timeout=timeout,
+                            stale_timeout=stale_timeout)
+    return songs
+
+
+async def acached_validators(search_term, filters=NO_FILTERS):
+    """
+    Asynchronous version of cached_validators
+    """
+    validators = []
+    for provider in PROVIDERS:
+        for cache_filters in cache_lookup_filters(filters):
+            cached = await search_cache.aget(validator_key(provider_cache_key(provider, search_term, cache_filters)))
+            if cached is not None and (cache_filters == filters or answers_filters(cached[0], filters)):
+                break
+        else:
+            return None
+        validators.append(cached[0])
+    return validators
+
+
+async def asearch_providers(search_term, fast=False, filters=NO_FILTERS):
+    """
+    Asynchronous version of search_providers: returns the songs of each provider and the providers that timed out
+    """
+    song_data = []
+    tasks = {}
+    for provider in PROVIDERS:
+        for cache_filters in cache_lookup_filters(filters):
+            cache_key = provider_cache_key(provider, search_term, cache_filters)
+            cached = await search_cache.aget(cache_key)
+            if cached is not None and (cache_filters == filters or answers_filters(cached[0], filters)):
+                break
+        else:
+            record_cache_lookup('search', 'miss')
+            # Concurrent requests missing the same results wait for a single fetch
+            cache_key = provider_cache_key(provider, search_term, filters)
+            tasks[async_search_flight.run(flight_key(cache_key, fast), afetch_songs, provider, search_term, fast,
+                                          INTERACTIVE, filters)] = provider
+            continue
+
+        cached_songs, fresh_until = cached
+        song_data.append(cached_songs)
+        if fresh_until > time.time():
+            record_cache_lookup('search', 'hit')
+        else:
+            record_cache_lookup('search', 'stale')
+            # Stale results are served right away while one background fetch refreshes them
+            async_search_flight.run(flight_key(cache_key, priority=BACKGROUND), afetch_songs, provider, search_term,
+                                    False, BACKGROUND, cache_filters)
+    if not tasks:
+        return song_data, []
+
+    # The tasks are shared with other requests, so the ones missing the deadline keep running and fill the cache
+    done, not_done = await asyncio.wait(tasks, timeout=settings.SONGSEARCH_SEARCH_DEADLINE)
+    timed_out = [tasks[task].name for task in tasks if task in not_done]
+
+    for task in tasks:
+        if task not in done:
+            continue
+        try:
+            song_data.append(task.result())
+        except ValueError:
+            # Error occurred while fetching data from the provider, skip and continue with the next provider
+            pass
+    return song_data, timed_out
+
+
+async def song_search(request):
+    """
+    Asynchronous version of SongViewSet.list. Served under ASGI, a worker keeps the provider calls of many
+    searches in flight at the same time instead of blocking a thread on each one
+    """
+    if isinstance(request, ASGIRequest):
+        return await search(request)
+    # Under WSGI every request runs in an event loop of its own that ends with it, along with the fetches still in
+    # flight, so its client is closed instead of leaking its connections
+    try:
+        return await search(request)
+    finally:
+        await close_async_client()
+
+
+async def search(request):
+    if request.method != 'GET':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    authentication = TokenAuthentication()
+    try:
+        with timer('auth'):
+            await sync_to_async(authentication.authenticate)(request)
+    except exceptions.AuthenticationFailed as e:
+        data = e.detail if isinstance(e.detail, dict) else {'detail': e.detail}  # The same body as DRF
+        response = JsonResponse(data, status=e.status_code)
+        response['WWW-Authenticate'] = authentication.authenticate_header(request)
+        return response
+
+    params = search_params(request)
+    if params is None:
+        return JsonResponse({'error': 'Search term is required'}, status=status.HTTP_400_BAD_REQUEST)
+    search_term, filters = params
+    search_stats.record(search_term, filters)
+    merge = query_flag(request, 'merge')
+    if 'HTTP_IF_NONE_MATCH' in request.META:
+        validators = await acached_validators(search_term, filters)
+        etag = results_etag(validators, 'json', *filters, merge) if validators is not None else None
+        response = not_modified(request, etag)
+        if response is not None:
+            return add_cache_headers(response, etag, validators)
+
+    with timer('providers'):
+        song_data, timed_out = await asearch_providers(search_term, query_flag(request, 'fast'), filters)
+    etag = results_etag(song_data, 'json', *filters, merge)
+    response = not_modified(request, etag)
+    if response is not None:
+        return add_cache_headers(response, etag, song_data)
+
+    with timer('filter'):
+        serialized_data = filter_songs(song_data, filters)
+    suggestion_index.add_songs(serialized_data)
+    if merge:
+        with timer('merge'):
+            serialized_data = sort_merged_songs(merge_songs(serialized_data))
+
+    with timer('serialize'):
+        response = HttpResponse(encode_json(serialized_data), content_type='application/json')
+    if timed_out:
+        response['X-Providers-Timed-Out'] = ', '.join(timed_out)
+    return add_cache_headers(response, etag, song_data)
@@ -0,0 +1,163 @@
+import asyncio
+import contextvars
+import threading
+import time
+from asgiref.sync import sync_to_async
+from collections import OrderedDict
+from concurrent.futures import Future
+from django.conf import settings
+from django.core.cache import cache
+from .metrics import run_for_request
+
+
+class LocalCache:
+    """
+    In-process cache that keeps at most max_entries values, evicting the least recently used ones
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # Key -> (expiration timestamp, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, expires_at: float):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class TieredCache:
+    """
+    Cache with two tiers: a small in-process LRU in front of the Django cache shared by the workers.
+    Values stay fresh for timeout seconds and are then kept stale for stale_timeout more seconds, so they can be
+    served while they are refreshed
+    """
+
+    def __init__(self, local: LocalCache, shared):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key):
+        """
+        Return the value and the timestamp until which it is fresh, or None if it is not cached
+        """
+        entry = self.local.get(key)
+        if entry is not None:
+            return entry
+
+        entry = self.shared.get(key)
+        if entry is None:
+            return None
+        fresh_until, expires_at, value = entry
+        self.local.set(key, (value, fresh_until), expires_at)
+        return value, fresh_until
+
+    def set(self, key, value, timeout: int, stale_timeout: int = 0):
+        fresh_until = time.time() + timeout
+        expires_at = fresh_until + stale_timeout
+        self.shared.set(key, (fresh_until, expires_at, value), timeout=timeout + stale_timeout)
+        self.local.set(key, (value, fresh_until), expires_at)
+
+    def delete(self, key):
+        self.shared.delete(key)
+        self.local.delete(key)
+
+    async def aget(self, key):
+        entry = self.local.get(key)
+        if entry is not None:
+            return entry
+        # The shared cache might be a network service, so it is read without blocking the event loop
+        return await sync_to_async(self.get, thread_sensitive=False)(key)
+
+    async def aset(self, key, value, timeout: int, stale_timeout: int = 0):
+        await sync_to_async(self.set, thread_sensitive=False)(key, value, timeout, stale_timeout)
+
+
+class SingleFlight:
+    """
+    Makes concurrent calls for the same key share a single execution and its result
+    """
+
+    def __init__(self):
+        self._calls = {}  # Key -> future of the call in flight
+        self._lock = threading.Lock()
+
+    def submit(self, executor, key, fn, *args):
+        """
+        Run fn in the executor unless a call for the key is already in flight, and return the future of the call
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future
+            future = Future()
+            self._calls[key] = future
+
+        # The call runs in a copy of the caller context, so the context variables it sets stay in the call
+        executor.submit(contextvars.copy_context().run, self._run, key, future, fn, args)
+        return future
+
+    def _run(self, key, future, fn, args):
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(run_for_request(fn, *args))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight:
+    """
+    Makes concurrent coroutines for the same key share a single task and its result
+    """
+
+    def __init__(self):
+        self._tasks = {}  # Key -> task in flight
+
+    def run(self, key, coroutine_function, *args) -> asyncio.Task:
+        """
+        Start coroutine_function as a task unless a task for the key is already running in this event loop,
+        and return the task
+        """
+        task = self._tasks.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            return task
+
+        task = asyncio.ensure_future(coroutine_function(*args))
+        self._tasks[key] = task
+        task.add_done_callback(lambda done_task: self._finish(key, done_task))
+        return task
+
+    def _finish(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # Marks the error as retrieved, background refreshes have nobody waiting for them
+
+
+search_cache = TieredCache(LocalCache(settings.SONGSEARCH_LOCAL_CACHE_SIZE), cache)
+search_flight = SingleFlight()
+async_search_flight = AsyncSingleFlight()
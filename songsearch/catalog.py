@@ -0,0 +1,135 @@
+import datetime
+import logging
+import threading
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from .facets import SongResults
+from .models import SearchCoverage, Song
+from .results import SongResult
+
+logger = logging.getLogger(__name__)
+
+# Number of songs returned per provider, the same as the page size requested to the providers
+CATALOG_RESULTS_LIMIT = 10
+
+# SQLite fails right away, instead of waiting, when a transaction that read the database tries to write while another
+# connection writes. Writes of the process take turns, and the catalog transactions start writing before reading
+catalog_write_lock = threading.Lock()
+
+CATALOG_FIELDS = ['name', 'album', 'artist', 'album_cover', 'year_release_date', 'genres', 'duration', 'isrc', 'updated_at']
+
+
+def store_songs(origin: str, search_term: str, songs, complete: bool = False):
+    """
+    Upsert the songs of a provider into the catalog and record that they answer the search term, and whether they
+    are every song the provider has for it
+    """
+    songs = {song.provider_song_id: song.to_dict() for song in songs}  # Providers sometimes repeat a song
+    now = timezone.now()
+    try:
+        # Read before the transaction, so it starts with a write and waits for the other writers, e.g. the
+        # rate limiters of every worker, instead of failing
+        existing_songs = {song.provider_song_id: song
+                          for song in Song.objects.filter(origin=origin, provider_song_id__in=list(songs))}
+        new_songs = []
+        for provider_song_id, song in songs.items():
+            catalog_song = existing_songs.get(provider_song_id)
+            if catalog_song is None:
+                new_songs.append(Song(**song))
+                continue
+            for field, value in song.items():
+                setattr(catalog_song, field, value)
+            catalog_song.updated_at = now  # bulk_update does not apply auto_now
+
+        with catalog_write_lock, transaction.atomic():
+            Song.objects.bulk_update(existing_songs.values(), CATALOG_FIELDS)
+            # Conflicts come from another worker storing the same songs at the same time
+            Song.objects.bulk_create(new_songs, ignore_conflicts=True)
+
+            song_ids = {}
+            if songs:
+                song_ids = dict(Song.objects.filter(origin=origin, provider_song_id__in=list(songs))
+                                .values_list('provider_song_id', 'id'))
+            coverage = {'song_ids': [song_ids[song_id] for song_id in songs if song_id in song_ids],
+                        'fetched_at': now, 'complete': complete}
+            updated = SearchCoverage.objects.filter(search_term=search_term, origin=origin).update(**coverage)
+            if not updated:
+                SearchCoverage.objects.create(search_term=search_term, origin=origin, **coverage)
+    except DatabaseError:
+        # The catalog is only an optimization, the search keeps working from the providers
+        logger.exception('Error storing %s songs in the catalog', origin)
+
+
+def find_songs(origin: str, search_term: str, max_age: float = None):
+    """
+    Return the songs of a provider for the search term from the catalog as SongResults, or None when the catalog does
+    not cover the term with songs newer than max_age seconds, SONGSEARCH_CATALOG_MAX_AGE by default. The songs are
+    fresh for SONGSEARCH_SEARCH_CACHE_TIMEOUT seconds since they were fetched from the provider
+    """
+    if max_age is None:
+        max_age = settings.SONGSEARCH_CATALOG_MAX_AGE
+    if not settings.SONGSEARCH_CATALOG_MAX_AGE or max_age <= 0:
+        return None
+    fresh_since = timezone.now() - datetime.timedelta(seconds=max_age)
+
+    try:
+        # Terms fetched from the provider recently are answered with the same songs, in the same order
+        coverage = SearchCoverage.objects.filter(search_term=search_term, origin=origin, fetched_at__gte=fresh_since).first()
+        if coverage is not None:
+            songs = Song.objects.in_bulk(coverage.song_ids)
+            return SongResults(serialize([songs[song_id] for song_id in coverage.song_ids if song_id in songs]),
+                               fresh_until=fresh_until(coverage.fetched_at), complete=coverage.complete)
+
+        # Other terms are answered from the full-text index when it has enough fresh matches
+        min_matches = settings.SONGSEARCH_CATALOG_MIN_MATCHES
+        if not min_matches:
+            return None
+        song_ids = full_text_search(search_term, limit=CATALOG_RESULTS_LIMIT * 5)
+        songs = Song.objects.filter(id__in=song_ids, origin=origin, updated_at__gte=fresh_since).in_bulk()
+        songs = [songs[song_id] for song_id in song_ids if song_id in songs][:CATALOG_RESULTS_LIMIT]
+        if len(songs) < min_matches:
+            return None
+        # The provider might have other songs for the term
+        return SongResults(serialize(songs), fresh_until=fresh_until(min(song.updated_at for song in songs)))
+    except DatabaseError:
+        logger.exception('Error reading %s songs from the catalog', origin)
+        return None
+
+
+def fresh_until(fetched_at: datetime.datetime) -> float:
+    return fetched_at.timestamp() + settings.SONGSEARCH_SEARCH_CACHE_TIMEOUT
+
+
+def full_text_search(search_term: str, limit: int):
+    """
+    Return the ids of the catalog songs whose name, artist or album contain every word of the search term,
+    best matches first. Only available on SQLite
+    """
+    if connection.vendor != 'sqlite':
+        return []
+    # Quote every word so the term is never read as FTS5 query syntax
+    query = ' '.join(f'"{word}"' for word in search_term.split())
+    if not query:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT rowid FROM songsearch_song_fts WHERE songsearch_song_fts MATCH %s ORDER BY rank LIMIT %s',
+            [query, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def recent_songs(limit: int):
+    """
+    Return the songs updated most recently in the catalog
+    """
+    try:
+        return serialize(Song.objects.order_by('-updated_at')[:limit])
+    except DatabaseError:
+        logger.exception('Error reading the recent songs from the catalog')
+        return []
+
+
+def serialize(songs):
+    return [SongResult.from_model(song) for song in songs]
@@ -0,0 +1,78 @@
+import hashlib
+import time
+from collections import namedtuple
+from django.conf import settings
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+
+
+class ResultsValidator(namedtuple('ResultsValidator', ['digest', 'fresh_until', 'complete'])):
+    """
+    Content hash, freshness and completeness of the cached songs of a provider. Cached apart from the songs, so the
+    conditional requests are answered without loading them
+    """
+    __slots__ = ()
+
+    @classmethod
+    def of(cls, songs):
+        return cls(songs.digest, songs.fresh_until, songs.complete)
+
+
+def validator_key(cache_key):
+    return f'{cache_key}:validator'
+
+
+def results_etag(song_data, *variant):
+    """
+    ETag of a response built from the cached songs, or their validators, of every provider, hashing the content hash
+    of each one along with whatever else changes the response, such as the filters and the format. None when some
+    songs are not cached, e.g. the provider failed, timed out or the songs have a pending album, since the response
+    would be incomplete, or when they are stale, since they are being refreshed
+    """
+    if not all(getattr(songs, 'digest', None) for songs in song_data):
+        return None
+    now = time.time()
+    if any(songs.fresh_until <= now for songs in song_data):
+        return None
+    digests = sorted(songs.digest for songs in song_data)
+    content = '|'.join([*map(str, variant), *digests]).encode('utf-8')
+    return f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+
+
+def fresh_seconds(song_data) -> int:
+    """
+    Seconds until the first of the cached songs stops being fresh
+    """
+    return max(int(min((songs.fresh_until for songs in song_data), default=0) - time.time()), 0)
+
+
+def not_modified(request, etag):
+    """
+    Return a 304 response when the client already has the response with the ETag, otherwise None
+    """
+    if etag is None:
+        return None
+    client_etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    # Weak comparison, as required for If-None-Match
+    if '*' in client_etags or etag in (client_etag.replace('W/', '', 1) for client_etag in client_etags):
+        return HttpResponseNotModified()
+    return None
+
+
+def add_cache_headers(response, etag, song_data):
+    """
+    Let the clients reuse the response until the songs stop being fresh and revalidate it with the ETag afterwards.
+    Shared caches only store it with SONGSEARCH_HTTP_CACHE_SHARED, since the search requires authentication
+    """
+    if etag is None:
+        patch_cache_control(response, no_cache=True)
+        return response
+    response['ETag'] = etag
+    max_age = fresh_seconds(song_data)
+    if settings.SONGSEARCH_HTTP_CACHE_SHARED:
+        patch_cache_control(response, public=True, max_age=max_age, s_maxage=max_age)
+    else:
+        patch_cache_control(response, private=True, max_age=max_age)
+    patch_vary_headers(response, ['Accept'])
+    return response
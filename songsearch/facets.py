@@ -0,0 +1,85 @@
+import hashlib
+from collections import namedtuple
+
+
+class SongFilters(namedtuple('SongFilters', ['album', 'genre', 'year'])):
+    """
+    Album, genre and year filters of a search, empty when not given. The album and year must be equal to the ones of
+    the song, the genre only has to be part of its genres
+    """
+    __slots__ = ()
+
+    def __bool__(self):
+        return any(self)
+
+    def matches(self, song) -> bool:
+        return ((not self.album or song.album == self.album)
+                and self.genre_matches(song.genres)
+                and (not self.year or song.year_release_date == self.year))
+
+    def genre_matches(self, genres) -> bool:
+        return not self.genre or self.genre.lower() in str(genres).lower()
+
+
+NO_FILTERS = SongFilters('', '', '')
+
+
+class FacetIndex:
+    """
+    Positions of the songs of a result set by album, genre and year, so any combination of filters is answered by
+    intersecting a few small sets instead of checking every song
+    """
+    __slots__ = ('albums', 'genres', 'years')
+
+    def __init__(self, songs):
+        self.albums = {}
+        self.genres = {}  # Lowercase genres -> positions, the genre filter only has to be part of them
+        self.years = {}
+        for position, song in enumerate(songs):
+            self.albums.setdefault(song.album, []).append(position)
+            self.genres.setdefault(str(song.genres).lower(), []).append(position)
+            self.years.setdefault(song.year_release_date, []).append(position)
+
+    def positions(self, filters: SongFilters):
+        """
+        Return the positions of the songs matching the filters, in order
+        """
+        selected = None
+        if filters.album:
+            selected = set(self.albums.get(filters.album, ()))
+        if filters.genre:
+            genre = filters.genre.lower()
+            positions = {position for genres, genre_positions in self.genres.items() if genre in genres
+                         for position in genre_positions}
+            selected = positions if selected is None else selected & positions
+        if filters.year:
+            positions = set(self.years.get(filters.year, ()))
+            selected = positions if selected is None else selected & positions
+        return sorted(selected)
+
+
+class SongResults(list):
+    """
+    Songs of a provider for a search, cached along with their facet index, a hash of their content and the timestamp
+    until which they are fresh. complete tells whether they are every song the provider has for the search, i.e. it
+    returned fewer songs than it was asked for, so the facet index answers any filters the same as the provider
+    """
+
+    def __init__(self, songs=(), fresh_until: float = 0, complete: bool = False):
+        super().__init__(songs)
+        self.facets = FacetIndex(self)
+        self.digest = hashlib.blake2b(b'\n'.join(song.json for song in self), digest_size=16).hexdigest()
+        self.fresh_until = fresh_until
+        self.complete = complete
+
+
+def filter_results(songs, filters: SongFilters):
+    """
+    Return the songs matching the filters, using the facet index of the songs when they have one
+    """
+    if not filters:
+        return list(songs)
+    facets = getattr(songs, 'facets', None)
+    if facets is None:
+        return [song for song in songs if filters.matches(song)]
+    return [songs[position] for position in facets.positions(filters)]
@@ -0,0 +1,106 @@
+import math
+import threading
+import time
+from collections import deque
+from django.conf import settings
+
+# States of the circuit breaker
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Latency samples needed before the timeouts and hedging follow the observed percentiles
+MIN_LATENCY_SAMPLES = 20
+
+
+class ProviderUnavailable(ValueError):
+    """
+    Raised instead of calling a provider while its circuit breaker is open
+    """
+
+
+class ProviderHealth:
+    """
+    Tracks the latency and failures of the calls to a provider. After SONGSEARCH_BREAKER_FAILURES consecutive failures
+    the provider is skipped for SONGSEARCH_BREAKER_COOLDOWN seconds, then a few probe fetches decide whether it is
+    used again. Probes that end without calling the provider, e.g. rate limited or answered without a call, decide
+    nothing, so a new round of probes is let through every SONGSEARCH_BREAKER_COOLDOWN seconds while half open
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0
+        self.half_opened_at = 0
+        self.probes = 0  # Fetches let through since the last round of probes started
+        self.latencies = deque(maxlen=settings.SONGSEARCH_HEALTH_WINDOW)  # Seconds of the last successful calls
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now - self.opened_at < settings.SONGSEARCH_BREAKER_COOLDOWN:
+                    return False
+                self.state = HALF_OPEN
+                self.half_opened_at = now
+                self.probes = 0
+            if self.state == HALF_OPEN:
+                if self.probes >= settings.SONGSEARCH_BREAKER_PROBES:
+                    if now - self.half_opened_at < settings.SONGSEARCH_BREAKER_COOLDOWN:
+                        return False
+                    # The probes ended without an outcome, start a new round
+                    self.half_opened_at = now
+                    self.probes = 0
+                self.probes += 1
+            return True
+
+    def check(self):
+        """
+        Raise ProviderUnavailable if the provider should not be called
+        """
+        if not self.allow_request():
+            raise ProviderUnavailable(f"{self.name} is unavailable after failing repeatedly")
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self.latencies.append(latency)
+            self.consecutive_failures = 0
+            self.state = CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= settings.SONGSEARCH_BREAKER_FAILURES:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def percentile(self, percent: float):
+        """
+        Return the given latency percentile in seconds, or None until there are enough samples
+        """
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        return latencies[min(math.ceil(percent / 100 * len(latencies)) - 1, len(latencies) - 1)]
+
+    def read_timeout(self) -> float:
+        """
+        Read timeout following the observed p99 latency, between SONGSEARCH_ADAPTIVE_TIMEOUT_MIN and
+        SONGSEARCH_HTTP_READ_TIMEOUT
+        """
+        p99 = self.percentile(99)
+        if p99 is None:
+            return settings.SONGSEARCH_HTTP_READ_TIMEOUT
+        timeout = p99 * settings.SONGSEARCH_ADAPTIVE_TIMEOUT_FACTOR
+        return min(max(timeout, settings.SONGSEARCH_ADAPTIVE_TIMEOUT_MIN), settings.SONGSEARCH_HTTP_READ_TIMEOUT)
+
+    def hedge_delay(self):
+        """
+        Seconds after which a hedged request is sent, or None when hedging is disabled or there are not enough samples
+        """
+        if not settings.SONGSEARCH_HEDGE_REQUESTS:
+            return None
+        return self.percentile(95)
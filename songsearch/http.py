@@ -0,0 +1,49 @@
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def create_session() -> requests.Session:
+    """
+    Create a session that keeps a pool of open connections, so consecutive calls to a provider skip the TCP and TLS
+    handshakes. Idempotent GET requests are retried on connection errors and 5xx responses
+    """
+    retry = Retry(
+        total=settings.SONGSEARCH_HTTP_RETRIES,
+        backoff_factor=settings.SONGSEARCH_HTTP_RETRY_BACKOFF,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        raise_on_status=False,  # The last response is returned so raise_for_status reports it
+        respect_retry_after_header=False,  # Retry-After is honored by the rate limiter, without blocking the thread
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.SONGSEARCH_HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def request_timeout(read_timeout: float):
+    """
+    Connect and read timeouts in seconds of a provider call
+    """
+    return settings.SONGSEARCH_HTTP_CONNECT_TIMEOUT, read_timeout
+
+
+def async_request_timeout(read_timeout: float) -> httpx.Timeout:
+    return httpx.Timeout(read_timeout, connect=settings.SONGSEARCH_HTTP_CONNECT_TIMEOUT)
+
+
+def create_async_client() -> httpx.AsyncClient:
+    """
+    Create an asynchronous client sharing up to SONGSEARCH_ASYNC_MAX_CONNECTIONS connections between the providers.
+    Only failed connections are retried, since httpx does not retry on response status
+    """
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=settings.SONGSEARCH_ASYNC_MAX_CONNECTIONS,
+                            max_keepalive_connections=settings.SONGSEARCH_ASYNC_MAX_CONNECTIONS),
+        timeout=httpx.Timeout(settings.SONGSEARCH_HTTP_READ_TIMEOUT, connect=settings.SONGSEARCH_HTTP_CONNECT_TIMEOUT),
+        transport=httpx.AsyncHTTPTransport(retries=settings.SONGSEARCH_HTTP_RETRIES),
+    )
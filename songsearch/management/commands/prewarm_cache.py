@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from songsearch.prewarm import prewarm
+
+
+class Command(BaseCommand):
+    help = ('Fetch the songs of the most popular searches that the catalog does not have or has for too long, so the '
+            'workers answer them without calling the providers after a deploy or a restart')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=settings.SONGSEARCH_PREWARM_TOP,
+                            help='Number of popular searches to pre-warm')
+        parser.add_argument('--rate', type=float, default=settings.SONGSEARCH_PREWARM_RATE,
+                            help='Provider fetches per second')
+
+    def handle(self, *args, **options):
+        if options['rate'] <= 0:
+            raise CommandError('--rate must be greater than 0')
+        # The cache of this process is dropped when the command ends, what remains are the songs stored in the
+        # catalog, and in the cache when it is shared by the processes
+        outcomes = prewarm(options['top'], settings.SONGSEARCH_PREWARM_REFRESH_AHEAD, options['rate'])
+        self.stdout.write(', '.join(f'{outcome}: {count}' for outcome, count in sorted(outcomes.items())) or
+                          'No searches to pre-warm')
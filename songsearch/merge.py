@@ -0,0 +1,106 @@
+import re
+
+# Providers to take each field of a merged song from, in order of preference
+FIELD_SOURCES = {
+    'name': ['Spotify', 'iTunes', 'Genius'],
+    'artist': ['Spotify', 'iTunes', 'Genius'],
+    'album': ['Genius', 'Spotify', 'iTunes'],
+    'album_cover': ['Spotify', 'iTunes', 'Genius'],
+    'year_release_date': ['Spotify', 'iTunes', 'Genius'],
+    'genres': ['Spotify', 'iTunes', 'Genius'],
+    'duration': ['Spotify', 'iTunes', 'Genius'],
+    'isrc': ['Spotify', 'iTunes', 'Genius'],
+}
+
+# Values the providers use for unknown fields ('pending' is the album of Genius songs still being fetched)
+MISSING_VALUES = ('', 'N/A', 'pending', None)
+
+# Maximum difference in milliseconds between the durations of the same recording in different providers
+DURATION_TOLERANCE_MS = 3000
+
+
+def normalize_text(text: str) -> str:
+    """
+    Lowercase the text and drop what providers write differently: parentheses such as (Remastered 2011),
+    featured artists, suffixes after a dash and punctuation
+    """
+    text = str(text).lower()
+    text = re.sub(r'\(.*?\)|\[.*?\]', ' ', text)
+    text = re.sub(r'\s(feat|ft|featuring)\.?\s.*$', ' ', text)
+    text = re.sub(r'\s-\s.*$', ' ', text)
+    text = re.sub(r'[^a-z0-9\s]', '', text)
+    return ' '.join(text.split())
+
+
+def main_artist(artist: str) -> str:
+    return normalize_text(re.split(r',|&| feat', str(artist))[0])
+
+
+def parse_duration(duration):
+    try:
+        return int(duration)
+    except (TypeError, ValueError):
+        return None  # Genius has no duration
+
+
+def blocking_keys(song):
+    """
+    Keys that the same recording shares across providers. Only songs with a key in common are compared
+    """
+    keys = []
+    if song.isrc not in MISSING_VALUES:
+        keys.append(('isrc', song.isrc.upper()))
+    title = normalize_text(song.name)
+    if title:
+        keys.append(('title', title, main_artist(song.artist)))
+    return keys
+
+
+def same_recording(song, other_song):
+    duration = parse_duration(song.duration)
+    other_duration = parse_duration(other_song.duration)
+    if duration is None or other_duration is None:
+        return True
+    return abs(duration - other_duration) <= DURATION_TOLERANCE_MS
+
+
+def merge_songs(songs):
+    """
+    Group the songs of the different providers that are the same recording and return one record per
+    group, with the id of the song in each provider and every field taken from its preferred provider
+    """
+    groups = []  # Songs of each group, with at most one song per provider
+    blocks = {}  # Blocking key -> indexes of the groups holding a song with that key
+
+    for song in songs:
+        keys = blocking_keys(song)
+        group = None
+        for key in keys:
+            for candidate in blocks.get(key, []):
+                members = groups[candidate]
+                if all(member.origin != song.origin and same_recording(member, song) for member in members):
+                    group = candidate
+                    break
+            if group is not None:
+                break
+
+        if group is None:
+            group = len(groups)
+            groups.append([])
+        groups[group].append(song)
+        for key in keys:
+            if group not in blocks.setdefault(key, []):
+                blocks[key].append(group)
+
+    return [merge_group(group) for group in groups]
+
+
+def merge_group(songs):
+    songs_by_origin = {song.origin: song for song in songs}
+    merged_song = {}
+    for field, sources in FIELD_SOURCES.items():
+        values = [getattr(songs_by_origin[origin], field) for origin in sources if origin in songs_by_origin]
+        merged_song[field] = next((value for value in values if value not in MISSING_VALUES), values[0])
+    merged_song['origins'] = [song.origin for song in songs]
+    merged_song['provider_song_ids'] = {song.origin: song.provider_song_id for song in songs}
+    return merged_song
@@ -0,0 +1,220 @@
+import contextvars
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import caches
+
+# Upper bounds in seconds of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS_HELP = {
+    'songsearch_phase_seconds': ('histogram', 'Seconds spent in each phase of the requests'),
+    'songsearch_provider_calls_total': ('counter', 'Calls made to the providers, by response status'),
+    'songsearch_provider_call_seconds': ('histogram', 'Seconds the calls to the providers took'),
+    'songsearch_cache_lookups_total': ('counter', 'Lookups of the provider results, by cache and result'),
+    'songsearch_cache_backend_entries': ('gauge', 'Entries stored by each Django cache'),
+    'songsearch_cache_backend_bytes': ('gauge', 'Bytes used by each Django cache, stored and before compression'),
+    'songsearch_cache_backend_max_bytes': ('gauge', 'Bytes each Django cache can use before evicting entries'),
+    'songsearch_cache_backend_requests_total': ('counter', 'Gets from each Django cache, by result'),
+    'songsearch_cache_backend_evictions_total': ('counter', 'Entries evicted by each Django cache to stay under its '
+                                                            'bytes'),
+}
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms of the process, rendered in the Prometheus text format
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(float)  # (name, labels) -> value, of the counters and the gauges
+        self.histograms = {}  # (name, labels) -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def increment(self, name, labels, amount=1):
+        with self._lock:
+            self.counters[name, labels] += amount
+
+    def set(self, name, labels, value):
+        with self._lock:
+            self.counters[name, labels] = value
+
+    def observe(self, name, labels, seconds):
+        with self._lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[name, labels] = [0] * (len(BUCKETS) + 2)
+            for index, bucket in enumerate(BUCKETS):
+                if seconds <= bucket:
+                    histogram[index] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: list(values) for key, values in self.histograms.items()}
+
+        lines = []
+        for name, (metric_type, description) in METRICS_HELP.items():
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} {metric_type}']
+            for (metric_name, labels), value in sorted(counters.items()):
+                if metric_name == name:
+                    lines.append(f'{name}{format_labels(labels)} {value:.15g}')
+            for (metric_name, labels), values in sorted(histograms.items()):
+                if metric_name != name:
+                    continue
+                for bucket, count in zip(BUCKETS, values):
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", f"{bucket:g}"),))} {count}')
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {values[-2]}')
+                lines.append(f'{name}_count{format_labels(labels)} {values[-2]}')
+                lines.append(f'{name}_sum{format_labels(labels)} {values[-1]:.6f}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+class RequestMetrics:
+    """
+    Timings and counts of a request, shared with the threads and tasks working for it
+    """
+
+    def __init__(self):
+        self.timings = defaultdict(float)  # Name -> seconds
+        self.counts = defaultdict(Counter)  # Group -> name -> count
+        self.threads = set()  # Idents of the threads working for the request
+        self._lock = threading.Lock()
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.timings[name] += seconds
+
+    def increment(self, group, name):
+        with self._lock:
+            self.counts[group][name] += 1
+
+    def server_timing(self) -> str:
+        """
+        Value of the Server-Timing header, with the timings in milliseconds and the counts in the descriptions
+        """
+        with self._lock:
+            entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.timings.items()]
+            entries += [f'{group};desc="{" ".join(f"{name}={count}" for name, count in sorted(counts.items()))}"'
+                        for group, counts in sorted(self.counts.items())]
+        return ', '.join(entries)
+
+
+registry = MetricsRegistry()
+
+# Metrics of the request being served, None outside of requests
+request_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+
+@contextmanager
+def working_for_request():
+    """
+    Mark the current thread as working for the request of the context while the block runs, so the profiler of the
+    request samples it
+    """
+    metrics = request_metrics.get()
+    if metrics is None:
+        yield
+        return
+    thread_id = threading.get_ident()
+    with metrics._lock:
+        metrics.threads.add(thread_id)
+    try:
+        yield
+    finally:
+        with metrics._lock:
+            metrics.threads.discard(thread_id)
+
+
+def run_for_request(fn, *args, **kwargs):
+    with working_for_request():
+        return fn(*args, **kwargs)
+
+
+def iterate_for_request(iterator, metrics):
+    """
+    Iterate in the context of the request with the metrics, for the body of a streaming response, which is consumed
+    after the middleware has returned the response and left the context of the request
+    """
+    iterator = iter(iterator)
+    while True:
+        token = request_metrics.set(metrics)
+        try:
+            with working_for_request():
+                item = next(iterator, StopIteration)
+        finally:
+            request_metrics.reset(token)
+        if item is StopIteration:
+            return
+        yield item
+
+
+def record_time(name, seconds):
+    registry.observe('songsearch_phase_seconds', (('phase', name),), seconds)
+    metrics = request_metrics.get()
+    if metrics is not None:
+        metrics.add_time(name, seconds)
+
+
+@contextmanager
+def timer(name):
+    """
+    Time the block as a phase of the request, e.g. spotify_search or filter
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_time(name, time.perf_counter() - start)
+
+
+def record_cache_lookup(cache, result):
+    """
+    Count a lookup of the provider results in the search cache or the catalog: hit, stale or miss
+    """
+    registry.increment('songsearch_cache_lookups_total', (('cache', cache), ('result', result)))
+    metrics = request_metrics.get()
+    if metrics is not None:
+        metrics.increment(f'{cache}_cache', result)
+
+
+def record_cache_stats():
+    """
+    Update the metrics of the Django caches that report their usage, such as CompressedLocMemCache
+    """
+    for alias in settings.CACHES:
+        stats = getattr(caches[alias], 'stats', None)
+        if stats is None:
+            continue
+        stats = stats()
+        labels = (('cache', alias),)
+        registry.set('songsearch_cache_backend_entries', labels, stats['entries'])
+        registry.set('songsearch_cache_backend_bytes', labels + (('kind', 'stored'),), stats['bytes'])
+        registry.set('songsearch_cache_backend_bytes', labels + (('kind', 'raw'),), stats['raw_bytes'])
+        registry.set('songsearch_cache_backend_max_bytes', labels, stats['max_bytes'])
+        registry.set('songsearch_cache_backend_requests_total', labels + (('result', 'hit'),), stats['hits'])
+        registry.set('songsearch_cache_backend_requests_total', labels + (('result', 'miss'),), stats['misses'])
+        registry.set('songsearch_cache_backend_evictions_total', labels, stats['evictions'])
+
+
+def record_call(provider, status, seconds=None):
+    """
+    Count a call to a provider by the status of its response, or the reason it failed or was not made
+    """
+    registry.increment('songsearch_provider_calls_total', (('provider', provider), ('status', str(status))))
+    if seconds is None:
+        return  # The call was not made
+    registry.observe('songsearch_provider_call_seconds', (('provider', provider),), seconds)
+    metrics = request_metrics.get()
+    if metrics is not None:
+        metrics.increment('calls', provider.lower())
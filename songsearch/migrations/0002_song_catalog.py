@@ -0,0 +1,40 @@
+# Generated by Django 3.2.15 on 2026-10-17 02:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('songsearch', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchCoverage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('search_term', models.CharField(max_length=200)),
+                ('origin', models.CharField(max_length=200)),
+                ('song_ids', models.JSONField()),
+                ('fetched_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='song',
+            index=models.Index(fields=['origin', 'updated_at'], name='songsearch__origin_b0922e_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='song',
+            constraint=models.UniqueConstraint(fields=('origin', 'provider_song_id'), name='unique_provider_song'),
+        ),
+        migrations.AddConstraint(
+            model_name='searchcoverage',
+            constraint=models.UniqueConstraint(fields=('search_term', 'origin'), name='unique_search_coverage'),
+        ),
+    ]
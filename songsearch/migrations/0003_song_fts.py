@@ -0,0 +1,61 @@
+from django.db import migrations
+
+# Full-text index over the catalog songs, kept up to date by triggers. Only created on SQLite, where FTS5 is available
+CREATE_FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE songsearch_song_fts USING fts5(
+        name, artist, album, content='songsearch_song', content_rowid='id'
+    )
+    """,
+    """
+    CREATE TRIGGER songsearch_song_fts_insert AFTER INSERT ON songsearch_song BEGIN
+        INSERT INTO songsearch_song_fts(rowid, name, artist, album) VALUES (new.id, new.name, new.artist, new.album);
+    END
+    """,
+    """
+    CREATE TRIGGER songsearch_song_fts_delete AFTER DELETE ON songsearch_song BEGIN
+        INSERT INTO songsearch_song_fts(songsearch_song_fts, rowid, name, artist, album)
+        VALUES ('delete', old.id, old.name, old.artist, old.album);
+    END
+    """,
+    """
+    CREATE TRIGGER songsearch_song_fts_update AFTER UPDATE ON songsearch_song BEGIN
+        INSERT INTO songsearch_song_fts(songsearch_song_fts, rowid, name, artist, album)
+        VALUES ('delete', old.id, old.name, old.artist, old.album);
+        INSERT INTO songsearch_song_fts(rowid, name, artist, album) VALUES (new.id, new.name, new.artist, new.album);
+    END
+    """,
+    "INSERT INTO songsearch_song_fts(songsearch_song_fts) VALUES ('rebuild')",
+]
+
+DROP_FTS_SQL = [
+    "DROP TRIGGER IF EXISTS songsearch_song_fts_insert",
+    "DROP TRIGGER IF EXISTS songsearch_song_fts_delete",
+    "DROP TRIGGER IF EXISTS songsearch_song_fts_update",
+    "DROP TABLE IF EXISTS songsearch_song_fts",
+]
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in CREATE_FTS_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_FTS_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('songsearch', '0002_song_catalog'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.15 on 2026-10-17 02:55
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+song_fts = import_module('songsearch.migrations.0003_song_fts')
+
+
+def recreate_fts(apps, schema_editor):
+    # SQLite adds and removes the column by rebuilding the song table, which drops the full-text index triggers
+    song_fts.drop_fts(apps, schema_editor)
+    song_fts.create_fts(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('songsearch', '0003_song_fts'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, recreate_fts),
+        migrations.AddField(
+            model_name='song',
+            name='isrc',
+            field=models.CharField(blank=True, default='', max_length=12),
+        ),
+        migrations.RunPython(recreate_fts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.15 on 2026-10-17 03:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('songsearch', '0004_song_isrc'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('search_term', models.CharField(max_length=200)),
+                ('album', models.CharField(blank=True, default='', max_length=200)),
+                ('genre', models.CharField(blank=True, default='', max_length=200)),
+                ('year', models.CharField(blank=True, default='', max_length=4)),
+                ('day', models.DateField()),
+                ('count', models.PositiveBigIntegerField(default=0)),
+                ('last_searched_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchstat',
+            index=models.Index(fields=['day'], name='songsearch__day_d8ddb2_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='searchstat',
+            constraint=models.UniqueConstraint(fields=('search_term', 'album', 'genre', 'year', 'day'), name='unique_search_stat_day'),
+        ),
+    ]
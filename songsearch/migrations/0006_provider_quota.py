@@ -0,0 +1,23 @@
+# Generated by Django 3.2.15 on 2026-10-17 03:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('songsearch', '0005_search_stat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderQuota',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True)),
+                ('tokens', models.FloatField()),
+                ('updated_at', models.FloatField()),
+                ('blocked_until', models.FloatField(default=0)),
+            ],
+        ),
+    ]
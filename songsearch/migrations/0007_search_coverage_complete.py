@@ -0,0 +1,18 @@
+# Generated by Django 3.2.15 on 2026-10-17 03:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('songsearch', '0006_provider_quota'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchcoverage',
+            name='complete',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -10,3 +10,62 @@ class Song(models.Model):
     genres = models.JSONField()
     duration = models.CharField(max_length=200) #Duration in milliseconds
     origin = models.CharField(max_length=200)
+    isrc = models.CharField(max_length=12, blank=True, default='')  # International Standard Recording Code, when known
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['origin', 'provider_song_id'], name='unique_provider_song'),
+        ]
+        indexes = [
+            models.Index(fields=['origin', 'updated_at']),
+        ]
+
+
+class SearchCoverage(models.Model):
+    """
+    Songs a provider returned for a normalized search term, and when they were fetched
+    """
+    search_term = models.CharField(max_length=200)
+    origin = models.CharField(max_length=200)
+    song_ids = models.JSONField()  # Ids of the catalog songs in the order the provider returned them
+    fetched_at = models.DateTimeField()
+    complete = models.BooleanField(default=False)  # The provider returned fewer songs than a page, so all it has
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['search_term', 'origin'], name='unique_search_coverage'),
+        ]
+
+
+class SearchStat(models.Model):
+    """
+    Number of times a normalized search term was searched with the given filters on a day, to pre-warm the popular
+    ones
+    """
+    search_term = models.CharField(max_length=200)
+    album = models.CharField(max_length=200, blank=True, default='')
+    genre = models.CharField(max_length=200, blank=True, default='')
+    year = models.CharField(max_length=4, blank=True, default='')
+    day = models.DateField()
+    count = models.PositiveBigIntegerField(default=0)
+    last_searched_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['search_term', 'album', 'genre', 'year', 'day'],
+                                    name='unique_search_stat_day'),
+        ]
+        indexes = [
+            models.Index(fields=['day']),
+        ]
+
+
+class ProviderQuota(models.Model):
+    """
+    Token bucket of the calls to a provider, shared by every worker and process through the database
+    """
+    name = models.CharField(max_length=200, unique=True)
+    tokens = models.FloatField()  # Tokens left at updated_at
+    updated_at = models.FloatField()  # Timestamp of the last time the tokens were taken
+    blocked_until = models.FloatField(default=0)  # Timestamp until which the provider asked us not to call it
@@ -0,0 +1,120 @@
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.db import connection
+from . import catalog
+from .cache import search_cache, search_flight
+from .facets import NO_FILTERS, SongResults
+from .ratelimit import BACKGROUND
+from .search_stats import popular_searches
+from .views import (PROVIDERS, answers_filters, cache_songs, fetch_songs, flight_key, provider_cache_key,
+                    provider_executor)
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of pre-warming the songs of a provider for a search term
+FRESH = 'fresh'  # Cached and fresh for longer than the refresh margin
+LOADED = 'loaded'  # Loaded from the catalog
+FETCHED = 'fetched'  # Fetched from the provider
+FAILED = 'failed'  # The provider failed or its quota for background calls was used up
+
+
+def prewarm(limit: int, refresh_ahead: float, rate: float) -> Counter:
+    """
+    Cache the songs of the limit most popular searches that are not cached, or stop being fresh within refresh_ahead
+    seconds. The songs come from the catalog when they stay fresh for longer than refresh_ahead, otherwise from the
+    providers at background priority and at most rate fetches per second, so the searches keep most of the provider
+    quotas. Returns the number of providers and searches with each outcome
+    """
+    if rate <= 0:
+        raise ValueError('The pre-warming rate must be greater than 0')
+    outcomes = Counter()
+    term_songs = {}  # (provider name, search term) -> songs of the term warmed in this run
+
+    def warm(provider, search_term, filters):
+        outcome, songs = prewarm_provider(provider, search_term, filters, refresh_ahead)
+        outcomes[outcome] += 1
+        if outcome in (FETCHED, FAILED):
+            time.sleep(1 / rate)
+        return songs
+
+    for search_term, filters in popular_searches(limit):
+        for provider in PROVIDERS:
+            if (provider.name, search_term) not in term_songs:
+                term_songs[provider.name, search_term] = warm(provider, search_term, NO_FILTERS)
+            # The songs of the term only answer the filters when they are complete, otherwise they are fetched
+            songs = term_songs[provider.name, search_term]
+            if filters and not (isinstance(songs, SongResults) and answers_filters(songs, filters)):
+                warm(provider, search_term, filters)
+    return outcomes
+
+
+def prewarm_provider(provider, search_term, filters, refresh_ahead):
+    """
+    Pre-warm the songs of a provider for a search, and return the outcome and the songs, None when it failed
+    """
+    cache_key = provider_cache_key(provider, search_term, filters)
+    cached = search_cache.get(cache_key)
+    if cached is not None and cached[1] - time.time() > refresh_ahead:
+        return FRESH, cached[0]
+
+    # The catalog songs stay fresh for SONGSEARCH_SEARCH_CACHE_TIMEOUT seconds since they were fetched
+    max_age = min(settings.SONGSEARCH_SEARCH_CACHE_TIMEOUT, settings.SONGSEARCH_CATALOG_MAX_AGE) - refresh_ahead
+    if not filters:  # The catalog only has the songs of the terms
+        songs = catalog.find_songs(provider.name, search_term, max_age)
+        if songs is not None:
+            return LOADED, cache_songs(cache_key, songs)
+
+    # Concurrent refreshes of the same songs join this fetch, the searches fetch them on their own instead of waiting
+    # for a fetch that gives way to them when the provider quota runs low
+    future = search_flight.submit(provider_executor, flight_key(cache_key, priority=BACKGROUND), fetch_songs,
+                                  provider, search_term, False, BACKGROUND, filters, max_age)
+    try:
+        songs = future.result()
+    except ValueError:
+        return FAILED, None
+    return FETCHED, songs
+
+
+class PrewarmScheduler(threading.Thread):
+    """
+    Pre-warms the popular searches when the process starts, and then every interval seconds to refresh them before
+    they stop being fresh
+    """
+
+    def __init__(self, interval: float):
+        super().__init__(name='prewarm', daemon=True)
+        self.interval = interval
+
+    def run(self):
+        while True:
+            try:
+                outcomes = prewarm(settings.SONGSEARCH_PREWARM_TOP, settings.SONGSEARCH_PREWARM_REFRESH_AHEAD,
+                                   settings.SONGSEARCH_PREWARM_RATE)
+                logger.info('Pre-warmed the popular searches: %s', dict(outcomes))
+            except Exception:
+                logger.exception('Error pre-warming the popular searches')
+            finally:
+                connection.close()  # Not reused until the next run
+            # The workers drift apart, so they do not fetch the same songs at the same time
+            time.sleep(self.interval * random.uniform(0.9, 1.1))
+
+
+prewarm_scheduler = None
+prewarm_scheduler_lock = threading.Lock()
+
+
+def start_scheduler():
+    """
+    Start pre-warming the popular searches in the background when SONGSEARCH_PREWARM_SCHEDULER is enabled
+    """
+    global prewarm_scheduler
+    if not settings.SONGSEARCH_PREWARM_SCHEDULER:
+        return
+    with prewarm_scheduler_lock:
+        if prewarm_scheduler is None:
+            prewarm_scheduler = PrewarmScheduler(settings.SONGSEARCH_PREWARM_INTERVAL)
+            prewarm_scheduler.start()
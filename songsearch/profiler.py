@@ -0,0 +1,51 @@
+import os
+import sys
+import threading
+from collections import Counter
+from django.conf import settings
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the threads working for a request every SONGSEARCH_PROFILER_INTERVAL seconds, so the time
+    of the request is attributed to the functions it went through, including the provider threads working for it.
+    Under ASGI the event loop thread is shared, so its stacks include the other requests served at the same time
+    """
+
+    def __init__(self, interval: float, threads):
+        self.interval = interval
+        self.threads = threads  # Idents of the threads to sample, updated while the request is served
+        self.samples = Counter()  # Folded stack -> number of samples
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        project_dir = str(settings.BASE_DIR) + os.sep
+        while not self._stop.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id not in self.threads:
+                    continue
+                stack = []
+                in_project = False
+                while frame is not None:
+                    code = frame.f_code
+                    in_project = in_project or code.co_filename.startswith(project_dir)
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                if in_project:  # Idle threads are left out
+                    stack.append(thread_names.get(thread_id, str(thread_id)))
+                    self.samples[';'.join(reversed(stack))] += 1
+
+    def folded_stacks(self) -> str:
+        """
+        The samples in the folded format read by flame graph tools, one stack and its count per line
+        """
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
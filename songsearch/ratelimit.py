@@ -0,0 +1,125 @@
+import contextvars
+import email.utils
+import logging
+import time
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import ExpressionWrapper, F, FloatField, Value
+from django.db.models.functions import Greatest, Least
+from .models import ProviderQuota
+
+logger = logging.getLogger(__name__)
+
+# Priorities of the calls to the providers
+INTERACTIVE = 'interactive'  # A client is waiting for the response
+BACKGROUND = 'background'  # Refreshes of cached results, shed first when the quota runs low
+
+# Priority of the provider calls made by the current fetch
+request_priority = contextvars.ContextVar('request_priority', default=INTERACTIVE)
+
+# Seconds a provider is left alone after answering 429 without a valid Retry-After header
+DEFAULT_RETRY_AFTER = 5
+
+# Seconds waited at least for a token, so rounding errors do not turn into a busy loop
+MIN_WAIT = 0.01
+
+
+class RateLimited(ValueError):
+    """
+    Raised instead of calling a provider that is throttling us or whose quota is used up
+    """
+
+
+class RateLimiter:
+    """
+    Token bucket of a provider shared by every worker and process through the database. The bucket holds up to
+    SONGSEARCH_RATE_LIMIT_BURST of the quota and is refilled with the rest over the window, so no window of that many
+    seconds gets more calls than the quota. Tokens are taken with a conditional UPDATE, which is atomic in every
+    database. As a single statement, SQLite makes it wait for the other writers, such as the catalog, instead of
+    failing, so it needs no lock of the process. Background calls leave part of the tokens to the searches, and no call
+    is made while the provider asks us to retry later. Providers without a quota never query the database, only the
+    process that got their Retry-After stops calling them
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._created = False
+        self._blocked_until = 0  # Timestamp until which the provider asked this process not to call it
+
+    def acquire(self):
+        """
+        Take a token for a call to the provider, waiting up to SONGSEARCH_RATE_LIMIT_MAX_WAIT seconds for it.
+        Raises RateLimited if the call has to be shed
+        """
+        if self._blocked_until > time.time():
+            raise RateLimited(f"{self.name} asked to retry later")
+        quota = settings.SONGSEARCH_RATE_LIMITS.get(self.name)
+        if quota is None:
+            return
+        capacity, rate = bucket_size(*quota)
+        needed = 1
+        priority = request_priority.get()
+        if priority == BACKGROUND:
+            # Leave part of the rest of the burst to the searches, a bucket of one token is not split
+            needed += (capacity - 1) * (1 - settings.SONGSEARCH_RATE_LIMIT_BACKGROUND_SHARE)
+
+        try:
+            self._create_bucket(capacity)
+            while True:
+                now = time.time()
+                bucket = ProviderQuota.objects.filter(name=self.name)
+                tokens = ExpressionWrapper(Least(Value(capacity), F('tokens') + (now - F('updated_at')) * rate),
+                                           output_field=FloatField())
+                taken = bucket.filter(blocked_until__lte=now).annotate(available=tokens).filter(
+                    available__gte=needed).update(tokens=tokens - 1, updated_at=now)
+                if taken:
+                    return
+
+                available, blocked_until = bucket.values_list('tokens', 'blocked_until').get()
+                if blocked_until > now:
+                    raise RateLimited(f"{self.name} asked to retry later")
+                wait = max((needed - available) / rate, MIN_WAIT)
+                if priority == BACKGROUND or wait > settings.SONGSEARCH_RATE_LIMIT_MAX_WAIT:
+                    raise RateLimited(f"{self.name} quota of {quota[0]} calls every {quota[1]} seconds is used up")
+                time.sleep(wait)
+        except DatabaseError:
+            # The provider still sends 429 responses when the quota is exceeded
+            logger.exception('Error taking a token of the %s quota', self.name)
+
+    def _create_bucket(self, capacity):
+        if self._created:
+            return
+        ProviderQuota.objects.get_or_create(name=self.name, defaults={'tokens': capacity, 'updated_at': time.time()})
+        self._created = True
+
+    def throttled(self, retry_after=None):
+        """
+        Stop calling the provider for the time given in its Retry-After header, in seconds or as a date
+        """
+        seconds = DEFAULT_RETRY_AFTER
+        if retry_after:
+            if retry_after.isdigit():
+                seconds = int(retry_after)
+            else:
+                try:
+                    seconds = email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    pass
+        blocked_until = time.time() + max(seconds, 1)
+        self._blocked_until = max(self._blocked_until, blocked_until)
+        if self.name not in settings.SONGSEARCH_RATE_LIMITS:
+            return  # No bucket to tell the other processes
+        try:
+            ProviderQuota.objects.filter(name=self.name).update(
+                blocked_until=Greatest(F('blocked_until'), Value(blocked_until)))
+        except DatabaseError:
+            logger.exception('Error blocking the calls to %s', self.name)
+
+
+def bucket_size(limit: int, window: int):
+    """
+    Return the tokens the bucket of a quota of limit calls per window of seconds holds, and the tokens it gets back
+    per second
+    """
+    capacity = max(limit * settings.SONGSEARCH_RATE_LIMIT_BURST, 1)
+    return capacity, max(limit - capacity, 1) / window
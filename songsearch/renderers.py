@@ -0,0 +1,59 @@
+from rest_framework import renderers
+from rest_framework.utils import encoders
+from .metrics import timer
+from .results import SongResult, encode_json
+
+
+class SongJSONEncoder(encoders.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, SongResult):
+            return obj.to_dict()
+        return super().default(obj)
+
+
+class SongJSONRenderer(renderers.JSONRenderer):
+    """
+    JSON renderer that copies the encoding of the songs into the response instead of serializing them again.
+    Indented responses, such as the ones of the browsable API, are rendered by the DRF JSON renderer
+    """
+    encoder_class = SongJSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            with timer('serialize'):
+                return encode_json(data)
+        except TypeError:
+            # Values that only the DRF encoder knows, such as dates
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class NDJSONRenderer(renderers.BaseRenderer):
+    """
+    Newline delimited JSON, one event per line
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return self.encode_event('error', data)
+
+    @staticmethod
+    def encode_event(event, data):
+        return encode_json({'event': event, **data}) + b'\n'
+
+
+class EventStreamRenderer(renderers.BaseRenderer):
+    """
+    Server-sent events
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return self.encode_event('error', data)
+
+    @staticmethod
+    def encode_event(event, data):
+        return f'event: {event}\ndata: '.encode('utf-8') + encode_json(data) + b'\n\n'
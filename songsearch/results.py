@@ -0,0 +1,67 @@
+import json
+
+# Fields of a song in the responses, in order
+SONG_FIELDS = ('name', 'provider_song_id', 'album', 'artist', 'album_cover', 'year_release_date', 'genres', 'duration',
+               'origin', 'isrc')
+
+# Fields given as text in the responses, whatever type the provider sends them as
+TEXT_FIELDS = frozenset(SONG_FIELDS) - {'genres'}
+
+# The same encoding as the DRF JSON renderer
+json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), allow_nan=False)
+
+
+def dumps(value) -> str:
+    # Line and paragraph separators are valid JSON but not valid JavaScript, DRF escapes them too
+    return json_encoder.encode(value).replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+
+# The keys of the song fields are encoded once, a song is then the encoded values joined with them
+SONG_KEYS = [dumps(field) + ':' for field in SONG_FIELDS]
+
+
+class SongResult:
+    """
+    A song found by a provider, with its JSON encoding computed once when it is created. The encoding is cached
+    along with the fields, so the responses served from the cache are built without serializing the songs again.
+    Songs are not modified after they are created, since the encoding would no longer match
+    """
+    __slots__ = SONG_FIELDS + ('json',)
+
+    def __init__(self, name='', provider_song_id='', album='', artist='', album_cover='', year_release_date='',
+                 genres='', duration='', origin='', isrc=''):
+        values = (name, provider_song_id, album, artist, album_cover, year_release_date, genres, duration, origin, isrc)
+        for field, value in zip(SONG_FIELDS, values):
+            if value is not None and field in TEXT_FIELDS:
+                value = str(value)
+            setattr(self, field, value)
+        self.json = encode_song(self)
+
+    def __repr__(self):
+        return f'SongResult({self.origin}, {self.provider_song_id}, {self.name!r})'
+
+    @classmethod
+    def from_model(cls, song):
+        return cls(**{field: getattr(song, field) for field in SONG_FIELDS})
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in SONG_FIELDS}
+
+
+def encode_song(song: SongResult) -> bytes:
+    return ('{' + ','.join(key + dumps(getattr(song, field))
+                           for key, field in zip(SONG_KEYS, SONG_FIELDS)) + '}').encode('utf-8')
+
+
+def encode_json(data) -> bytes:
+    """
+    Encode data holding songs as compact JSON, reusing the encoding of every song
+    """
+    if isinstance(data, SongResult):
+        return data.json
+    if isinstance(data, (list, tuple)):
+        return b'[' + b','.join([encode_json(item) for item in data]) + b']'
+    if isinstance(data, dict):
+        return b'{' + b','.join([dumps(str(key)).encode('utf-8') + b':' + encode_json(value)
+                                 for key, value in data.items()]) + b'}'
+    return dumps(data).encode('utf-8')
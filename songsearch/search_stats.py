@@ -0,0 +1,82 @@
+import datetime
+import logging
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+from .catalog import catalog_write_lock
+from .facets import SongFilters
+from .models import SearchStat
+
+logger = logging.getLogger(__name__)
+
+
+class SearchStats:
+    """
+    Counts the searches by normalized term and filters in memory, and adds the counts to the database every
+    flush_interval seconds from a background thread, so the requests never wait for the write
+    """
+
+    def __init__(self, flush_interval: int):
+        self.flush_interval = flush_interval
+        self.counts = Counter()  # (search term, filters) -> searches since the last flush
+        self.flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, search_term: str, filters: SongFilters):
+        with self._lock:
+            self.counts[search_term, filters] += 1
+            if time.monotonic() - self.flushed_at < self.flush_interval:
+                return
+            self.flushed_at = time.monotonic()
+        threading.Thread(target=self.flush_in_background, name='search-stats', daemon=True).start()
+
+    def flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            connection.close()  # The connection of the thread would stay open until it is garbage collected
+
+    def flush(self):
+        with self._lock:
+            counts, self.counts = self.counts, Counter()
+        if not counts:
+            return
+        now = timezone.now()
+        try:
+            with catalog_write_lock, transaction.atomic():
+                for (search_term, filters), count in counts.items():
+                    search = dict(search_term=search_term, day=now.date(), **filters._asdict())
+                    updated = SearchStat.objects.filter(**search).update(count=F('count') + count, last_searched_at=now)
+                    if not updated:
+                        SearchStat.objects.create(count=count, last_searched_at=now, **search)
+                # The days before the window are no longer read
+                SearchStat.objects.filter(day__lt=first_window_day(now)).delete()
+        except DatabaseError:
+            # The counts only choose the searches to pre-warm, losing some of them is harmless
+            logger.exception('Error storing the search counts')
+
+
+def first_window_day(now):
+    """
+    First day counted in the SONGSEARCH_PREWARM_WINDOW seconds before now, the counts are kept per day
+    """
+    return (now - datetime.timedelta(seconds=settings.SONGSEARCH_PREWARM_WINDOW)).date()
+
+
+def popular_searches(limit: int):
+    """
+    Return the normalized terms and filters searched the most over the days of the last SONGSEARCH_PREWARM_WINDOW
+    seconds
+    """
+    stats = (SearchStat.objects.filter(day__gte=first_window_day(timezone.now()))
+             .values('search_term', 'album', 'genre', 'year')
+             .annotate(searches=Sum('count'), searched_at=Max('last_searched_at'))
+             .order_by('-searches', '-searched_at')[:limit])
+    return [(stat['search_term'], SongFilters(stat['album'], stat['genre'], stat['year'])) for stat in stats]
+
+
+search_stats = SearchStats(settings.SONGSEARCH_SEARCH_STATS_FLUSH_INTERVAL)
@@ -1,9 +1,35 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Song
 
-class SongSerializer(serializers.ModelSerializer):
-    genres = serializers.JSONField()
 
-    class Meta:
-        model = Song
-        fields = ['name', 'provider_song_id', 'album', 'artist', 'album_cover', 'year_release_date', 'genres', 'duration', 'origin']
+class SearchSerializer(serializers.Serializer):
+    search_term = serializers.CharField(trim_whitespace=False)  # Kept as sent, since the results are keyed by it
+    album = serializers.CharField(required=False, allow_blank=True)
+    genre = serializers.CharField(required=False, allow_blank=True)
+    year = serializers.CharField(required=False, allow_blank=True)
+
+
+class BatchSearchSerializer(serializers.Serializer):
+    # Each search is validated on its own by validate_searches, so a bad one does not fail the batch
+    searches = serializers.ListField(allow_empty=False, max_length=settings.SONGSEARCH_BATCH_MAX_SEARCHES)
+
+
+def validate_searches(searches):
+    """
+    Validate each search of a batch with SearchSerializer. Returns the valid searches and the errors of the others
+    by their position in the batch
+    """
+    valid_searches = []
+    errors = {}
+    search_terms = set()
+    for position, search in enumerate(searches):
+        serializer = SearchSerializer(data=search)
+        if not serializer.is_valid():
+            errors[position] = serializer.errors
+        elif serializer.validated_data['search_term'] in search_terms:
+            # The results are keyed by search term
+            errors[position] = {'search_term': ['Each search term can only appear once']}
+        else:
+            search_terms.add(serializer.validated_data['search_term'])
+            valid_searches.append(serializer.validated_data)
+    return valid_searches, errors
@@ -0,0 +1,153 @@
+import bisect
+import heapq
+import threading
+from django.conf import settings
+from django.db import connection
+from . import catalog
+from .merge import normalize_text
+
+# Kinds of suggestion
+SONG = 'song'
+ARTIST = 'artist'
+
+# Words of a name indexed as the start of a key, so "cross" also suggests "Christopher Cross"
+MAX_INDEXED_WORDS = 4
+
+# New keys are inserted in a small sorted array, merged into the main one once it holds this many keys. Inserting
+# in the main array moves all the keys after the new one
+MAX_RECENT_KEYS = 5000
+
+
+class SuggestionIndex:
+    """
+    In-process prefix index of the song names and artists returned by the searches, ranked by the number of times
+    they were returned. The keys are kept in sorted arrays, so the suggestions of a prefix are the keys following
+    its position found by bisection
+    """
+
+    def __init__(self, max_entries: int, max_scanned: int):
+        self.max_entries = max_entries
+        self.max_scanned = max_scanned  # Keys read per lookup, bounds the time short prefixes take
+        self.keys = []  # Sorted (normalized text, entry id)
+        self.recent_keys = []  # Sorted keys added since the last merge into keys
+        self.entries = {}  # Entry id -> [popularity, suggestion]
+        self.entry_ids = {}  # (kind, normalized name, normalized artist) -> entry id
+        self.next_id = 0
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def add_songs(self, songs):
+        """
+        Add the songs to the index, or raise their popularity if they are already in it
+        """
+        with self._lock:
+            for song in songs:
+                name = normalize_text(song.name)
+                if name:
+                    self._add((SONG, name, normalize_text(song.artist)), name,
+                              {'text': song.name, 'type': SONG, 'artist': song.artist})
+                for artist in str(song.artist).split(', '):
+                    normalized_artist = normalize_text(artist)
+                    if normalized_artist:
+                        self._add((ARTIST, normalized_artist, ''), normalized_artist, {'text': artist, 'type': ARTIST})
+            if len(self.entries) > self.max_entries:
+                self._evict()
+
+    def load(self, songs):
+        """
+        Add many songs to the index, e.g. the ones of the catalog, without blocking the lookups and the searches for
+        as long. The songs are indexed apart, and the index is swapped with them along with the songs added meanwhile
+        """
+        index = SuggestionIndex(self.max_entries, self.max_scanned)
+        index.add_songs(songs)
+        with self._lock:
+            for identity, entry_id in self.entry_ids.items():
+                popularity, suggestion = self.entries[entry_id]
+                index._add(identity, identity[1], suggestion, popularity)
+            if len(index.entries) > self.max_entries:
+                index._evict()
+            self.keys, self.recent_keys = index.keys, index.recent_keys
+            self.entries, self.entry_ids, self.next_id = index.entries, index.entry_ids, index.next_id
+            self.loaded = True
+
+    def _add(self, identity, text, suggestion, popularity=1):
+        entry_id = self.entry_ids.get(identity)
+        if entry_id is not None:
+            self.entries[entry_id][0] += popularity
+            return
+        entry_id = self.entry_ids[identity] = self.next_id
+        self.next_id += 1
+        self.entries[entry_id] = [popularity, suggestion]
+        words = text.split()
+        for start in range(min(len(words), MAX_INDEXED_WORDS)):
+            bisect.insort(self.recent_keys, (' '.join(words[start:]), entry_id))
+        if len(self.recent_keys) >= MAX_RECENT_KEYS:
+            self.keys += self.recent_keys
+            self.keys.sort()  # Merges the two sorted runs in linear time
+            self.recent_keys = []
+
+    def _evict(self):
+        # Keeps the most popular 90%, so evictions are rare and each one rebuilds the keys once
+        kept = set(heapq.nlargest(int(self.max_entries * 0.9), self.entries,
+                                  key=lambda entry_id: self.entries[entry_id][0]))
+        self.keys = [key for key in self.keys if key[1] in kept]
+        self.recent_keys = [key for key in self.recent_keys if key[1] in kept]
+        self.entries = {entry_id: entry for entry_id, entry in self.entries.items() if entry_id in kept}
+        self.entry_ids = {identity: entry_id for identity, entry_id in self.entry_ids.items() if entry_id in kept}
+
+    def suggest(self, prefix: str, limit: int):
+        """
+        Return the most popular suggestions with a word starting with the prefix
+        """
+        prefix = normalize_text(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            matches = set()
+            for keys in (self.keys, self.recent_keys):
+                position = bisect.bisect_left(keys, (prefix,))
+                for key, entry_id in keys[position:position + self.max_scanned]:
+                    if not key.startswith(prefix):
+                        break
+                    matches.add(entry_id)
+            best = heapq.nlargest(limit, matches, key=lambda entry_id: (self.entries[entry_id][0], -entry_id))
+            return [self.entries[entry_id][1] for entry_id in best]
+
+
+suggestion_index = SuggestionIndex(settings.SONGSEARCH_SUGGEST_MAX_ENTRIES, settings.SONGSEARCH_SUGGEST_MAX_SCANNED)
+suggestion_index_lock = threading.Lock()
+
+
+def load_suggestions():
+    """
+    Load the most recent songs of the catalog into the index of the process, unless they are loaded or loading
+    """
+    if suggestion_index.loaded or not suggestion_index_lock.acquire(blocking=False):
+        return
+    try:
+        if not suggestion_index.loaded:
+            suggestion_index.load(catalog.recent_songs(settings.SONGSEARCH_SUGGEST_CATALOG_SONGS))
+    finally:
+        suggestion_index_lock.release()
+
+
+def start_loading():
+    """
+    Load the suggestions in the background, so the first ones already include the catalog songs
+    """
+    def run():
+        try:
+            load_suggestions()
+        finally:
+            connection.close()  # Not reused by the thread
+
+    threading.Thread(target=run, name='load-suggestions', daemon=True).start()
+
+
+def suggest(prefix: str, limit: int):
+    """
+    Suggestions for the prefix. The index of each process starts from the most recent songs of the catalog, and
+    answers from the songs of the searches while they load
+    """
+    load_suggestions()
+    return suggestion_index.suggest(prefix, limit)
@@ -1,3 +1,792 @@
-from django.test import TestCase
+import contextvars
+import datetime
+import json
+import os
+import threading
+import time
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import OperationalError
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+from SongSearchAPI.cache import ENTRY_OVERHEAD, CompressedLocMemCache
+from SongSearchAPI.middleware import server_timing_middleware
+from . import catalog
+from .cache import search_cache, search_flight
+from .conditional import not_modified, results_etag
+from .facets import NO_FILTERS, SongFilters, SongResults, filter_results
+from .health import CLOSED, HALF_OPEN, OPEN, ProviderHealth, ProviderUnavailable
+from .merge import merge_songs
+from .metrics import request_metrics
+from .models import SearchCoverage
+from .prewarm import FETCHED, prewarm
+from .ratelimit import BACKGROUND, RateLimited, RateLimiter, request_priority
+from .renderers import SongJSONRenderer
+from .results import SongResult, encode_json
+from .suggest import SuggestionIndex, suggest, suggestion_index_lock
+from .tokens import TokenManager
+from .views import (PAGE_SIZE, PROVIDERS, SongViewSet, cached_validators, fetch_songs, filter_songs, flight_key,
+                    provider_cache_key, provider_executor, search_providers, submit_fetch)
 
-# Create your tests here.
+
+class Clock:
+    """
+    Clock moved by hand
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@override_settings(SONGSEARCH_BREAKER_FAILURES=3, SONGSEARCH_BREAKER_COOLDOWN=30, SONGSEARCH_BREAKER_PROBES=2)
+class ProviderHealthTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('songsearch.health.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.health = ProviderHealth('Test')
+
+    def open_breaker(self):
+        for _ in range(3):
+            self.health.record_failure()
+
+    def test_stays_closed_below_the_failure_threshold(self):
+        self.health.record_failure()
+        self.health.record_failure()
+        self.assertEqual(self.health.state, CLOSED)
+        self.assertTrue(self.health.allow_request())
+
+    def test_success_resets_the_consecutive_failures(self):
+        self.health.record_failure()
+        self.health.record_failure()
+        self.health.record_success(0.1)
+        self.health.record_failure()
+        self.assertEqual(self.health.state, CLOSED)
+
+    def test_opens_after_consecutive_failures(self):
+        self.open_breaker()
+        self.assertEqual(self.health.state, OPEN)
+        self.assertFalse(self.health.allow_request())
+        with self.assertRaises(ProviderUnavailable):
+            self.health.check()
+
+    def test_lets_probes_through_after_the_cooldown(self):
+        self.open_breaker()
+        self.clock.now += 30
+        self.assertTrue(self.health.allow_request())
+        self.assertEqual(self.health.state, HALF_OPEN)
+        self.assertTrue(self.health.allow_request())
+        self.assertFalse(self.health.allow_request())
+
+    def test_closes_when_a_probe_succeeds(self):
+        self.open_breaker()
+        self.clock.now += 30
+        self.health.allow_request()
+        self.health.record_success(0.1)
+        self.assertEqual(self.health.state, CLOSED)
+        self.assertTrue(self.health.allow_request())
+
+    def test_reopens_when_a_probe_fails(self):
+        self.open_breaker()
+        self.clock.now += 30
+        self.health.allow_request()
+        self.health.record_failure()
+        self.assertEqual(self.health.state, OPEN)
+        self.assertFalse(self.health.allow_request())
+        self.clock.now += 30
+        self.assertTrue(self.health.allow_request())
+
+    def test_probes_without_an_outcome_do_not_block_the_provider_for_good(self):
+        self.open_breaker()
+        self.clock.now += 30
+        # Probes that end without calling the provider record neither a success nor a failure
+        self.assertTrue(self.health.allow_request())
+        self.assertTrue(self.health.allow_request())
+        self.assertFalse(self.health.allow_request())
+        self.clock.now += 29
+        self.assertFalse(self.health.allow_request())
+        self.clock.now += 1
+        self.assertTrue(self.health.allow_request())
+        self.assertEqual(self.health.state, HALF_OPEN)
+        self.health.record_success(0.1)
+        self.assertEqual(self.health.state, CLOSED)
+
+
+@override_settings(SONGSEARCH_RATE_LIMITS={'Test': (20, 60)}, SONGSEARCH_RATE_LIMIT_BURST=0.1,
+                   SONGSEARCH_RATE_LIMIT_BACKGROUND_SHARE=0.5, SONGSEARCH_RATE_LIMIT_MAX_WAIT=5)
+class RateLimiterTests(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        for patcher in (mock.patch('songsearch.ratelimit.time.time', self.clock),
+                        mock.patch('songsearch.ratelimit.time.sleep', self.sleep)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.sleeps = []
+        self.limiter = RateLimiter('Test')
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.clock.now += seconds
+
+    def test_takes_the_burst_at_once(self):
+        self.limiter.acquire()
+        self.limiter.acquire()
+        self.assertEqual(self.sleeps, [])
+
+    def test_waits_for_the_next_token(self):
+        self.limiter.acquire()
+        self.limiter.acquire()
+        self.limiter.acquire()
+        # The other 18 calls of the quota are spread over the 60 seconds
+        self.assertAlmostEqual(sum(self.sleeps), 60 / 18, places=1)
+
+    def test_sheds_calls_that_would_wait_too_long(self):
+        with override_settings(SONGSEARCH_RATE_LIMIT_MAX_WAIT=0):
+            self.limiter.acquire()
+            self.limiter.acquire()
+            with self.assertRaises(RateLimited):
+                self.limiter.acquire()
+
+    def test_never_exceeds_the_quota_in_a_window(self):
+        calls = []
+        start = self.clock.now
+        while self.clock.now < start + 60:
+            self.limiter.acquire()
+            calls.append(self.clock.now)
+        self.assertLessEqual(len([call for call in calls if call < start + 60]), 20)
+
+    def test_background_calls_leave_tokens_to_the_searches(self):
+        token = request_priority.set(BACKGROUND)
+        self.addCleanup(request_priority.reset, token)
+        self.limiter.acquire()
+        with self.assertRaises(RateLimited):
+            self.limiter.acquire()
+        self.assertEqual(self.sleeps, [])
+
+    def test_shares_the_bucket_between_limiters(self):
+        other = RateLimiter('Test')
+        self.limiter.acquire()
+        other.acquire()
+        with override_settings(SONGSEARCH_RATE_LIMIT_MAX_WAIT=0):
+            with self.assertRaises(RateLimited):
+                self.limiter.acquire()
+
+    def test_blocks_the_calls_after_retry_after(self):
+        self.limiter.acquire()
+        self.limiter.throttled('30')
+        with self.assertRaises(RateLimited):
+            self.limiter.acquire()
+        self.clock.now += 30
+        self.limiter.acquire()
+
+    def test_retry_after_blocks_the_other_processes(self):
+        self.limiter.acquire()
+        self.limiter.throttled('30')
+        with self.assertRaises(RateLimited):
+            RateLimiter('Test').acquire()
+
+    def test_providers_without_a_quota_do_not_query_the_database(self):
+        limiter = RateLimiter('Unlimited')
+        with self.assertNumQueries(0):
+            for _ in range(100):
+                limiter.acquire()
+            limiter.throttled('30')
+            with self.assertRaises(RateLimited):
+                limiter.acquire()
+            self.clock.now += 30
+            limiter.acquire()
+
+
+class CompressedLocMemCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('SongSearchAPI.cache.time.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # BaseCache computes the expirations with its own reference to time
+        patcher = mock.patch('django.core.cache.backends.base.time.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = self.create_cache(max_bytes=10000)
+
+    def create_cache(self, **options):
+        cache = CompressedLocMemCache(self.id(), {'OPTIONS': {name.upper(): value for name, value in options.items()}})
+        cache.clear()
+        return cache
+
+    def test_stores_the_values_compressed(self):
+        value = ['song %d' % number for number in range(100)]
+        self.cache.set('key', value)
+        self.assertEqual(self.cache.get('key'), value)
+        stats = self.cache.stats()
+        self.assertEqual(stats['entries'], 1)
+        self.assertLess(stats['bytes'] - len(self.cache.make_key('key')) - ENTRY_OVERHEAD, stats['raw_bytes'])
+
+    def test_leaves_small_values_uncompressed(self):
+        self.cache.set('key', 1)
+        stats = self.cache.stats()
+        self.assertEqual(stats['bytes'], len(self.cache.make_key('key')) + stats['raw_bytes'] + ENTRY_OVERHEAD)
+
+    def test_missing_keys(self):
+        self.assertIsNone(self.cache.get('missing'))
+        self.assertEqual(self.cache.get('missing', 'default'), 'default')
+        self.assertFalse(self.cache.has_key('missing'))
+        self.assertFalse(self.cache.delete('missing'))
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    def test_add_only_sets_missing_keys(self):
+        self.assertTrue(self.cache.add('key', 1))
+        self.assertFalse(self.cache.add('key', 2))
+        self.assertEqual(self.cache.get('key'), 1)
+
+    def test_expires_the_values(self):
+        self.cache.set('key', 1, timeout=10)
+        self.clock.now += 9
+        self.assertEqual(self.cache.get('key'), 1)
+        self.clock.now += 1
+        self.assertIsNone(self.cache.get('key'))
+        self.assertTrue(self.cache.add('key', 2, timeout=10))
+        self.assertEqual(self.cache.stats()['entries'], 1)
+
+    def test_touch_extends_the_expiration(self):
+        self.cache.set('key', 1, timeout=10)
+        self.assertTrue(self.cache.touch('key', timeout=20))
+        self.clock.now += 15
+        self.assertEqual(self.cache.get('key'), 1)
+        self.assertFalse(self.cache.touch('missing'))
+
+    def test_incr_keeps_the_expiration(self):
+        self.cache.set('key', 1, timeout=10)
+        self.assertEqual(self.cache.incr('key'), 2)
+        self.assertEqual(self.cache.decr('key', 3), -1)
+        self.clock.now += 10
+        self.assertIsNone(self.cache.get('key'))
+        with self.assertRaises(ValueError):
+            self.cache.incr('key')
+
+    def test_evicts_the_least_recently_used_entries(self):
+        value = os.urandom(3000)  # Random bytes do not compress
+        self.cache.set('a', value)
+        self.cache.set('b', value)
+        self.cache.set('c', value)
+        self.cache.get('a')
+        self.cache.set('d', value)
+        self.assertTrue(self.cache.has_key('a'))
+        self.assertFalse(self.cache.has_key('b'))
+        stats = self.cache.stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['entries'], 3)
+        self.assertLessEqual(stats['bytes'], stats['max_bytes'])
+
+    def test_skips_values_larger_than_the_budget(self):
+        self.cache.set('a', 1)
+        self.cache.set('big', os.urandom(20000))
+        self.assertIsNone(self.cache.get('big'))
+        self.assertFalse(self.cache.add('big', os.urandom(20000)))
+        self.assertEqual(self.cache.get('a'), 1)
+
+    def test_accounting_returns_to_zero(self):
+        self.cache.set('a', os.urandom(3000))
+        self.cache.set('a', 1)
+        self.cache.set('b', ['song'] * 100)
+        self.cache.incr('a')
+        self.cache.delete('a')
+        self.cache.delete('b')
+        stats = self.cache.stats()
+        self.assertEqual((stats['entries'], stats['bytes'], stats['raw_bytes']), (0, 0, 0))
+
+    def test_shares_the_entries_between_instances(self):
+        self.cache.set('key', 1)
+        self.assertEqual(CompressedLocMemCache(self.id(), {}).get('key'), 1)
+
+
+def make_song(name, album='Album', genres='Pop', year='2000', origin='iTunes', **fields):
+    return SongResult(name=name, provider_song_id=name, album=album, artist='Artist', genres=genres,
+                      year_release_date=year, origin=origin, **fields)
+
+
+class FilterResultsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.songs = [
+            make_song('a', album='First', genres='Pop, Rock', year='2000'),
+            make_song('b', album='Second', genres='Jazz', year='2000'),
+            make_song('c', album='First', genres='Hard Rock', year='2001'),
+            make_song('d', album='Second', genres='Pop', year='2001'),
+        ]
+
+    def names(self, songs):
+        return [song.name for song in songs]
+
+    def test_without_filters_returns_every_song(self):
+        self.assertEqual(self.names(filter_results(SongResults(self.songs), NO_FILTERS)), ['a', 'b', 'c', 'd'])
+
+    def test_album_and_year_must_be_equal(self):
+        results = SongResults(self.songs)
+        self.assertEqual(self.names(filter_results(results, SongFilters('First', '', ''))), ['a', 'c'])
+        self.assertEqual(self.names(filter_results(results, SongFilters('', '', '2001'))), ['c', 'd'])
+        self.assertEqual(self.names(filter_results(results, SongFilters('Firs', '', ''))), [])
+
+    def test_genre_only_has_to_be_part_of_the_genres(self):
+        results = SongResults(self.songs)
+        self.assertEqual(self.names(filter_results(results, SongFilters('', 'rock', ''))), ['a', 'c'])
+
+    def test_combines_the_filters(self):
+        results = SongResults(self.songs)
+        self.assertEqual(self.names(filter_results(results, SongFilters('First', 'rock', '2001'))), ['c'])
+        self.assertEqual(self.names(filter_results(results, SongFilters('Second', 'pop', '2000'))), [])
+
+    def test_the_facet_index_matches_checking_every_song(self):
+        results = SongResults(self.songs)
+        for album in ('', 'First', 'Second', 'Missing'):
+            for genre in ('', 'pop', 'ROCK', 'jazz'):
+                for year in ('', '2000', '2001'):
+                    filters = SongFilters(album, genre, year)
+                    self.assertEqual(filter_results(results, filters), filter_results(self.songs, filters))
+
+
+class FakeProvidersTestCase(SimpleTestCase):
+    """
+    Searches with providers that return the songs given to set_provider_songs, and without catalog
+    """
+
+    def setUp(self):
+        search_cache.shared.clear()
+        search_cache.local.clear()
+        self.addCleanup(search_cache.shared.clear)
+        self.provider_songs = {}
+        for provider in PROVIDERS:
+            for patcher in (mock.patch.object(provider, 'get_data', side_effect=self.get_data(provider)),
+                            mock.patch.object(provider, 'get_song_details', side_effect=lambda data: data)):
+                patcher.start()
+                self.addCleanup(patcher.stop)
+        for patcher in (mock.patch('songsearch.catalog.find_songs', return_value=None),
+                        mock.patch('songsearch.catalog.store_songs')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_data(self, provider):
+        def get_data(search_term, fast=False, filters=NO_FILTERS):
+            return [song for song in self.provider_songs[provider.name] if filters.matches(song)]
+        return get_data
+
+    def set_provider_songs(self, count):
+        for provider in PROVIDERS:
+            self.provider_songs[provider.name] = [
+                make_song(f'{provider.name} {index}', album='Rare' if index == 0 else 'Common', origin=provider.name)
+                for index in range(count)]
+
+    def provider_calls(self):
+        return [call for provider in PROVIDERS for call in provider.get_data.call_args_list]
+
+
+class FilteredSearchTests(FakeProvidersTestCase):
+    """
+    Searches with filters answered from the cached songs of their search term
+    """
+
+    def test_complete_songs_of_the_term_answer_new_filters_without_provider_calls(self):
+        self.set_provider_songs(PAGE_SIZE - 1)
+        search_providers('term')
+        self.assertEqual(len(self.provider_calls()), len(PROVIDERS))
+
+        for provider in PROVIDERS:
+            provider.get_data.reset_mock()
+        for filters in (SongFilters('Rare', '', ''), SongFilters('', 'pop', '2000'), SongFilters('Missing', '', '')):
+            song_data, timed_out = search_providers('term', filters=filters)
+            self.assertEqual(timed_out, [])
+            expected = filter_songs([self.provider_songs[provider.name] for provider in PROVIDERS], filters)
+            self.assertEqual([song.json for song in filter_songs(song_data, filters)], [song.json for song in expected])
+        self.assertEqual(self.provider_calls(), [])
+
+    def test_a_full_page_of_the_term_does_not_answer_other_filters(self):
+        self.set_provider_songs(PAGE_SIZE)
+        search_providers('term')
+        filters = SongFilters('Rare', '', '')
+        song_data, _ = search_providers('term', filters=filters)
+        # The providers might have more songs of the album than the ones in the page
+        for provider in PROVIDERS:
+            self.assertEqual([call.kwargs['filters'] for call in provider.get_data.call_args_list], [NO_FILTERS, filters])
+        self.assertEqual(len(filter_songs(song_data, filters)), len(PROVIDERS))
+
+        search_providers('term', filters=filters)
+        self.assertEqual(len(self.provider_calls()), 6)  # The songs fetched for the filters are cached for them
+
+
+    def prewarm(self, searches):
+        with mock.patch('songsearch.prewarm.popular_searches', return_value=searches), \
+                mock.patch('songsearch.prewarm.time.sleep'):
+            return prewarm(len(searches), refresh_ahead=0, rate=1)
+
+    def test_prewarms_the_filters_the_songs_of_the_term_do_not_answer(self):
+        self.set_provider_songs(PAGE_SIZE)
+        filters = SongFilters('Rare', '', '')
+        outcomes = self.prewarm([('term', NO_FILTERS), ('term', filters)])
+        self.assertEqual(outcomes, {FETCHED: 2 * len(PROVIDERS)})
+
+        for provider in PROVIDERS:
+            provider.get_data.reset_mock()
+        search_providers('term', filters=filters)
+        self.assertEqual(self.provider_calls(), [])
+
+    def test_complete_songs_of_the_term_prewarm_its_filters(self):
+        self.set_provider_songs(PAGE_SIZE - 1)
+        outcomes = self.prewarm([('term', SongFilters('Rare', '', '')), ('term', SongFilters('', 'pop', ''))])
+        self.assertEqual(outcomes, {FETCHED: len(PROVIDERS)})
+        for provider in PROVIDERS:
+            self.assertEqual([call.kwargs['filters'] for call in provider.get_data.call_args_list], [NO_FILTERS])
+
+    def test_prewarming_needs_a_positive_rate(self):
+        with self.assertRaises(ValueError):
+            prewarm(10, refresh_ahead=0, rate=0)
+
+    def test_searches_do_not_join_background_fetches(self):
+        self.set_provider_songs(1)
+        provider = PROVIDERS[0]
+        release = threading.Event()
+        provider.get_data.side_effect = lambda *args, **kwargs: release.wait() and self.provider_songs[provider.name]
+        cache_key = provider_cache_key(provider, 'term')
+        refresh = search_flight.submit(provider_executor, flight_key(cache_key, priority=BACKGROUND), fetch_songs,
+                                       provider, 'term', False, BACKGROUND)
+        search = submit_fetch(provider, 'term')
+        self.assertIsNot(search, refresh)
+        release.set()
+        self.assertEqual(len(search.result(timeout=5)), 1)
+        self.assertEqual(len(refresh.result(timeout=5)), 1)
+
+
+class ConditionalRequestTests(FakeProvidersTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.set_provider_songs(3)
+
+    def search(self, if_none_match=None, **params):
+        headers = {'HTTP_IF_NONE_MATCH': if_none_match} if if_none_match else {}
+        request = APIRequestFactory().get('/api/song/', {'search_term': 'term', **params}, **headers)
+        force_authenticate(request, user=User(username='test'))
+        return SongViewSet.as_view({'get': 'list'})(request)
+
+    def test_a_matching_etag_is_not_modified(self):
+        song_data, _ = search_providers('term')
+        etag = results_etag(song_data, 'json')
+        for if_none_match in (etag, f'W/{etag}', f'"other", {etag}', '*'):
+            request = RequestFactory().get('/', HTTP_IF_NONE_MATCH=if_none_match)
+            self.assertEqual(not_modified(request, etag).status_code, 304)
+        self.assertIsNone(not_modified(RequestFactory().get('/', HTTP_IF_NONE_MATCH='"other"'), etag))
+        self.assertIsNone(not_modified(RequestFactory().get('/'), etag))
+        self.assertIsNone(not_modified(RequestFactory().get('/', HTTP_IF_NONE_MATCH='*'), None))
+
+    def test_the_etag_changes_with_the_songs_and_the_variant(self):
+        songs = SongResults([make_song('a')], fresh_until=time.time() + 60)
+        other_songs = SongResults([make_song('b')], fresh_until=time.time() + 60)
+        self.assertEqual(results_etag([songs, other_songs], 'json'), results_etag([other_songs, songs], 'json'))
+        self.assertNotEqual(results_etag([songs], 'json'), results_etag([other_songs], 'json'))
+        self.assertNotEqual(results_etag([songs], 'json'), results_etag([songs], 'json', 'Album'))
+
+    def test_partial_or_stale_results_have_no_etag(self):
+        songs = SongResults([make_song('a')], fresh_until=time.time() + 60)
+        self.assertIsNone(results_etag([songs, [make_song('b')]], 'json'))  # Not cached, e.g. pending album
+        self.assertIsNone(results_etag([songs, SongResults([make_song('b')], fresh_until=time.time() - 1)], 'json'))
+
+    def test_the_validators_give_the_etag_of_the_songs(self):
+        filters = SongFilters('Rare', '', '')
+        song_data, _ = search_providers('term', filters=filters)
+        with mock.patch.object(search_cache, 'get', wraps=search_cache.get) as cache_get:
+            validators = cached_validators('term', filters)
+        self.assertTrue(all(call.args[0].endswith(':validator') for call in cache_get.call_args_list))
+        self.assertEqual(results_etag(validators, 'json', *filters), results_etag(song_data, 'json', *filters))
+        self.assertIsNone(cached_validators('other term'))
+
+    def test_answers_with_not_modified_without_loading_the_songs(self):
+        response = self.search()
+        etag = response['ETag']
+        self.assertEqual(response.status_code, 200)
+
+        with mock.patch('songsearch.views.search_providers') as search:
+            response = self.search(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('max-age', response['Cache-Control'])
+        search.assert_not_called()
+
+        self.assertEqual(self.search(if_none_match='"other"').status_code, 200)
+        self.assertEqual(self.search(if_none_match=etag, album='Rare').status_code, 200)
+
+
+class StreamTests(FakeProvidersTestCase):
+
+    def test_the_summary_has_the_metrics_of_the_search(self):
+        self.set_provider_songs(3)
+        request = APIRequestFactory().get('/api/song/stream/', {'search_term': 'term'})
+        force_authenticate(request, user=User(username='test'))
+        view = SongViewSet.as_view({'get': 'stream'}, **SongViewSet.stream.kwargs)  # With the renderers of the action
+        response = server_timing_middleware(view)(request)
+        self.assertIn('Server-Timing', response)
+
+        events = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([event['event'] for event in events], ['songs'] * len(PROVIDERS) + ['summary'])
+        server_timing = events[-1]['server_timing']
+        self.assertIn('stream;dur=', server_timing)
+        self.assertIn(f'search_cache;desc="miss={len(PROVIDERS)}"', server_timing)
+        self.assertTrue(all(f'{provider.name.lower()}_fetch;dur=' in server_timing for provider in PROVIDERS))
+        self.assertIsNone(request_metrics.get())
+
+
+class BatchSearchTests(FakeProvidersTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.set_provider_songs(3)
+
+    def batch(self, searches):
+        request = APIRequestFactory().post('/api/song/batch/', {'searches': searches}, format='json')
+        force_authenticate(request, user=User(username='test'))
+        return SongViewSet.as_view({'post': 'batch'})(request)
+
+    def test_equivalent_search_terms_share_one_fetch(self):
+        response = self.batch([{'search_term': 'Term'}, {'search_term': ' term! '},
+                               {'search_term': 'TERM', 'album': 'Rare'}])
+        self.assertEqual(response.status_code, 200)
+        for provider in PROVIDERS:
+            self.assertEqual(len(provider.get_data.call_args_list), 1)
+        results = response.data['results']
+        self.assertEqual(list(results), ['Term', ' term! ', 'TERM'])
+        self.assertEqual(len(results['Term']), 3 * len(PROVIDERS))
+        self.assertEqual([song.json for song in results['Term']], [song.json for song in results[' term! ']])
+        self.assertEqual(len(results['TERM']), len(PROVIDERS))
+        self.assertEqual(response.data['errors'], {})
+
+    def test_bad_searches_get_their_errors_without_failing_the_batch(self):
+        response = self.batch([{'album': 'Rare'}, {'search_term': 'term'}, 'term', {'search_term': 'term'}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.data['results']), ['term'])
+        errors = response.data['errors']
+        self.assertEqual(sorted(errors), [0, 2, 3])
+        self.assertTrue(all(error['status'] == 400 for error in errors.values()))
+        self.assertIn('search_term', errors[0]['errors'])
+        self.assertIn('non_field_errors', errors[2]['errors'])
+        self.assertEqual(errors[3]['errors'], {'search_term': ['Each search term can only appear once']})
+
+    def test_the_batch_needs_searches(self):
+        self.assertEqual(self.batch([]).status_code, 400)
+        searches = [{'search_term': str(index)} for index in range(settings.SONGSEARCH_BATCH_MAX_SEARCHES + 1)]
+        self.assertEqual(self.batch(searches).status_code, 400)
+        self.assertEqual(self.provider_calls(), [])
+
+
+class SongResultTests(SimpleTestCase):
+
+    def setUp(self):
+        self.songs = [
+            SongResult(name='Canción de los niños', provider_song_id=123, album='Ærø “Deluxe”', artist='Björk & 坂本龍一',
+                       album_cover=None, year_release_date='2001', genres=['Pop', 'Électronique'], duration=245000,
+                       origin='Spotify', isrc=None),
+            SongResult(name='Line\u2028separator\u2029"quoted"\\', provider_song_id='a/b', artist='Emoji 🎵\ttab',
+                       genres='', origin='Genius'),
+        ]
+
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def test_the_encoding_of_a_song_is_the_one_of_the_drf_renderer(self):
+        for song in self.songs:
+            self.assertEqual(song.json, self.render(song.to_dict()))
+
+    def test_the_encoding_of_a_response_is_the_one_of_the_drf_renderer(self):
+        data = {'results': {'término': self.songs, 'empty': []}, 'timed_out': {'término': ['iTunes']}, 'count': 2,
+                'errors': {0: {'status': 400}}, 'missing': None}
+        expected = {'results': {'término': [song.to_dict() for song in self.songs], 'empty': []},
+                    'timed_out': {'término': ['iTunes']}, 'count': 2, 'errors': {0: {'status': 400}}, 'missing': None}
+        self.assertEqual(encode_json(data), self.render(expected))
+        self.assertEqual(SongJSONRenderer().render(data), self.render(expected))
+
+
+class MergeSongsTests(SimpleTestCase):
+
+    def song(self, origin, name, artist='Artist', **fields):
+        return SongResult(name=name, provider_song_id=f'{origin} {name}', artist=artist, origin=origin, **fields)
+
+    def test_merges_the_songs_with_the_same_isrc(self):
+        merged = merge_songs([self.song('Spotify', 'Song', isrc='usabc1234567'),
+                              self.song('iTunes', 'Another Title', artist='Another Artist', isrc='USABC1234567')])
+        self.assertEqual(len(merged), 1)
+        self.assertEqual(merged[0]['provider_song_ids'],
+                         {'Spotify': 'Spotify Song', 'iTunes': 'iTunes Another Title'})
+
+    def test_falls_back_to_the_normalized_title_and_main_artist(self):
+        merged = merge_songs([self.song('Spotify', 'Hey Jude - Remastered 2015', artist='The Beatles'),
+                              self.song('iTunes', 'Hey Jude (Live)', artist='The Beatles & Friends'),
+                              self.song('Genius', 'Hey Jude feat. Someone', artist='The Beatles'),
+                              self.song('Genius', 'Hey Jude', artist='Another Band')])
+        self.assertEqual([song['origins'] for song in merged], [['Spotify', 'iTunes', 'Genius'], ['Genius']])
+
+    def test_keeps_apart_different_recordings(self):
+        merged = merge_songs([self.song('Spotify', 'Song', duration='200000'),
+                              self.song('iTunes', 'Song', duration='260000'),
+                              self.song('Spotify', 'Song', isrc='USABC1234567'),
+                              self.song('Genius', 'Song')])
+        # Durations too far apart, and songs of the same provider, are never the same recording
+        self.assertEqual([song['origins'] for song in merged], [['Spotify', 'Genius'], ['iTunes', 'Spotify']])
+
+    def test_takes_each_field_from_its_preferred_provider(self):
+        merged = merge_songs([self.song('iTunes', 'Song', album='Single', genres='Pop', duration='200000'),
+                              self.song('Genius', 'song', album='Album', genres='N/A'),
+                              self.song('Spotify', 'SONG', album='pending', genres='', duration='201000')])
+        self.assertEqual(len(merged), 1)
+        song = merged[0]
+        self.assertEqual(song['name'], 'SONG')  # Spotify first
+        self.assertEqual(song['album'], 'Album')  # Genius first
+        self.assertEqual(song['genres'], 'Pop')  # Missing in Spotify, so iTunes
+        self.assertEqual(song['duration'], '201000')
+        self.assertEqual(song['isrc'], '')  # Missing everywhere
+
+    def test_keeps_the_order_of_the_providers(self):
+        merged = merge_songs([self.song('Genius', 'First'), self.song('iTunes', 'Second'),
+                              self.song('Spotify', 'Second'), self.song('Spotify', 'First')])
+        self.assertEqual([song['name'] for song in merged], ['First', 'Second'])
+        self.assertEqual([song['origins'] for song in merged], [['Genius', 'Spotify'], ['iTunes', 'Spotify']])
+
+
+class SuggestionIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.index = SuggestionIndex(max_entries=100, max_scanned=50)
+
+    def song(self, name, artist='Artist'):
+        return SongResult(name=name, artist=artist, origin='iTunes')
+
+    def texts(self, prefix, limit=10):
+        return [suggestion['text'] for suggestion in self.index.suggest(prefix, limit)]
+
+    def test_matches_the_start_of_any_word(self):
+        self.index.add_songs([self.song('Sailing', 'Christopher Cross'), self.song('Ride Like the Wind', 'Someone')])
+        self.assertEqual(self.texts('cro'), ['Christopher Cross'])
+        self.assertEqual(self.texts('SAIL'), ['Sailing'])
+        self.assertEqual(self.texts('like the'), ['Ride Like the Wind'])
+        self.assertEqual(self.texts('ross'), [])
+        self.assertEqual(self.texts('!'), [])
+
+    def test_ranks_by_popularity_then_first_added(self):
+        self.index.add_songs([self.song('Sail Away'), self.song('Sailing'), self.song('Sail On')])
+        self.index.add_songs([self.song('Sail On')])
+        self.assertEqual(self.texts('sail'), ['Sail On', 'Sail Away', 'Sailing'])
+        self.assertEqual(self.texts('sail', limit=1), ['Sail On'])
+
+    def test_finds_the_keys_merged_from_the_recent_ones(self):
+        with mock.patch('songsearch.suggest.MAX_RECENT_KEYS', 3):
+            self.index.add_songs([self.song(f'Song {index}', f'Artist {index}') for index in range(5)])
+        self.assertTrue(self.index.keys)
+        self.assertEqual(sorted(self.texts('song')), [f'Song {index}' for index in range(5)])
+
+    def test_evicts_the_least_popular(self):
+        index = SuggestionIndex(max_entries=10, max_scanned=50)
+        index.add_songs([self.song('Popular', 'Band')] * 3)
+        index.add_songs([self.song(f'Song {index}', 'Band') for index in range(10)])
+        self.assertLessEqual(len(index.entries), 10)
+        self.assertEqual(index.suggest('popular', 10)[0]['text'], 'Popular')
+
+    def test_loading_keeps_the_songs_added_meanwhile(self):
+        self.index.add_songs([self.song('Sailing')] * 2)
+        self.index.load([self.song('Sail Away'), self.song('Sail Away'), self.song('Sailing'), self.song('Sail On')])
+        self.assertTrue(self.index.loaded)
+        self.assertEqual(self.texts('sail'), ['Sailing', 'Sail Away', 'Sail On'])
+
+    def test_suggests_without_waiting_for_the_catalog_songs(self):
+        with mock.patch('songsearch.suggest.suggestion_index', self.index), \
+                mock.patch('songsearch.suggest.catalog.recent_songs', return_value=[self.song('Sail Away')]):
+            self.index.add_songs([self.song('Sailing')])
+            with suggestion_index_lock:  # Loading in another thread
+                self.assertEqual([suggestion['text'] for suggestion in suggest('sail', 10)], ['Sailing'])
+            self.assertCountEqual([suggestion['text'] for suggestion in suggest('sail', 10)], ['Sailing', 'Sail Away'])
+
+
+class CatalogTests(TestCase):
+
+    def setUp(self):
+        self.songs = [make_song(name, origin='iTunes') for name in ('b', 'a', 'c')]
+        search_cache.shared.clear()
+        search_cache.local.clear()
+        self.addCleanup(search_cache.shared.clear)
+
+    def fetched_ago(self, seconds):
+        SearchCoverage.objects.update(fetched_at=timezone.now() - datetime.timedelta(seconds=seconds))
+
+    def test_finds_the_stored_songs_of_the_term_in_the_same_order(self):
+        catalog.store_songs('iTunes', 'term', self.songs, complete=True)
+        songs = catalog.find_songs('iTunes', 'term')
+        self.assertEqual([song.json for song in songs], [song.json for song in self.songs])
+        self.assertTrue(songs.complete)
+        self.assertIsNone(catalog.find_songs('Spotify', 'term'))
+        self.assertIsNone(catalog.find_songs('iTunes', 'other term'))
+
+    @override_settings(SONGSEARCH_SEARCH_CACHE_TIMEOUT=60 * 60, SONGSEARCH_CATALOG_MAX_AGE=60 * 60 * 24)
+    def test_the_songs_are_fresh_since_they_were_fetched(self):
+        catalog.store_songs('iTunes', 'term', self.songs)
+        self.assertAlmostEqual(catalog.find_songs('iTunes', 'term').fresh_until, time.time() + 60 * 60, delta=5)
+        self.fetched_ago(60 * 60 * 2)
+        self.assertAlmostEqual(catalog.find_songs('iTunes', 'term').fresh_until, time.time() - 60 * 60, delta=5)
+        self.assertIsNone(catalog.find_songs('iTunes', 'term', max_age=60 * 60))
+        self.fetched_ago(60 * 60 * 25)
+        self.assertIsNone(catalog.find_songs('iTunes', 'term'))
+
+    @override_settings(SONGSEARCH_SEARCH_CACHE_TIMEOUT=60 * 60, SONGSEARCH_CATALOG_MAX_AGE=60 * 60 * 24)
+    def test_a_refresh_reaches_the_provider(self):
+        provider = PROVIDERS[0]
+        catalog.store_songs(provider.name, 'term', [make_song(name, origin=provider.name) for name in ('b', 'a', 'c')])
+        self.fetched_ago(60 * 60 * 2)
+        new_songs = [make_song('new', origin=provider.name)]
+        with mock.patch.object(provider, 'get_data', return_value=new_songs), \
+                mock.patch.object(provider, 'get_song_details', side_effect=lambda data: data):
+            # A search answered from the catalog gets the songs stale, so they are refreshed in the background
+            songs = contextvars.copy_context().run(fetch_songs, provider, 'term')
+            self.assertEqual(len(songs), 3)
+            self.assertLess(songs.fresh_until, time.time())
+            self.assertLessEqual(search_cache.get(provider_cache_key(provider, 'term'))[1], time.time())
+            provider.get_data.assert_not_called()
+
+            songs = contextvars.copy_context().run(fetch_songs, provider, 'term', False, BACKGROUND)
+            provider.get_data.assert_called_once()
+        self.assertEqual([song.json for song in songs], [song.json for song in new_songs])
+        self.assertGreater(songs.fresh_until, time.time() + 60 * 59)
+        self.assertEqual([song.json for song in catalog.find_songs(provider.name, 'term')], [new_songs[0].json])
+
+
+class TokenManagerTests(TestCase):
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.fetch_token = mock.Mock(side_effect=lambda: (f'token {self.fetch_token.call_count}', 30))
+
+    def test_reuses_the_token_until_it_expires(self):
+        tokens = TokenManager(refresh_margin=60)
+        self.assertEqual(tokens.get_token('Test', self.fetch_token), 'token 1')
+        self.assertEqual(tokens.get_token('Test', self.fetch_token), 'token 1')
+        with mock.patch('songsearch.tokens.time.time', return_value=time.time() + 30):
+            self.assertEqual(tokens.get_token('Test', self.fetch_token), 'token 2')
+
+    def test_shares_the_token_with_the_other_processes(self):
+        TokenManager(refresh_margin=60).get_token('Test', self.fetch_token)
+        self.assertEqual(TokenManager(refresh_margin=60).get_token('Test', self.fetch_token), 'token 1')
+        self.assertEqual(self.fetch_token.call_count, 1)
+
+    def test_keeps_the_token_in_the_process_when_the_shared_cache_fails(self):
+        shared_cache = caches['shared']
+        error = OperationalError('no such table: songsearch_shared_cache')
+        tokens = TokenManager(refresh_margin=60)
+        with mock.patch.object(shared_cache, 'get', side_effect=error), \
+                mock.patch.object(shared_cache, 'set', side_effect=error), self.assertLogs('songsearch.tokens'):
+            self.assertEqual(tokens.get_token('Test', self.fetch_token), 'token 1')
+            self.assertEqual(tokens.get_token('Test', self.fetch_token), 'token 1')
+        self.assertEqual(self.fetch_token.call_count, 1)
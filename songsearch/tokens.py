@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError
+from .catalog import catalog_write_lock
+
+logger = logging.getLogger(__name__)
+
+# Seconds before the expiration from which a token is no longer handed out
+TOKEN_EXPIRY_LEEWAY = 5
+
+
+class TokenManager:
+    """
+    Keeps the provider access tokens for the whole process and shares them with the other workers and processes through
+    the shared cache. Only one token request per provider is made at a time, and tokens are refreshed in the background
+    before they expire. When the shared cache fails, e.g. its table was not created with createcachetable, each process
+    keeps requesting its own tokens
+    """
+
+    def __init__(self, refresh_margin: int):
+        self.refresh_margin = refresh_margin
+        self._tokens = {}  # Provider name -> (access token, expiration timestamp)
+        self._locks = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def get_token(self, provider_name: str, fetch_token) -> str:
+        """
+        Return a valid access token for the provider. fetch_token is called to request a new one and must return
+        the access token and the seconds it is valid for
+        """
+        token = self._valid_token(self._tokens.get(provider_name))
+        if token:
+            return token
+
+        # Concurrent requests wait here for the token being fetched instead of requesting their own
+        with self._provider_lock(provider_name):
+            token = self._valid_token(self._tokens.get(provider_name))
+            if token:
+                return token
+
+            # Another worker might have fetched the token already
+            shared_token = self._shared_token(provider_name)
+            if self._valid_token(shared_token):
+                self._store(provider_name, shared_token, fetch_token)
+                return shared_token[0]
+
+            return self._fetch(provider_name, fetch_token)
+
+    def _fetch(self, provider_name, fetch_token):
+        access_token, expires_in = fetch_token()
+        token = (access_token, time.time() + expires_in)
+        try:
+            with catalog_write_lock:  # The shared cache is a table of the database by default
+                caches['shared'].set(self._cache_key(provider_name), token, timeout=expires_in)
+        except DatabaseError:
+            logger.exception('Error sharing the %s access token', provider_name)
+        self._store(provider_name, token, fetch_token)
+        return access_token
+
+    def _shared_token(self, provider_name):
+        try:
+            return caches['shared'].get(self._cache_key(provider_name))
+        except DatabaseError:
+            logger.exception('Error reading the shared %s access token', provider_name)
+            return None
+
+    def _refresh(self, provider_name, fetch_token):
+        with self._provider_lock(provider_name):
+            try:
+                self._fetch(provider_name, fetch_token)
+            except ValueError:
+                pass  # The token is requested again when it is needed
+
+    def _store(self, provider_name, token, fetch_token):
+        self._tokens[provider_name] = token
+
+        # Schedule the refresh so requests never have to wait for a new token
+        delay = token[1] - time.time() - self.refresh_margin
+        if delay <= 0:
+            return  # Short lived tokens are only requested when needed
+        timer = threading.Timer(delay, self._refresh, args=(provider_name, fetch_token))
+        timer.daemon = True
+        with self._lock:
+            previous_timer = self._timers.get(provider_name)
+            if previous_timer:
+                previous_timer.cancel()
+            self._timers[provider_name] = timer
+        timer.start()
+
+    def _provider_lock(self, provider_name):
+        with self._lock:
+            return self._locks.setdefault(provider_name, threading.Lock())
+
+    @staticmethod
+    def _valid_token(token):
+        if token and token[1] - TOKEN_EXPIRY_LEEWAY > time.time():
+            return token[0]
+        return None
+
+    @staticmethod
+    def _cache_key(provider_name):
+        return f'provider_token:{provider_name}'
+
+
+token_manager = TokenManager(refresh_margin=settings.SONGSEARCH_TOKEN_REFRESH_MARGIN)
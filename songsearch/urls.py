@@ -1,11 +1,14 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from SongSearchAPI.authentication import TokenAuthentication
-from .views import SongViewSet
+from .async_views import song_search
+from .views import SongViewSet, metrics
 
 router = DefaultRouter()
 router.register('song', SongViewSet, basename='song')
 
 urlpatterns = [
+    path('song/async/', song_search, name='song-async'),
+    path('metrics/', metrics, name='metrics'),
     path('', include(router.urls)),
 ]
@@ -1,21 +1,168 @@
+import asyncio
+import contextvars
+import httpx
 import requests
 import re
-import datetime
 import os
+from asgiref.sync import sync_to_async
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import viewsets, status, viewsets
-from .models import Song
-from .serializers import SongSerializer
+from rest_framework.decorators import action
+from rest_framework.renderers import BrowsableAPIRenderer
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from . import catalog
+from .merge import merge_songs
+from .metrics import (iterate_for_request, record_cache_lookup, record_cache_stats, record_call, registry,
+                      request_metrics, run_for_request, timer)
+from .renderers import EventStreamRenderer, NDJSONRenderer, SongJSONRenderer
+from .results import SongResult
+from .serializers import BatchSearchSerializer, validate_searches
+from .search_stats import search_stats
+from .suggest import suggest, suggestion_index
+from .health import ProviderHealth
+from .http import async_request_timeout, create_session, request_timeout
+from .ratelimit import BACKGROUND, INTERACTIVE, RateLimited, RateLimiter, request_priority
+from .cache import search_cache, search_flight
+from .conditional import ResultsValidator, add_cache_headers, not_modified, results_etag, validator_key
+from .facets import NO_FILTERS, SongFilters, SongResults, filter_results
+from .tokens import token_manager
 from django.core.cache import cache
 import hashlib
+import hmac
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed, wait
+from django.conf import settings
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from SongSearchAPI.authentication import TokenAuthentication
 
+# Runs the requests of a hedged call, so the first one can be raced by a second one
+hedge_executor = ThreadPoolExecutor(max_workers=settings.SONGSEARCH_MAX_WORKERS, thread_name_prefix='hedge')
+
+
+# Songs requested to the providers per search
+PAGE_SIZE = 10
+
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """
+    Submit fn to the executor keeping the context variables of the caller, such as the priority of its provider calls
+    """
+    return executor.submit(contextvars.copy_context().run, run_for_request, fn, *args, **kwargs)
+
+
 class Provider:
+    # Largest page of songs the provider returns. Filtered searches fetch bigger pages, up to this one, while too few
+    # of the songs match the filters the provider can not apply itself
+    max_page_size = PAGE_SIZE
+
     def __init__(self, name):
         self.name = name
+        # Long lived session shared by all the requests and threads, so the connections to the provider are reused
+        self.session = create_session()
+        self.health = ProviderHealth(name)
+        self.rate_limiter = RateLimiter(name)
+
+    def get(self, url, hedge=False, **kwargs):
+        """
+        GET request to the provider. With hedge, an identical request is sent when the first one takes longer than
+        the p95 latency of the provider, and the first one to succeed is used
+        """
+        hedge_delay = self.health.hedge_delay() if hedge else None
+        if hedge_delay is None:
+            return self.request('GET', url, **kwargs)
+
+        first_request = submit_in_context(hedge_executor, self.request, 'GET', url, **kwargs)
+        done, _ = wait([first_request], timeout=hedge_delay)
+        if done:
+            return first_request.result()
+        hedged_request = submit_in_context(hedge_executor, self.request, 'GET', url, **kwargs)
+        for request in as_completed([first_request, hedged_request]):
+            try:
+                return request.result()
+            except requests.exceptions.RequestException as e:
+                error = e
+        raise error
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """
+        Request to the provider within its rate limit and with a read timeout adapted to its latency, recording the
+        outcome in its health
+        """
+        self.acquire()
+        start = time.monotonic()
+        try:
+            response = self.session.request(method, url, timeout=request_timeout(self.health.read_timeout()), **kwargs)
+        except requests.exceptions.RequestException:
+            self.health.record_failure()
+            record_call(self.name, 'error', time.monotonic() - start)
+            raise
+        self.record_response(response, time.monotonic() - start)
+        return response
+
+    async def aget(self, client, url, hedge=False, **kwargs):
+        """
+        Asynchronous version of get
+        """
+        hedge_delay = self.health.hedge_delay() if hedge else None
+        if hedge_delay is None:
+            return await self.arequest(client, 'GET', url, **kwargs)
+
+        requests_in_flight = [asyncio.ensure_future(self.arequest(client, 'GET', url, **kwargs))]
+        done, _ = await asyncio.wait(requests_in_flight, timeout=hedge_delay)
+        if done:
+            return requests_in_flight[0].result()
+        requests_in_flight.append(asyncio.ensure_future(self.arequest(client, 'GET', url, **kwargs)))
+        try:
+            for request in asyncio.as_completed(requests_in_flight):
+                try:
+                    return await request
+                except httpx.HTTPError as e:
+                    error = e
+            raise error
+        finally:
+            for request in requests_in_flight:
+                request.cancel()  # The slower request is no longer needed
+
+    async def arequest(self, client, method, url, **kwargs):
+        await sync_to_async(self.acquire, thread_sensitive=False)()
+        start = time.monotonic()
+        try:
+            response = await client.request(method, url, timeout=async_request_timeout(self.health.read_timeout()), **kwargs)
+        except httpx.HTTPError:
+            self.health.record_failure()
+            record_call(self.name, 'error', time.monotonic() - start)
+            raise
+        self.record_response(response, time.monotonic() - start)
+        return response
+
+    def acquire(self):
+        try:
+            self.rate_limiter.acquire()
+        except RateLimited:
+            record_call(self.name, 'rate_limited')
+            raise
+
+    def record_response(self, response, latency):
+        record_call(self.name, response.status_code, latency)
+        if response.status_code == 429 or 'Retry-After' in response.headers:
+            # The provider is throttling us, no more calls are made until it asks
+            self.rate_limiter.throttled(response.headers.get('Retry-After'))
+        if response.status_code >= 500:
+            self.health.record_failure()
+        else:
+            self.health.record_success(latency)
+
+    def timer(self, phase):
+        """
+        Time the block as a phase of the provider, e.g. spotify_search
+        """
+        return timer(f'{self.name.lower()}_{phase}')
 
     # Method to get access token, to be overridden by child classes
     def get_access_token(self):
@@ -30,13 +177,49 @@ class Provider:
         cleaned_parameter = cleaned_parameter.strip()
         return cleaned_parameter
 
-    def get_data(self, search_term: str):
+    @classmethod
+    def normalize_search_term(cls, parameter: str) -> str:
+        """
+        Clean the search term and normalize its case and spaces, so equivalent searches share the cached results
+        """
+        return ' '.join(cls.clean_search_term(parameter).lower().split())
+
+    def get_data(self, search_term: str, fast: bool = False, filters: SongFilters = NO_FILTERS):
         raise NotImplementedError
 
     def get_song_details(self, response):
         return response
 
+    def overfetch(self, fetch_page, filters: SongFilters):
+        """
+        Call fetch_page with growing page sizes until SONGSEARCH_FILTER_QUOTA of its songs match the filters, and
+        return the last page. Without filters a single page is fetched
+        """
+        page_size = PAGE_SIZE
+        while True:
+            data = fetch_page(page_size)
+            if not self.needs_bigger_page(data, page_size, filters):
+                return data
+            page_size = min(page_size * settings.SONGSEARCH_FILTER_OVERFETCH_GROWTH, self.max_page_size)
+
+    async def aoverfetch(self, fetch_page, filters: SongFilters):
+        page_size = PAGE_SIZE
+        while True:
+            data = await fetch_page(page_size)
+            if not self.needs_bigger_page(data, page_size, filters):
+                return data
+            page_size = min(page_size * settings.SONGSEARCH_FILTER_OVERFETCH_GROWTH, self.max_page_size)
+
+    def needs_bigger_page(self, data, page_size, filters):
+        if not filters or len(data) < page_size or page_size >= self.max_page_size:
+            return False  # Nothing to filter, or no more songs to get
+        matches = sum(1 for song in self.get_song_details(data) if filters.matches(song))
+        return matches < settings.SONGSEARCH_FILTER_QUOTA
+
 class Itunes(Provider):
+    search_url = f'{settings.SONGSEARCH_ITUNES_URL}/search'
+    max_page_size = 200
+
     def __init__(self):
         super().__init__('iTunes')
 
@@ -44,20 +227,39 @@ class Itunes(Provider):
         # iTunes doesn't require an access token, so this method is not implemented for the iTunes provider
         pass
 
-    def get_data(self, search_term: str):
+    def get_data(self, search_term: str, fast: bool = False, filters: SongFilters = NO_FILTERS):
         cleaned_search_term = self.clean_search_term(search_term)
         try:
-            response = requests.get(f'https://itunes.apple.com/search',
-                                    params={'term': cleaned_search_term, 'media': 'music', 'limit': 10})
-            response.raise_for_status()  # Raise an exception if the request was unsuccessful
-            return response.json().get('results', [])
+            # The search API has no filters, the term is matched against a single field when one is chosen
+            return self.overfetch(lambda limit: self.search_tracks(cleaned_search_term, limit), filters)
         except requests.exceptions.RequestException as e:
             raise ValueError("Error fetching data from iTunes API") from e
 
+    def search_tracks(self, search_term, limit):
+        with self.timer('search'):
+            response = self.get(self.search_url, hedge=True,
+                                params={'term': search_term, 'media': 'music', 'limit': limit})
+        response.raise_for_status()  # Raise an exception if the request was unsuccessful
+        return response.json().get('results', [])
+
+    async def aget_data(self, client, search_term: str, fast: bool = False, filters: SongFilters = NO_FILTERS):
+        cleaned_search_term = self.clean_search_term(search_term)
+        try:
+            return await self.aoverfetch(lambda limit: self.asearch_tracks(client, cleaned_search_term, limit), filters)
+        except httpx.HTTPError as e:
+            raise ValueError("Error fetching data from iTunes API") from e
+
+    async def asearch_tracks(self, client, search_term, limit):
+        with self.timer('search'):
+            response = await self.aget(client, self.search_url, hedge=True,
+                                       params={'term': search_term, 'media': 'music', 'limit': limit})
+        response.raise_for_status()  # Raise an exception if the request was unsuccessful
+        return response.json().get('results', [])
+
     def get_song_details(self, data):
         song_details = []
         for track in data:
-            song = Song(
+            song = SongResult(
                 name=track.get('trackName', ''),
                 provider_song_id=track.get('trackId', ''),
                 album= track.get('collectionName', ''),
@@ -66,69 +268,181 @@ class Itunes(Provider):
                 year_release_date=track.get('releaseDate', '')[:4],
                 genres=track.get('primaryGenreName', ''),
                 duration=track.get('trackTimeMillis', ''),
-                origin='iTunes'
+                origin='iTunes',
+                isrc=track.get('isrc') or '',  # Only present in some iTunes responses
             )
             song_details.append(song)
         return song_details
 
+# Maximum number of ids accepted by the Spotify multiple artists endpoint
+SPOTIFY_MAX_ARTIST_IDS = 50
+
+
 class Spotify(Provider):
+    token_url = f'{settings.SONGSEARCH_SPOTIFY_ACCOUNTS_URL}/api/token'
+    search_url = f'{settings.SONGSEARCH_SPOTIFY_API_URL}/v1/search'
+    artists_url = f'{settings.SONGSEARCH_SPOTIFY_API_URL}/v1/artists'
+    max_page_size = 50
+
     def __init__(self):
         super().__init__('Spotify')
-        self.access_token = None
-        self.token_expires = None
 
     def get_access_token(self):
-        if self.access_token and self.token_expires > datetime.datetime.now():
-            return self.access_token
+        # The token is shared by all the requests of the process
+        return token_manager.get_token(self.name, self.fetch_access_token)
 
+    def fetch_access_token(self):
         client_id = os.getenv("SPOTIFY_CLIENT_ID")
         client_secret = os.getenv("SPOTIFY_CLIENT_SECRET")
         try:
-            response = requests.post('https://accounts.spotify.com/api/token',
-                                     data={'grant_type': 'client_credentials'},
-                                     auth=(client_id, client_secret))
+            response = self.post(self.token_url,
+                                 data={'grant_type': 'client_credentials'},
+                                 auth=(client_id, client_secret))
             response.raise_for_status()  # Raise an exception if the request was unsuccessful
-            expires_in = response.json().get('expires_in', 0)
-            self.token_expires = datetime.datetime.now() + datetime.timedelta(seconds=expires_in)
-            self.access_token = response.json().get('access_token')
-            return self.access_token
+            return response.json().get('access_token'), response.json().get('expires_in', 0)
         except requests.exceptions.RequestException as e:
             raise ValueError("Error getting Spotify access token") from e
 
-    def get_data(self, search_term: str):
-        access_token = self.get_access_token()
-        cleaned_search_term = self.clean_search_term(search_term)
+    def get_data(self, search_term: str, fast: bool = False, filters: SongFilters = NO_FILTERS):
+        with self.timer('token'):
+            access_token = self.get_access_token()
+        query = self.search_query(self.clean_search_term(search_term), filters)
         headers = {'Authorization': f'Bearer {access_token}'}
 
-        tracks = []
         try:
-            response = requests.get(
-                f'https://api.spotify.com/v1/search',
-                params={'q': cleaned_search_term, 'type': 'track', 'limit': 10},
+            return self.overfetch(lambda limit: self.search_tracks(query, limit, headers), filters)
+        except requests.exceptions.RequestException as e:
+            raise ValueError("Error fetching data from Spotify API") from e
+
+    def search_tracks(self, query, limit, headers):
+        with self.timer('search'):
+            response = self.get(
+                self.search_url,
+                hedge=True,
+                params={'q': query, 'type': 'track', 'limit': limit},
                 headers=headers
             )
-            response.raise_for_status()  # Raise an exception if the request was unsuccessful
-            tracks_data = response.json().get('tracks', {}).get('items', [])
+        response.raise_for_status()  # Raise an exception if the request was unsuccessful
+        tracks_data = response.json().get('tracks', {}).get('items', [])
 
-            
-            for track_data in tracks_data:
-                track = track_data.copy()  # Copy track data to not modify the original data
-                artist_id = track_data['artists'][0]['id']  # Get the artist id
+        # Get the genres of every artist with as few requests as possible
+        with self.timer('enrich'):
+            artist_genres = self.get_artist_genres(self.artist_ids(tracks_data), headers)
+        return self.add_artist_genres(tracks_data, artist_genres)
 
-                # Make a new request to get the artist info to get genres
-                response = requests.get(f'https://api.spotify.com/v1/artists/{artist_id}', headers=headers)
-                response.raise_for_status()  # Raise an exception if the request was unsuccessful
+    async def aget_data(self, client, search_term: str, fast: bool = False, filters: SongFilters = NO_FILTERS):
+        with self.timer('token'):
+            access_token = await sync_to_async(self.get_access_token, thread_sensitive=False)()
+        query = self.search_query(self.clean_search_term(search_term), filters)
+        headers = {'Authorization': f'Bearer {access_token}'}
 
-                artist_info = response.json()
-                track['artist_genres'] = artist_info.get('genres', [])  # Add the artist's genres to the track data
+        try:
+            return await self.aoverfetch(lambda limit: self.asearch_tracks(client, query, limit, headers), filters)
+        except httpx.HTTPError as e:
+            raise ValueError("Error fetching data from Spotify API") from e
 
-                tracks.append(track)
+    async def asearch_tracks(self, client, query, limit, headers):
+        with self.timer('search'):
+            response = await self.aget(
+                client,
+                self.search_url,
+                hedge=True,
+                params={'q': query, 'type': 'track', 'limit': limit},
+                headers=headers
+            )
+        response.raise_for_status()  # Raise an exception if the request was unsuccessful
+        tracks_data = response.json().get('tracks', {}).get('items', [])
 
-        except requests.exceptions.RequestException as e:
-            raise ValueError("Error fetching data from Spotify API") from e
-        
+        with self.timer('enrich'):
+            artist_genres = await self.aget_artist_genres(client, self.artist_ids(tracks_data), headers)
+        return self.add_artist_genres(tracks_data, artist_genres)
+
+    @staticmethod
+    def search_query(search_term, filters):
+        """
+        Add the filters to the search term as Spotify field filters, so the search only returns matching tracks.
+        The filters are cleaned, so they can not close the quotes
+        """
+        query = [search_term]
+        if filters.album:
+            query.append(f'album:"{filters.album}"')
+        if filters.genre:
+            query.append(f'genre:"{filters.genre}"')
+        if filters.year:
+            query.append(f'year:{filters.year}')
+        return ' '.join(query)
+
+    @staticmethod
+    def artist_ids(tracks_data):
+        return [track_data['artists'][0]['id'] for track_data in tracks_data]
+
+    @staticmethod
+    def add_artist_genres(tracks_data, artist_genres):
+        tracks = []
+        for track_data in tracks_data:
+            track = track_data.copy()  # Copy track data to not modify the original data
+            artist_id = track_data['artists'][0]['id']  # Get the artist id
+            track['artist_genres'] = artist_genres.get(artist_id, [])  # Add the artist's genres to the track data
+
+            tracks.append(track)
         return tracks
 
+    def get_artist_genres(self, artist_ids, headers):
+        """
+        Get the genres of the given artists, using the cache first and the multiple artists endpoint for the rest
+        """
+        artist_genres, missing_ids = self.cached_artist_genres(artist_ids)
+        fetched_genres = {}
+        for start in range(0, len(missing_ids), SPOTIFY_MAX_ARTIST_IDS):
+            ids = missing_ids[start:start + SPOTIFY_MAX_ARTIST_IDS]
+            response = self.get(self.artists_url, params={'ids': ','.join(ids)}, headers=headers)
+            response.raise_for_status()  # Raise an exception if the request was unsuccessful
+            fetched_genres.update(self.parse_artist_genres(response.json()))
+
+        self.cache_artist_genres(fetched_genres)
+        artist_genres.update(fetched_genres)
+        return artist_genres
+
+    async def aget_artist_genres(self, client, artist_ids, headers):
+        artist_genres, missing_ids = await sync_to_async(self.cached_artist_genres, thread_sensitive=False)(artist_ids)
+        requests_in_flight = []
+        for start in range(0, len(missing_ids), SPOTIFY_MAX_ARTIST_IDS):
+            ids = missing_ids[start:start + SPOTIFY_MAX_ARTIST_IDS]
+            requests_in_flight.append(self.aget(client, self.artists_url, params={'ids': ','.join(ids)}, headers=headers))
+
+        fetched_genres = {}
+        for response in await asyncio.gather(*requests_in_flight):
+            response.raise_for_status()  # Raise an exception if the request was unsuccessful
+            fetched_genres.update(self.parse_artist_genres(response.json()))
+
+        await sync_to_async(self.cache_artist_genres, thread_sensitive=False)(fetched_genres)
+        artist_genres.update(fetched_genres)
+        return artist_genres
+
+    @staticmethod
+    def cached_artist_genres(artist_ids):
+        """
+        Return the cached genres of the given artists and the ids of the artists that are not cached
+        """
+        artist_ids = list(dict.fromkeys(artist_ids))  # Remove duplicates keeping the order
+        cache_keys = {f'spotify_artist_genres:{artist_id}': artist_id for artist_id in artist_ids}
+        cached_genres = cache.get_many(list(cache_keys))
+        artist_genres = {cache_keys[key]: genres for key, genres in cached_genres.items()}
+
+        missing_ids = [artist_id for artist_id in artist_ids if artist_id not in artist_genres]
+        return artist_genres, missing_ids
+
+    @staticmethod
+    def parse_artist_genres(artists_data):
+        # Unknown ids come back as null
+        return {artist_info['id']: artist_info.get('genres', []) for artist_info in artists_data.get('artists', []) if artist_info}
+
+    @staticmethod
+    def cache_artist_genres(artist_genres):
+        # Artist genres rarely change, so they are kept much longer than the search results
+        cache.set_many({f'spotify_artist_genres:{artist_id}': genres for artist_id, genres in artist_genres.items()},
+                       timeout=settings.SONGSEARCH_ARTIST_GENRES_TIMEOUT)
+
     def get_song_details(self, data):
         
         song_details = []
@@ -137,8 +451,8 @@ class Spotify(Provider):
             artists = [artist.get('name', '') for artist in track.get('artists', [])]
             genres = ', '.join(track.get('artist_genres', []))
             try:
-                # Extract relevant details from the track_info response and create a Song object
-                song = Song(
+                # Extract relevant details from the track_info response and create a SongResult
+                song = SongResult(
                     name=track.get('name', ''),
                     provider_song_id=track.get('id', ''),
                     album=album.get('name', ''),
@@ -147,7 +461,8 @@ class Spotify(Provider):
                     year_release_date=album.get('release_date', '')[:4],
                     genres=genres,
                     duration=track.get('duration_ms', ''),
-                    origin='Spotify'
+                    origin='Spotify',
+                    isrc=track.get('external_ids', {}).get('isrc') or '',
                 )
 
                 song_details.append(song)
@@ -158,58 +473,185 @@ class Spotify(Provider):
         return song_details
 
 
+# Album given to the Genius songs whose details are still being fetched in fast mode
+PENDING = 'pending'
+
+# Genius does not provide genres
+GENIUS_GENRES = 'N/A'
+
+# Caps the number of Genius song detail requests in flight across all requests
+genius_detail_executor = ThreadPoolExecutor(max_workers=settings.SONGSEARCH_GENIUS_DETAIL_WORKERS, thread_name_prefix='genius-detail')
+genius_pending_ids = set()
+genius_pending_lock = threading.Lock()
+
+
 class Genius(Provider):
+    token_url = f'{settings.SONGSEARCH_GENIUS_URL}/oauth/token'
+    search_url = f'{settings.SONGSEARCH_GENIUS_URL}/search'
+    songs_url = f'{settings.SONGSEARCH_GENIUS_URL}/songs'
+
     def __init__(self):
-        super().__init__('Genius') 
-        self.access_token = None
-        self.token_expires = None  
+        super().__init__('Genius')
 
     def get_access_token(self):
-        if self.access_token and self.token_expires > datetime.datetime.now():
-            return self.access_token
+        # The token is shared by all the requests of the process
+        return token_manager.get_token(self.name, self.fetch_access_token)
 
+    def fetch_access_token(self):
         client_id = os.getenv("GENIUS_CLIENT_ID")
         client_secret = os.getenv("GENIUS_CLIENT_SECRET")
         try:
-            response = requests.post('https://api.genius.com/oauth/token',
-                                    data={'grant_type': 'client_credentials'},
-                                    auth=(client_id, client_secret))
+            response = self.post(self.token_url,
+                                 data={'grant_type': 'client_credentials'},
+                                 auth=(client_id, client_secret))
             response.raise_for_status()  # Raise an exception if the request was unsuccessful
-            expires_in = response.json().get('expires_in', 0)
-            self.token_expires = datetime.datetime.now() + datetime.timedelta(seconds=expires_in)
-            self.access_token = response.json().get('access_token')
-            return self.access_token
+            return response.json().get('access_token'), response.json().get('expires_in', 0)
         except requests.exceptions.RequestException as e:
             raise ValueError("Error getting Genius access token") from e
 
-    def get_data(self, search_term: str):
-        access_token = self.get_access_token()
+    def get_data(self, search_term: str, fast: bool = False, filters: SongFilters = NO_FILTERS):
+        # The search has no filters and the album of every song takes a request, so bigger pages are not fetched
+        if not filters.genre_matches(GENIUS_GENRES):
+            return []  # No song can match the genre filter, the provider is not called
+        with self.timer('token'):
+            access_token = self.get_access_token()
         cleaned_search_term = self.clean_search_term(search_term)
         headers = {'Authorization': f'Bearer {access_token}'}
-        tracks = []
         try:
-            response = requests.get('https://api.genius.com/search', params={'q': cleaned_search_term}, headers=headers)
+            with self.timer('search'):
+                response = self.get(self.search_url, hedge=True, params={'q': cleaned_search_term, 'per_page': PAGE_SIZE},
+                                    headers=headers)
             response.raise_for_status()  # Raise an exception if the request was unsuccessful
             results = response.json().get('response', {}).get('hits', [])
-            for result in results:
-                song = result.get('result', {})
-                song_id = song.get('id')
-                # Make an additional request to get song details
-                response = requests.get(f'https://api.genius.com/songs/{song_id}', headers=headers)
-                response.raise_for_status()  # Raise an exception if the request was unsuccessful
-
-                song_detail = response.json().get('response', {}).get('song', {})
-                album = song_detail.get('album', {})
-                song['album'] = album.get('name', '') if album else 'N/A'
-                release_date_components = song.get('release_date_components', {})
-                song['year_release_date'] = release_date_components.get('year') if release_date_components else 'N/A'
-        
-                tracks.append(song)
+            songs = [result.get('result', {}) for result in results]
 
-            return tracks
+            # The album is only available in the song details, which need an additional request per song
+            with self.timer('enrich'):
+                albums = self.get_song_albums([song.get('id') for song in songs], headers, fast)
+            return self.add_song_details(songs, albums)
         except requests.exceptions.RequestException as e:
             raise ValueError("Error fetching data from Genius API") from e
 
+    async def aget_data(self, client, search_term: str, fast: bool = False, filters: SongFilters = NO_FILTERS):
+        if not filters.genre_matches(GENIUS_GENRES):
+            return []  # No song can match the genre filter, the provider is not called
+        with self.timer('token'):
+            access_token = await sync_to_async(self.get_access_token, thread_sensitive=False)()
+        cleaned_search_term = self.clean_search_term(search_term)
+        headers = {'Authorization': f'Bearer {access_token}'}
+        try:
+            with self.timer('search'):
+                response = await self.aget(client, self.search_url, hedge=True,
+                                           params={'q': cleaned_search_term, 'per_page': PAGE_SIZE}, headers=headers)
+            response.raise_for_status()  # Raise an exception if the request was unsuccessful
+            results = response.json().get('response', {}).get('hits', [])
+            songs = [result.get('result', {}) for result in results]
+
+            with self.timer('enrich'):
+                albums = await self.aget_song_albums(client, [song.get('id') for song in songs], headers, fast)
+            return self.add_song_details(songs, albums)
+        except httpx.HTTPError as e:
+            raise ValueError("Error fetching data from Genius API") from e
+
+    @staticmethod
+    def add_song_details(songs, albums):
+        tracks = []
+        for song in songs:
+            song['album'] = albums.get(song.get('id'), PENDING)
+            release_date_components = song.get('release_date_components', {})
+            song['year_release_date'] = release_date_components.get('year') if release_date_components else 'N/A'
+
+            tracks.append(song)
+        return tracks
+
+    def get_song_albums(self, song_ids, headers, fast=False):
+        """
+        Get the album of the given songs, using the cache first and concurrent song detail requests for the rest.
+        In fast mode the missing songs are fetched in the background and left out of the result
+        """
+        albums, missing_ids = self.cached_song_albums(song_ids)
+        if fast:
+            self.fetch_song_albums_in_background(missing_ids, headers)
+            return albums
+
+        futures = [submit_in_context(genius_detail_executor, self.fetch_song_album, song_id, headers)
+                   for song_id in missing_ids]
+        for song_id, future in zip(missing_ids, futures):
+            albums[song_id] = future.result()  # Raises the request exception of the song detail, if any
+        return albums
+
+    async def aget_song_albums(self, client, song_ids, headers, fast=False):
+        albums, missing_ids = await sync_to_async(self.cached_song_albums, thread_sensitive=False)(song_ids)
+        if fast:
+            # The background fetches run on the same executor as the synchronous requests
+            self.fetch_song_albums_in_background(missing_ids, headers)
+            return albums
+
+        # Caps the song detail requests of this search in flight at the same time
+        semaphore = asyncio.Semaphore(settings.SONGSEARCH_GENIUS_DETAIL_WORKERS)
+
+        async def afetch_song_album(song_id):
+            async with semaphore:
+                response = await self.aget(client, f'{self.songs_url}/{song_id}', headers=headers)
+            response.raise_for_status()  # Raise an exception if the request was unsuccessful
+            album_name = self.parse_song_album(response.json())
+            await sync_to_async(self.cache_song_album, thread_sensitive=False)(song_id, album_name)
+            return album_name
+
+        fetched_albums = await asyncio.gather(*[afetch_song_album(song_id) for song_id in missing_ids])
+        albums.update(zip(missing_ids, fetched_albums))
+        return albums
+
+    @staticmethod
+    def cached_song_albums(song_ids):
+        """
+        Return the cached albums of the given songs and the ids of the songs that are not cached
+        """
+        cache_keys = {f'genius_song_album:{song_id}': song_id for song_id in song_ids}
+        cached_albums = cache.get_many(list(cache_keys))
+        albums = {cache_keys[key]: album for key, album in cached_albums.items()}
+
+        missing_ids = [song_id for song_id in dict.fromkeys(song_ids) if song_id not in albums]
+        return albums, missing_ids
+
+    def fetch_song_album(self, song_id, headers):
+        """
+        Fetch the album name of a song from the song details and cache it
+        """
+        response = self.get(f'{self.songs_url}/{song_id}', headers=headers)
+        response.raise_for_status()  # Raise an exception if the request was unsuccessful
+
+        album_name = self.parse_song_album(response.json())
+        self.cache_song_album(song_id, album_name)
+        return album_name
+
+    @staticmethod
+    def parse_song_album(song_data):
+        song_detail = song_data.get('response', {}).get('song', {})
+        album = song_detail.get('album', {})
+        return album.get('name', '') if album else 'N/A'
+
+    @staticmethod
+    def cache_song_album(song_id, album_name):
+        cache.set(f'genius_song_album:{song_id}', album_name, timeout=settings.SONGSEARCH_GENIUS_SONG_TIMEOUT)
+
+    def fetch_song_albums_in_background(self, song_ids, headers):
+        for song_id in song_ids:
+            with genius_pending_lock:
+                if song_id in genius_pending_ids:
+                    continue  # Already being fetched by another request
+                genius_pending_ids.add(song_id)
+            submit_in_context(genius_detail_executor, self.fetch_song_album_in_background, song_id, headers)
+
+    def fetch_song_album_in_background(self, song_id, headers):
+        try:
+            self.fetch_song_album(song_id, headers)
+        except (requests.exceptions.RequestException, RateLimited):
+            pass  # The song is fetched again by the next request that needs it
+        finally:
+            with genius_pending_lock:
+                genius_pending_ids.discard(song_id)
+
 
     def get_song_details(self, data):
         song_details = []
@@ -217,15 +659,15 @@ class Genius(Provider):
             artists = [track.get('primary_artist', {}).get('name', '')]
             year_release_date = track.get('year_release_date', '')
             try:
-                # Extract relevant details from the song_detail response and create a Song object
-                song = Song(
+                # Extract relevant details from the song_detail response and create a SongResult
+                song = SongResult(
                     name=track.get('title', ''),
                     provider_song_id=track.get('id', ''),
                     album=track.get('album', ''),
                     artist=', '.join(artists),
                     album_cover=track.get('song_art_image_url', ''),
                     year_release_date=year_release_date,
-                    genres='N/A', #Genius does not provide Genres
+                    genres=GENIUS_GENRES,
                     duration='N/A', #Genius does not provide Duration
                     origin='Genius',
                 )
@@ -237,67 +679,486 @@ class Genius(Provider):
         return song_details
 
 
+# Shared by all requests so the number of provider calls in flight stays bounded
+provider_executor = ThreadPoolExecutor(max_workers=settings.SONGSEARCH_MAX_WORKERS, thread_name_prefix='provider')
+
+
+# Created once so their sessions and connection pools are reused by every request
+PROVIDERS = [Spotify(), Itunes(), Genius()]
+
+
+def provider_cache_key(provider, search_term, filters=NO_FILTERS):
+    # The songs fetched with filters only answer the same filters
+    search = f'{search_term}|{filters.album}|{filters.genre}|{filters.year}' if filters else search_term
+    term_hash = hashlib.md5(search.encode('utf-8')).hexdigest()
+    return f'provider_songs:{provider.name}:{term_hash}'
+
+
+def cache_songs(cache_key, songs: SongResults):
+    timeout = fresh_timeout(songs)
+    stale_timeout = settings.SONGSEARCH_SEARCH_CACHE_STALE_TIMEOUT
+    search_cache.set(cache_key, songs, timeout=timeout, stale_timeout=stale_timeout)
+    search_cache.set(validator_key(cache_key), ResultsValidator.of(songs), timeout=timeout, stale_timeout=stale_timeout)
+    return songs
+
+
+def fresh_timeout(songs: SongResults):
+    """
+    Seconds the songs stay fresh in the cache. The songs just fetched from a provider are fresh for
+    SONGSEARCH_SEARCH_CACHE_TIMEOUT seconds, the catalog songs only until then since they were fetched
+    """
+    now = time.time()
+    if not songs.fresh_until:
+        songs.fresh_until = now + settings.SONGSEARCH_SEARCH_CACHE_TIMEOUT
+    return max(songs.fresh_until - now, 0)
+
+
+def fetch_songs(provider, search_term, fast=False, priority=INTERACTIVE, filters=NO_FILTERS, max_age=None):
+    """
+    Get the serialized songs of a provider from the local catalog, or fetch them from the provider and store them,
+    and cache them for the next requests. With filters, the catalog songs of the search term are used when they are
+    complete, otherwise the provider only returns songs for the filters, which are cached for them and not stored.
+    max_age overrides SONGSEARCH_CATALOG_MAX_AGE. Background fetches refresh stale songs, so they only take the
+    catalog songs that are still fresh, stored by another worker meanwhile
+    """
+    request_priority.set(priority)
+    if priority == BACKGROUND:
+        request_metrics.set(None)  # Not part of the request that started the refresh
+        if max_age is None:
+            max_age = min(settings.SONGSEARCH_SEARCH_CACHE_TIMEOUT, settings.SONGSEARCH_CATALOG_MAX_AGE)
+    cache_key = provider_cache_key(provider, search_term)
+    songs = catalog.find_songs(provider.name, search_term, max_age)
+    if songs is not None and not answers_filters(songs, filters):
+        songs = None
+    record_cache_lookup('catalog', 'miss' if songs is None else 'hit')
+    if songs is None:
+        provider.health.check()  # Fails right away while the provider is failing repeatedly
+        with provider.timer('fetch'):
+            data = provider.get_data(search_term, fast=fast, filters=filters)
+            songs = serialize_songs(provider, data)
+        if has_pending_songs(songs):
+            # Songs with a pending album are not stored so the next requests pick up the album once it is known
+            return songs
+        songs = SongResults(songs, complete=is_complete(data, filters))
+        if filters:
+            cache_key = provider_cache_key(provider, search_term, filters)
+        else:
+            catalog.store_songs(provider.name, search_term, songs, songs.complete)
+
+    return cache_songs(cache_key, songs)
+
+
+def is_complete(data, filters) -> bool:
+    """
+    Whether the data a provider returned for a search term are every song it has for the term, as it returned fewer
+    than the PAGE_SIZE songs asked for. Filtered searches only get the songs for their filters
+    """
+    return not filters and len(data) < PAGE_SIZE
+
+
+def serialize_songs(provider, data):
+    return provider.get_song_details(data)
+
+
+def has_pending_songs(songs):
+    return any(song.album == PENDING for song in songs)
+
+
+# Outcome of each provider in a search
+FOUND = 'found'
+FAILED = 'failed'
+TIMED_OUT = 'timed_out'
+
+
+def cached_provider_songs(provider, search_term, filters=NO_FILTERS):
+    """
+    Return the cached songs of a provider for a normalized search term, or None if they are not cached.
+    With filters, the songs fetched for them are looked up first, then the songs of the search term when they are
+    complete. Stale songs are returned while one background fetch refreshes them
+    """
+    for cache_filters in cache_lookup_filters(filters):
+        cache_key = provider_cache_key(provider, search_term, cache_filters)
+        cached = search_cache.get(cache_key)
+        if cached is not None and (cache_filters == filters or answers_filters(cached[0], filters)):
+            break
+    else:
+        record_cache_lookup('search', 'miss')
+        return None
+
+    cached_songs, fresh_until = cached
+    if fresh_until > time.time():
+        record_cache_lookup('search', 'hit')
+    else:
+        record_cache_lookup('search', 'stale')
+        # The refresh gives way to the searches when the provider quota runs low, the stale songs are served meanwhile
+        search_flight.submit(provider_executor, flight_key(cache_key, priority=BACKGROUND), fetch_songs, provider,
+                             search_term, False, BACKGROUND, cache_filters)
+    return cached_songs
+
+
+def cached_validators(search_term, filters=NO_FILTERS):
+    """
+    Return the validators of the fresh cached songs of every provider for a search, or None when some are not cached
+    or stale. The songs are looked up the same as cached_provider_songs does
+    """
+    validators = []
+    for provider in PROVIDERS:
+        for cache_filters in cache_lookup_filters(filters):
+            cached = search_cache.get(validator_key(provider_cache_key(provider, search_term, cache_filters)))
+            if cached is not None and (cache_filters == filters or answers_filters(cached[0], filters)):
+                break
+        else:
+            return None
+        validators.append(cached[0])
+    return validators
+
+
+def cache_lookup_filters(filters):
+    """
+    Filters of the cached songs that can answer a search, the songs fetched for its filters first
+    """
+    return (filters, NO_FILTERS) if filters else (NO_FILTERS,)
+
+
+def answers_filters(songs, filters) -> bool:
+    """
+    Whether the songs of a search term answer a search with filters from their facet index, which needs them to be
+    complete. Otherwise the provider might have other songs matching the filters, and is asked for them
+    """
+    return not filters or songs.complete
+
+
+def submit_fetch(provider, search_term, fast=False, filters=NO_FILTERS):
+    """
+    Start fetching the songs of a provider, or join the fetch already in flight for the same search
+    """
+    cache_key = provider_cache_key(provider, search_term, filters)
+    return search_flight.submit(provider_executor, flight_key(cache_key, fast), fetch_songs, provider, search_term,
+                                fast, INTERACTIVE, filters)
+
+
+def flight_key(cache_key, fast=False, priority=INTERACTIVE):
+    """
+    Key of the single fetch shared by the concurrent fetches of the same songs. Searches do not join background
+    fetches, which are rejected with RateLimited to leave the provider quota to the searches
+    """
+    if priority == BACKGROUND:
+        return f'{cache_key}:background'
+    return f'{cache_key}:fast' if fast else cache_key
+
+
+def iter_provider_songs(search_term, fast=False, filters=NO_FILTERS):
+    """
+    Yield the provider name, serialized songs and outcome of every provider for a normalized search term, as soon as
+    they are available: cached songs first, then the fetched ones in the order they finish until the deadline.
+    The songs still have to be filtered, the filters only let the providers return fewer songs that do not match
+    """
+    futures = {}
+    for provider in PROVIDERS:
+        cached_songs = cached_provider_songs(provider, search_term, filters)
+        if cached_songs is None:
+            # Concurrent requests missing the same results wait for a single fetch
+            futures[submit_fetch(provider, search_term, fast, filters)] = provider
+            continue
+        yield provider.name, cached_songs, FOUND
+
+    # The fetches are shared with other requests, so the ones missing the deadline keep running and fill the cache
+    pending_futures = set(futures)
+    try:
+        for future in as_completed(futures, timeout=settings.SONGSEARCH_SEARCH_DEADLINE):
+            pending_futures.discard(future)
+            try:
+                yield futures[future].name, future.result(), FOUND
+            except ValueError:
+                # Error occurred while fetching data from the provider, skip and continue with the next provider
+                yield futures[future].name, [], FAILED
+    except TimeoutError:
+        for provider in PROVIDERS:
+            if any(futures[future] is provider for future in pending_futures):
+                yield provider.name, [], TIMED_OUT
+
+
+def search_providers(search_term, fast=False, filters=NO_FILTERS):
+    """
+    Get the serialized songs of every provider for a normalized search term.
+    Returns the songs of each provider, to filter with filter_songs, and the providers that timed out
+    """
+    song_data = []
+    timed_out = []
+    for provider_name, songs, outcome in iter_provider_songs(search_term, fast, filters):
+        song_data.append(songs)
+        if outcome == TIMED_OUT:
+            timed_out.append(provider_name)
+    return song_data, timed_out
+
+
+def search_providers_batch(search_terms, fast=False):
+    """
+    Get the serialized songs of every provider for many normalized search terms, with at most
+    SONGSEARCH_BATCH_CONCURRENCY provider fetches of the batch in flight at the same time.
+    Returns the songs of each provider and the providers that timed out by search term. The searches of a term
+    share its songs, so the filters are not sent to the providers
+    """
+    song_data = {search_term: [] for search_term in search_terms}
+    timed_out = {search_term: [] for search_term in search_terms}
+    deadline = time.monotonic() + settings.SONGSEARCH_BATCH_DEADLINE
+    slots = threading.BoundedSemaphore(settings.SONGSEARCH_BATCH_CONCURRENCY)
+    futures = {}
+    for search_term in song_data:
+        for provider in PROVIDERS:
+            cached_songs = cached_provider_songs(provider, search_term)
+            if cached_songs is not None:
+                song_data[search_term].append(cached_songs)
+            elif slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+                future = submit_fetch(provider, search_term, fast)
+                future.add_done_callback(lambda _: slots.release())
+                futures[future] = futures.get(future, []) + [(search_term, provider)]
+            else:
+                timed_out[search_term].append(provider.name)
+
+    done, not_done = wait(futures, timeout=max(deadline - time.monotonic(), 0))
+    for future, searches in futures.items():
+        for search_term, provider in searches:
+            if future in not_done:
+                timed_out[search_term].append(provider.name)
+                continue
+            try:
+                song_data[search_term].append(future.result())
+            except ValueError:
+                # Error occurred while fetching data from the provider, skip and continue with the next provider
+                pass
+    return song_data, timed_out
+
+
+def filter_songs(song_data, filters=NO_FILTERS):
+    """
+    Filter the serialized songs of each provider by album, genre and year if provided and sort them all by name
+    and artist
+    """
+    return sort_songs([song for songs in song_data for song in filter_results(songs, filters)])
+
+
+def sort_songs(song_data):
+    return sorted(song_data, key=lambda song: (song.name, song.artist))
+
+
+def sort_merged_songs(merged_songs):
+    return sorted(merged_songs, key=lambda song: (song['name'], song['artist']))
+
+
+# Suggestions returned by default and at most
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+
+
+def query_flag(request, name):
+    return request.GET.get(name, '').lower() in ('1', 'true')
+
+
 class SongViewSet(viewsets.ViewSet):
+    renderer_classes = [SongJSONRenderer, BrowsableAPIRenderer]
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]  # Ensures that only authenticated requests are allowed
 
+    def perform_authentication(self, request):
+        with timer('auth'):
+            super().perform_authentication(request)
+
     @swagger_auto_schema(
         manual_parameters=[
             openapi.Parameter('search_term', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Search term'),
             openapi.Parameter('album', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Album filter (optional)', required=False),
             openapi.Parameter('genre', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Genre filter (optional)', required=False),
+            openapi.Parameter('year', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Release year filter (optional)', required=False),
+            openapi.Parameter('fast', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN, description='Return Genius songs without waiting for their album, marked as pending (optional)', required=False),
+            openapi.Parameter('merge', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN, description='Return one record per song found in several providers (optional)', required=False),
             openapi.Parameter('Authorization', openapi.IN_HEADER, type=openapi.TYPE_STRING, description='Bearer {token}', format='Bearer')
         ],
-        responses={200: 'OK', 401: 'Unauthorized'}
+        responses={200: 'OK (X-Providers-Timed-Out lists the providers that missed the deadline)', 304: 'Not Modified (If-None-Match has the ETag of the songs)', 401: 'Unauthorized'}
     )
 
     def list(self, request):
-        search_term = request.GET.get('search_term')
-        album_filter = request.GET.get('album')
-        genre_filter = request.GET.get('genre')
+        params = search_params(request)
+        if params is None:
+            return Response({'error': 'Search term is required'}, status=status.HTTP_400_BAD_REQUEST)
+        search_term, filters = params
+        search_stats.record(search_term, filters)
+        merge = query_flag(request, 'merge')
+        variant = (request.accepted_renderer.format, *filters, merge)
+        if 'HTTP_IF_NONE_MATCH' in request.META:
+            # Repeated requests for unchanged songs are answered without loading them
+            validators = cached_validators(search_term, filters)
+            etag = results_etag(validators, *variant) if validators is not None else None
+            response = not_modified(request, etag)
+            if response is not None:
+                return add_cache_headers(response, etag, validators)
+
+        with timer('providers'):
+            song_data, timed_out = search_providers(search_term, query_flag(request, 'fast'), filters)
+        # Also before filtering and serializing them, for the songs cached without their validators
+        etag = results_etag(song_data, *variant)
+        response = not_modified(request, etag)
+        if response is not None:
+            return add_cache_headers(response, etag, song_data)
 
-        if not search_term:
+        with timer('filter'):
+            serialized_data = filter_songs(song_data, filters)
+        suggestion_index.add_songs(serialized_data)
+        if merge:
+            with timer('merge'):
+                serialized_data = sort_merged_songs(merge_songs(serialized_data))
+        headers = {'X-Providers-Timed-Out': ', '.join(timed_out)} if timed_out else None
+        # Incomplete responses have no ETag and are not reused
+        return add_cache_headers(Response(serialized_data, headers=headers), etag, song_data)
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('search_term', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Search term'),
+            openapi.Parameter('album', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Album filter (optional)', required=False),
+            openapi.Parameter('genre', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Genre filter (optional)', required=False),
+            openapi.Parameter('year', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Release year filter (optional)', required=False),
+            openapi.Parameter('fast', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN, description='Return Genius songs without waiting for their album, marked as pending (optional)', required=False),
+            openapi.Parameter('Authorization', openapi.IN_HEADER, type=openapi.TYPE_STRING, description='Bearer {token}', format='Bearer')
+        ],
+        responses={200: 'A "songs" event per provider as soon as it finishes, then a "summary" event with the providers that failed or timed out and the Server-Timing of the search', 401: 'Unauthorized'}
+    )
+    @action(detail=False, renderer_classes=[NDJSONRenderer, EventStreamRenderer])
+    def stream(self, request):
+        """
+        Stream the songs of each provider as soon as it finishes, as NDJSON or as server-sent events
+        (Accept: text/event-stream). The songs are sorted per provider and can not be merged
+        """
+        params = search_params(request)
+        if params is None:
             return Response({'error': 'Search term is required'}, status=status.HTTP_400_BAD_REQUEST)
+        search_term, filters = params
+        search_stats.record(search_term, filters)
+        renderer = request.accepted_renderer
+        fast = query_flag(request, 'fast')
+        metrics = request_metrics.get()
 
-       # Generate a unique cache key
-        cache_key_parts = ['song_data', search_term]
-        if album_filter:
-            album_filter = re.sub(r'[^a-zA-Z0-9_\s]', '', album_filter) # Remove special characters except spaces
-            album_filter = album_filter.strip()
-            cache_key_parts.append(album_filter)
-        if genre_filter:
-            genre_filter =  re.sub(r'[^a-zA-Z0-9_\s]', '', genre_filter)
-            genre_filter = genre_filter.strip()
-            cache_key_parts.append(genre_filter)
-        cache_key = hashlib.md5(':'.join(cache_key_parts).encode('utf-8')).hexdigest()
-
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            return Response(cached_data)
-
-        providers = [Spotify(), Itunes(), Genius()]
-        song_data = []
-        for provider in providers:
-            try:
-                data = provider.get_data(search_term)
-                if provider.name == 'Spotify' or provider.name == 'Genius' or provider.name == 'iTunes':
-                    data = provider.get_song_details(data)
-                song_data.extend(data)
-            except ValueError:
-                # Error occurred while fetching data from the provider, skip and continue with the next provider
-                pass
-        # Filter song_data by album and genre if provided
-        if album_filter:
-            song_data = [song for song in song_data if song.album == album_filter]
-        if genre_filter:
-            song_data = [song for song in song_data if genre_filter.lower() in song.genres.lower()]
+        def events():
+            failed = []
+            timed_out = []
+            with timer('stream'):
+                for provider_name, songs, outcome in iter_provider_songs(search_term, fast, filters):
+                    if outcome == FAILED:
+                        failed.append(provider_name)
+                    elif outcome == TIMED_OUT:
+                        timed_out.append(provider_name)
+                    else:
+                        songs = filter_songs([songs], filters)
+                        suggestion_index.add_songs(songs)
+                        yield renderer.encode_event('songs', {'provider': provider_name, 'songs': songs})
+            summary = {'errors': failed, 'timed_out': timed_out}
+            if metrics is not None:
+                # The Server-Timing header is sent before the songs, so the summary has the timings of the search
+                summary['server_timing'] = metrics.server_timing()
+            yield renderer.encode_event('summary', summary)
+
+        # The songs are searched while the response is streamed, after the middleware that collects the metrics
+        response = StreamingHttpResponse(iterate_for_request(events(), metrics), content_type=renderer.media_type)
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Stops proxies such as nginx from buffering the events
+        return response
+
+
+    @swagger_auto_schema(
+        request_body=BatchSearchSerializer,
+        manual_parameters=[
+            openapi.Parameter('fast', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN, description='Return Genius songs without waiting for their album, marked as pending (optional)', required=False),
+            openapi.Parameter('merge', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN, description='Return one record per song found in several providers (optional)', required=False),
+            openapi.Parameter('Authorization', openapi.IN_HEADER, type=openapi.TYPE_STRING, description='Bearer {token}', format='Bearer')
+        ],
+        responses={200: 'The songs of each search term in "results", the providers that timed out for it in "timed_out", and the 400 status and validation errors of each bad search by its position in "errors"', 400: 'Bad Request', 401: 'Unauthorized'}
+    )
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Search many terms in one call. Equivalent terms are searched once and share the cache of the list endpoint.
+        Bad searches get their errors without failing the others
+        """
+        serializer = BatchSearchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        searches, errors = validate_searches(serializer.validated_data['searches'])
+        merge = query_flag(request, 'merge')
+
+        search_terms = {search['search_term']: Provider.normalize_search_term(search['search_term']) for search in searches}
+        with timer('providers'):
+            song_data, timed_out = search_providers_batch(set(search_terms.values()), query_flag(request, 'fast'))
+
+        results = {}
+        batch_timed_out = {}
+        for search in searches:
+            search_term = search_terms[search['search_term']]
+            filters = SongFilters(*(Provider.clean_search_term(search.get(name, '')) for name in SongFilters._fields))
+            search_stats.record(search_term, filters)
+            serialized_data = filter_songs(song_data[search_term], filters)
+            suggestion_index.add_songs(serialized_data)
+            if merge:
+                serialized_data = sort_merged_songs(merge_songs(serialized_data))
+            results[search['search_term']] = serialized_data
+            if timed_out[search_term]:
+                batch_timed_out[search['search_term']] = timed_out[search_term]
+
+        batch_errors = {position: {'status': status.HTTP_400_BAD_REQUEST, 'errors': search_errors}
+                        for position, search_errors in errors.items()}
+        return Response({'results': results, 'timed_out': batch_timed_out, 'errors': batch_errors})
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('q', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Start of a song name or artist'),
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description=f'Number of suggestions, {SUGGEST_LIMIT} by default and {SUGGEST_MAX_LIMIT} at most (optional)', required=False),
+            openapi.Parameter('Authorization', openapi.IN_HEADER, type=openapi.TYPE_STRING, description='Bearer {token}', format='Bearer')
+        ],
+        responses={200: 'Suggestions with "text" and "type" (song or artist), and the "artist" of the songs', 400: 'Bad Request', 401: 'Unauthorized'}
+    )
+    @action(detail=False, url_path='suggest', url_name='suggest')
+    def suggestions(self, request):
+        """
+        Song names and artists with a word starting with q, most returned by the searches first. Answered from an
+        index in the process, the providers are never called, so it can be requested on every keystroke
+        """
+        try:
+            limit = min(int(request.GET.get('limit', SUGGEST_LIMIT)), SUGGEST_MAX_LIMIT)
+        except ValueError:
+            return Response({'error': 'The limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        with timer('suggest'):
+            suggestions = suggest(request.GET.get('q', ''), max(limit, 0))
+        return Response(suggestions)
+
+
+def search_params(request):
+    """
+    Return the normalized search term and the cleaned album, genre and year filters of the request,
+    or None when the search term is missing
+    """
+    search_term = request.GET.get('search_term')
+    if not search_term:
+        return None
+
+    # Results are cached per provider and normalized term, the filters are applied on top of them
+    search_term = Provider.normalize_search_term(search_term)
+    filters = SongFilters(*(Provider.clean_search_term(request.GET.get(name, '')) for name in SongFilters._fields))
+    return search_term, filters
 
-        # Sort song_data by name and artist
-        song_data = sorted(song_data, key=lambda song: (song.name, song.artist))
 
-        serialized_data = SongSerializer(song_data, many=True).data
-        # Cache the data for future requests
-        cache.set(cache_key, serialized_data, timeout=60 * 60 * 6)  # Cache for 6 hours
+def metrics(request):
+    """
+    Metrics of the process in the Prometheus text format, only for the allowed clients
+    """
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    record_cache_stats()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-        return Response(serialized_data)
 
+def metrics_allowed(request) -> bool:
+    """
+    Whether the request comes from SONGSEARCH_METRICS_ALLOWED_IPS or has the bearer token SONGSEARCH_METRICS_TOKEN
+    """
+    if request.META.get('REMOTE_ADDR') in settings.SONGSEARCH_METRICS_ALLOWED_IPS:
+        return True
+    token = settings.SONGSEARCH_METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(token) and hmac.compare_digest(authorization.encode('utf-8'), f'Bearer {token}'.encode('utf-8'))